@@ -0,0 +1,42 @@
+"""
+Restores the `numpy.ndarray` objects tokenized by the `merky.tree.ndarray_handler`.
+"""
+import ast
+
+import six
+
+from .. import digest
+
+
+def _resolve(value, reader):
+    """
+    Returns `value`, or the structure it refers to if it is a token (a hex string, or a
+    `merky.digest.Token` from a transform with `binary_tokens`).
+    """
+    if isinstance(value, six.string_types + (digest.Token,)):
+        return reader(value)
+    return value
+
+
+def from_token(token, reader):
+    """
+    Produces a `numpy.ndarray` from the given `token` and `reader`.
+
+    Parameters:
+        `reader`:  a callable that, when given a "token" of a structure, returns
+                   the corresponding structure (from a store, for instance).
+        `token`:   the token of the array's structure, as yielded by a transform.
+
+    The array is rebuilt from a copy of its bytes, whether or not it was chunked
+    (see `merky.util.chunked`), and so is writable.
+    """
+    import numpy
+    structure = reader(token)
+    dtype = structure["dtype"]
+    if dtype.startswith("["):
+        dtype = ast.literal_eval(dtype)
+    data = _resolve(structure["data"], reader)
+    if isinstance(data, list):
+        data = b''.join(bytes(reader(t)) for t in data)
+    shape = _resolve(structure["shape"], reader)
+    return numpy.frombuffer(bytes(data), dtype=numpy.dtype(dtype)).reshape(shape).copy()
@@ -1,5 +1,6 @@
 import itertools
 import six
+from merky import chunking
 from merky import util
 
 
@@ -111,7 +112,9 @@ class AttributeGraph(object):
 
     @classmethod
     def attrs_from_token_list(cls, t_list, reader):
-        return reader(t_list[0])
+        attrs = reader(t_list[0])
+        return type(attrs)((k, chunking.restore_text(v, reader))
+                           for k, v in six.iteritems(attrs))
 
 
     @classmethod
@@ -137,7 +140,8 @@ class AttributeGraph(object):
 
         If the structure has a non-empty members dictionary structure, each
         member (the values of the dictionary) will be recursively expanded
-        using this same method.
+        using this same method.  Attributes that are strings chunked by the
+        `chunk_strings` option of the transformer are reassembled.
 
         Returns an `AttributeGraph` with attributes and members fully realized.
         """
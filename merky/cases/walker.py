@@ -1,3 +1,6 @@
+from merky import chunking
+
+
 class Walker(object):
     """
     Explore merky tokenized structures.
@@ -40,6 +43,11 @@ class Walker(object):
     is a token, meaning that the `Walker` will get that token and return a new `Walker` instance
     bound to the structure to which that token refers (looked up via the `read` function in this
     case).
+
+    Sequences and strings chunked by the `chunk_sequences` and `chunk_strings` options of a
+    `merky.Transformer` are reached as a `Walker` of their manifest (through the reference
+    that stands for a chunked string), whose `iter_members` and `iter_text` read the chunks
+    only as they are needed.
     """
     __slots__ = ('reader', 'token', 'structure')
 
@@ -54,6 +62,29 @@ class Walker(object):
 
     
     def node(self, key):
-        return type(self)(self.reader, key)
+        return type(self)(self.reader, chunking.referenced_text(key) or key)
+
+
+    def iter_members(self):
+        """
+        Iterates over the members of the sequence `structure`, reading the chunks of a
+        chunked sequence (see `merky.chunking`) only as they are reached.
+        """
+        return chunking.iter_sequence(self.structure, self.reader)
+
+
+    def iter_text(self):
+        """
+        Iterates over the chunks of the chunked string whose manifest is `structure`,
+        reading each only as it is reached.
+        """
+        return chunking.iter_text(self.structure, self.reader)
+
+
+    def text(self):
+        """
+        Returns the whole of the chunked string whose manifest is `structure`.
+        """
+        return u''.join(self.iter_text())
 
 
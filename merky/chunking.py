@@ -0,0 +1,316 @@
+"""
+Content-defined chunking of long sequences and strings.
+
+A long list tokenized as a single node changes token, and must be serialized and
+stored anew, whenever any member changes.  A `sequence_splitter` instead splits
+such a list into chunks at boundaries chosen by the hashes of the members
+themselves, so that a boundary depends only on the member before it.  An
+insertion or deletion then changes only the chunk it falls in, while the chunks
+around it keep their tokens, and stores dedupe them.
+
+The tokens of the chunks are chunked in turn, level by level, until few enough
+remain to list in a small manifest node that stands for the whole sequence:
+
+    OrderedDict([('__merky_chunks__', 'list'),
+                 ('chunks', [top-level chunk tokens]),
+                 ('depth', number of levels),
+                 ('length', number of members)])
+
+Each chunk is a plain list: of members at the first level, and of the tokens of
+chunks of the level below at the others.  A localized edit thus touches one chunk
+per level, and the manifest.
+
+Long strings are likewise split by a `string_dispatcher`, at line (or, within long
+lines, word) breaks chosen by the hashes of the text before them, into chunks that
+are tokenized as strings of their own; their manifest is marked "text" and always
+has a depth of 1.  Where the string appeared, its container holds a reference to the
+manifest: its token behind the `TEXT_PREFIX`, so that a chunked string is told apart
+from a string that merely looks like a token.
+"""
+import collections
+import re
+import zlib
+
+import six
+
+from . import digest
+from . import tree
+from . import util
+
+MARKER = '__merky_chunks__'
+TEXT_PREFIX = u'__merky_text__:'
+
+_MASK = 0xffffffff
+
+
+def _member_hash(member, serializer):
+    """
+    Returns the CRC-32 of `member`: of its UTF-8 if it is a string, of its hex if it is a
+    `merky.digest.Token` (so that binary tokens give the same boundaries as hex tokens),
+    or else of its serialization.
+    """
+    if isinstance(member, digest.Token):
+        member = member.hex()
+    if isinstance(member, six.text_type):
+        member = member.encode('utf-8')
+    elif not isinstance(member, str):
+        member = digest.encoded(serializer(member))
+    return zlib.crc32(member) & _MASK
+
+
+def boundaries(members, serializer, average, minimum, maximum):
+    """
+    Yields the indices at which to split `members` into chunks.
+
+    A chunk ends after a member whose hash (the CRC-32 of its serialization with
+    `serializer`, or of its UTF-8 if it is a string) hits one value in
+    `average - minimum`, provided the chunk has at least `minimum` members, so that
+    chunks have about `average` members; a chunk also ends once it has `maximum`
+    members.  The final index is `len(members)`.
+    """
+    divisor = average - minimum
+    hit = divisor - 1
+    crc32 = zlib.crc32
+    text = six.text_type
+    hashes = [crc32(m.encode('utf-8')) & _MASK if type(m) is text else
+              _member_hash(m, serializer) for m in members]
+    candidates = [i for i, h in enumerate(hashes, 1) if h % divisor == hit]
+    start = 0
+    for end in candidates + [len(members)]:
+        while end - start > maximum:
+            start += maximum
+            yield start
+        # The final index is a candidate too if the last member hits.
+        if end > start and (end - start >= minimum or end == len(members)):
+            start = end
+            yield end
+
+
+def is_chunked(structure, kind=None):
+    """
+    Returns whether the normal `structure` is the manifest of a chunked value of `kind`
+    ("list" or "text"), or of any kind if `kind` is `None`.
+    """
+    if not isinstance(structure, dict) or MARKER not in structure:
+        return False
+    return kind is None or structure[MARKER] == kind
+
+
+def manifest(kind, chunks, depth, length):
+    """
+    Returns the manifest node for a value of `kind` split into `chunks` over `depth` levels.
+    """
+    return collections.OrderedDict([(MARKER, kind),
+                                    ('chunks', chunks),
+                                    ('depth', depth),
+                                    ('length', length)])
+
+
+def sequence_splitter(tokenizer, serializer, average=64):
+    """
+    Returns a function that splits a normal list of more than `4 * average` members into
+    chunks of about `average` members, returning the `(token, structure)` pairs of the
+    chunks, level by level, with that of the manifest last.  It returns `None` for a
+    shorter list, which is tokenized as usual.
+
+    The `tokenizer` gives the tokens of the chunks and manifest, and the `serializer`
+    the bytes hashed to choose boundaries for members other than strings.
+    """
+    if average < 2:
+        raise ValueError("average must be at least 2")
+    minimum = max(1, average // 4)
+    maximum = average * 4
+
+    def inner(members):
+        if len(members) <= maximum:
+            return None
+        pairs = []
+        level = members
+        depth = 0
+        while depth == 0 or len(level) > maximum:
+            tokens = []
+            start = 0
+            for end in boundaries(level, serializer, average, minimum, maximum):
+                chunk = level[start:end]
+                token = tokenizer(chunk)
+                pairs.append((token, chunk))
+                tokens.append(token)
+                start = end
+            level = tokens
+            depth += 1
+        structure = manifest('list', level, depth, len(members))
+        pairs.append((tokenizer(structure), structure))
+        return pairs
+    return inner
+
+
+def iter_sequence(structure, reader):
+    """
+    Yields the members of the sequence whose normal `structure` is given, reading
+    chunks with `reader` only as they are reached if it is a chunked manifest.
+    """
+    if not is_chunked(structure, 'list'):
+        for member in structure:
+            yield member
+        return
+    stack = [(iter(structure['chunks']), structure['depth'])]
+    while stack:
+        for token in stack[-1][0]:
+            depth = stack[-1][1]
+            chunk = reader(token)
+            if depth == 1:
+                for member in chunk:
+                    yield member
+            else:
+                stack.append((iter(chunk), depth - 1))
+                break
+        else:
+            stack.pop()
+
+
+_WORDS = re.compile(r'\S+\s*|\s+')
+
+
+def _pieces(text, maximum):
+    """
+    Yields the lines of `text`, splitting lines longer than `maximum` into words, and
+    words longer than `maximum` into slices of that length.
+    """
+    for line in text.splitlines(True):
+        if len(line) <= maximum:
+            yield line
+            continue
+        for word in _WORDS.findall(line):
+            for i in range(0, len(word), maximum):
+                yield word[i:i + maximum]
+
+
+def text_boundaries(text, average):
+    """
+    Yields the indices at which to split `text` into chunks of about `average` characters.
+
+    A chunk ends after a line (or a word, within lines of more than `4 * average`
+    characters) whose CRC-32 modulo `average` is less than its length, so that about
+    one boundary falls in every `average` characters, provided the chunk has at least
+    `average // 4` characters; a chunk also ends before it would exceed `4 * average`
+    characters.  The final index is `len(text)`.
+    """
+    minimum = average // 4
+    maximum = average * 4
+    crc32 = zlib.crc32
+    start = end = 0
+    for piece in _pieces(text, maximum):
+        if end + len(piece) - start > maximum and end > start:
+            yield end
+            start = end
+        end += len(piece)
+        if (end - start >= minimum and
+                (crc32(piece.encode('utf-8')) & _MASK) % average < len(piece)):
+            yield end
+            start = end
+    if end > start:
+        yield end
+
+
+class _TextChunk(object):
+    """
+    A chunk of a long string, which `string_dispatcher` tokenizes as a string of its own.
+    """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __reduce__(self):
+        return (type(self), (self.text,))
+
+    def collect(self, _):
+        return self.text
+
+
+class _TextManifest(object):
+    """
+    The chunks of a long string, which `string_dispatcher` tokenizes as their manifest.
+    """
+    __slots__ = ('chunks', 'length')
+
+    def __init__(self, chunks, length):
+        self.chunks = chunks
+        self.length = length
+
+    def collect(self, tokens):
+        return manifest('text', tokens, 1, self.length)
+
+
+def text_reference(token):
+    """
+    Returns the reference to the manifest of token `token` that stands for a chunked string.
+    """
+    return TEXT_PREFIX + (token.hex() if isinstance(token, digest.Token) else token)
+
+
+def referenced_text(value):
+    """
+    Returns the token of the manifest that `value` refers to if it is the reference to a
+    chunked string (see `text_reference`), or else `None`.
+    """
+    if isinstance(value, six.string_types) and value.startswith(TEXT_PREFIX):
+        return value[len(TEXT_PREFIX):]
+    return None
+
+
+def _collect_reference(tokens):
+    return text_reference(tokens[0])
+
+
+def string_dispatcher(dispatcher, average=16384):
+    """
+    Returns a dispatcher that handles plain strings of more than `4 * average` characters,
+    whether or not wrapped by `merky.util.annotate`, by splitting them at the
+    `text_boundaries`, tokenizing each chunk, and tokenizing the "text" manifest of their
+    tokens, whose `text_reference` stands for the string; everything else goes to
+    `dispatcher`.
+    """
+    if average < 2:
+        raise ValueError("average must be at least 2")
+    maximum = average * 4
+
+    def inner(item):
+        cls = type(item)
+        if cls is _TextChunk:
+            return iter(()), item.collect, tree.ALWAYS
+        if cls is _TextManifest:
+            return iter(item.chunks), item.collect, tree.ALWAYS
+        text = item.__merky_annotated__ if cls is util.annotate else item
+        if type(text) is six.text_type and len(text) > maximum:
+            ends = list(text_boundaries(text, average))
+            chunks = [_TextChunk(text[start:end]) for start, end in zip([0] + ends, ends)]
+            return iter((_TextManifest(chunks, len(text)),)), _collect_reference, False
+        return dispatcher(item)
+    return inner
+
+
+def iter_text(structure, reader):
+    """
+    Yields the chunks of the string whose normal `structure` (a reference to a chunked
+    string, or its manifest) is given, reading each with `reader` only as it is reached, or
+    else the string itself.
+    """
+    token = referenced_text(structure)
+    if token is not None:
+        structure = reader(token)
+    if not is_chunked(structure, 'text'):
+        yield structure
+        return
+    for token in structure['chunks']:
+        yield reader(token)
+
+
+def restore_text(value, reader):
+    """
+    Returns `value`, or the whole string it stands for if it is the reference to a chunked
+    string, reading the chunks with `reader`.  Any other value is returned as is.
+    """
+    if referenced_text(value) is None:
+        return value
+    return u''.join(iter_text(value, reader))
@@ -1,11 +1,232 @@
+import binascii
+import functools
 import hashlib
+import itertools
 
-def hexdigest(encodable):
-    return hashlib.sha1(encodable.encode("utf-8")).hexdigest()
+import six
 
+DEFAULT_ALGORITHM = 'sha1'
 
-def hexdigester(serializer):
+ALGORITHMS = {}
+SIZED_ALGORITHMS = {}
+
+def register(name, factory, sized=False):
+    """
+    Registers a hash algorithm under `name`.
+
+    The `factory` is called with the initial data to hash (as `hashlib.sha1` is) and
+    must return an object with the `hashlib` interface.  If `sized` is true, the
+    factory must also accept a `digest_size` (in bytes), and the algorithm can be
+    requested with a digest size in bits, as in "blake2b-256".
+    """
+    if sized:
+        SIZED_ALGORITHMS[name] = factory
+    ALGORITHMS[name] = factory
+
+
+def get_algorithm(name):
+    """
+    Returns the hash factory for the algorithm `name`.
+
+    Raises a `ValueError` for an unknown algorithm or unsupported digest size.
+    """
+    try:
+        return ALGORITHMS[name]
+    except KeyError:
+        pass
+    base, _, bits = name.rpartition('-')
+    if base in SIZED_ALGORITHMS and bits.isdigit() and int(bits) % 8 == 0:
+        factory = functools.partial(SIZED_ALGORITHMS[base], digest_size=int(bits) // 8)
+        try:
+            factory(b'')
+        except ValueError:
+            pass
+        else:
+            return factory
+    raise ValueError("Unsupported hash algorithm: %s" % name)
+
+
+register('sha1', hashlib.sha1)
+register('sha256', hashlib.sha256)
+if hasattr(hashlib, 'blake2b'):
+    register('blake2b', hashlib.blake2b, sized=True)
+    register('blake2s', hashlib.blake2s, sized=True)
+
+
+class Token(bytes):
+    """
+    A compact token: the raw bytes of a digest.
+
+    Hashing and equality are those of the bytes; the hex form familiar from
+    `hexdigest` is only rendered on demand, by `hex()` or `str()`.  When serialized
+    by `merky.serialization`, a `Token` is rendered as its hex string, so structures
+    containing tokens hash the same whichever representation they use.
+
+    Requires python 3, where `bytes` is distinct from `str`.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def fromhex(cls, string):
+        return cls(binascii.unhexlify(string))
+
+    def hex(self):
+        return binascii.hexlify(self).decode('ascii')
+
+    def __str__(self):
+        return self.hex()
+
+    def __repr__(self):
+        return "Token(%r)" % self.hex()
+
+
+def encoded(serialized):
+    """
+    Returns the bytes to hash for a `serialized` structure: text as UTF-8, and anything
+    else (`bytes` or another bytes-like object, such as a memoryview) as is.
+    """
+    if isinstance(serialized, six.text_type):
+        return serialized.encode("utf-8")
+    return serialized
+
+
+def hexdigest(encodable, algorithm=DEFAULT_ALGORITHM):
+    return get_algorithm(algorithm)(encoded(encodable)).hexdigest()
+
+
+def hexdigester(serializer, algorithm=DEFAULT_ALGORITHM):
+    hasher = get_algorithm(algorithm)
     def inner(structure):
-        return hexdigest(serializer(structure))
+        return hasher(encoded(serializer(structure))).hexdigest()
+    return inner
+
+
+def binary_digester(serializer, algorithm=DEFAULT_ALGORITHM):
+    """
+    Like `hexdigester`, but the function returned gives a `Token` rather than a hex string.
+    """
+    hasher = get_algorithm(algorithm)
+    def inner(structure):
+        return Token(hasher(encoded(serializer(structure))).digest())
+    return inner
+
+
+def fused_digester(chunker, algorithm=DEFAULT_ALGORITHM, binary=False, sink=None):
+    """
+    Returns a function giving the token of a structure as `hexdigester` would (or
+    `binary_digester`, if `binary` is true), but hashing each chunk from `chunker`
+    (text, as UTF-8, or bytes) as it comes, so that no more of the serialization is
+    held at once, as text or as bytes, than the chunker gives in one chunk.
+
+    If a `sink` is given, each encoded chunk is also passed to `sink.write(data)` as it
+    is hashed, and the token to `sink.commit(token)` once the structure is complete,
+    so that a store can take in the serialization without it being produced twice.
+    """
+    factory = get_algorithm(algorithm)
+    def inner(structure):
+        h = factory(b'')
+        for chunk in chunker(structure):
+            data = encoded(chunk)
+            h.update(data)
+            if sink is not None:
+                sink.write(data)
+        token = Token(h.digest()) if binary else h.hexdigest()
+        if sink is not None:
+            sink.commit(token)
+        return token
+    return inner
+
+
+def threshold_digester(chunker, threshold, algorithm=DEFAULT_ALGORITHM, binary=False, sink=None):
+    """
+    Returns a function giving the token of a structure as `fused_digester` would, but
+    only if its serialization (by `chunker`) comes to at least `threshold` bytes, and
+    otherwise `None`.  The chunks are held only until the threshold is reached, and
+    whatever follows is hashed as it comes; `sink` is as for `fused_digester`, and
+    receives nothing for a structure without a token.
+    """
+    factory = get_algorithm(algorithm)
+    def inner(structure):
+        chunks = iter(chunker(structure))
+        head = []
+        size = 0
+        for chunk in chunks:
+            data = encoded(chunk)
+            head.append(data)
+            size += len(data)
+            if size >= threshold:
+                break
+        else:
+            return None
+        h = factory(b'')
+        for data in itertools.chain(head, (encoded(chunk) for chunk in chunks)):
+            h.update(data)
+            if sink is not None:
+                sink.write(data)
+        token = Token(h.digest()) if binary else h.hexdigest()
+        if sink is not None:
+            sink.commit(token)
+        return token
+    return inner
+
+
+class SequenceDigest(object):
+    """
+    Incrementally computes the `hexdigest` of a serialized sequence, one member at a time.
+
+    Each member given to `append` is serialized on its own and fed to the hash,
+    framed so that the final digest matches that of the whole sequence serialized
+    at once.  The default framing is that of the compact JSON of `merky.serialization`;
+    `merky.serialization.CBOR_FRAMING` gives that of its CBOR.
+
+    If `retain` is false, the members are not kept, and `members` is `None`; memory
+    use is then constant no matter how long the sequence is.
+
+    The `token()` is the `hexdigest()`, or a `Token` if `binary` is true.
+    """
+    __slots__ = ('serializer', 'hash', 'members', 'separator', 'end', 'empty', 'binary')
+
+    def __init__(self, serializer, retain=True, algorithm=DEFAULT_ALGORITHM, binary=False,
+                 start=b'[', separator=b',', end=b']'):
+        self.serializer = serializer
+        self.hash = get_algorithm(algorithm)(start)
+        self.members = [] if retain else None
+        self.separator = separator
+        self.end = end
+        self.empty = True
+        self.binary = binary
+
+    def append(self, member):
+        if self.empty:
+            self.empty = False
+        else:
+            self.hash.update(self.separator)
+        self.hash.update(encoded(self.serializer(member)))
+        if self.members is not None:
+            self.members.append(member)
+
+    def _final(self):
+        h = self.hash.copy()
+        h.update(self.end)
+        return h
+
+    def hexdigest(self):
+        return self._final().hexdigest()
+
+    def token(self):
+        if self.binary:
+            return Token(self._final().digest())
+        return self.hexdigest()
+
+
+def sequence_digester(serializer, retain=True, algorithm=DEFAULT_ALGORITHM, binary=False,
+                      **framing):
+    """
+    Returns a function that makes a new `SequenceDigest` for `serializer`, with any
+    `start`, `separator`, or `end` framing given.
+    """
+    def inner():
+        return SequenceDigest(serializer, retain=retain, algorithm=algorithm, binary=binary,
+                              **framing)
     return inner
 
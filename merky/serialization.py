@@ -1,6 +1,21 @@
+import binascii
+import collections
+import itertools
 import json
+import struct
+import sys
+
+import six
+
+from . import digest
+from . import util
+
+DEFAULT_FORMAT = 'json'
+FORMATS = ('json', 'cbor')
 
 def _json_default(item):
+    if isinstance(item, digest.Token):
+        return item.hex()
     try:
         return item.__merky_annotated__
     except:
@@ -13,7 +28,8 @@ def json_serializer(sort=True):
     nans disallowed, keys sorted, and whitespace-free separators.
 
     The function will handle merky-annotated objects according to the particulars
-    of the underlying annotated structure.
+    of the underlying annotated structure, and renders `merky.digest.Token` objects
+    as hex strings.
 
     You can override the sorted keys via `sort=False`.
     """
@@ -23,3 +39,315 @@ def json_serializer(sort=True):
                             separators=(",",":"),
                             default=_json_default).encode
 
+
+
+_JSON_SCALARS = {
+    six.text_type: json.encoder.encode_basestring,
+    bool: lambda b: 'true' if b else 'false',
+    type(None): lambda n: 'null',
+}
+if six.PY3:
+    _JSON_SCALARS[int] = int.__repr__
+
+
+def templated_json_serializer(sort=True, shapes=1024, width=256):
+    """
+    Returns a function giving the same JSON as `json_serializer`, but quicker for dicts that
+    share a set of keys, such as the rows of a long list of records.
+
+    The first time a set of string keys is seen, their order and JSON are worked out once
+    and kept as a template, which is then filled with the JSON of the values of each dict
+    with that set of keys.  Templates are kept for the first `shapes` sets of keys seen,
+    of at most `width` keys each; any other structure is serialized by `json_serializer`.
+    """
+    encode = json_serializer(sort=sort)
+    scalar = _JSON_SCALARS.get
+    templates = {}
+
+    def template(shape):
+        if not all(type(k) is six.text_type for k in shape):
+            return None
+        order = sorted(shape) if sort else shape
+        keys = (json.encoder.encode_basestring(k).replace('%', '%%') for k in order)
+        return order, '{' + ','.join(k + ':%s' for k in keys) + '}'
+
+    def inner(structure):
+        if type(structure) not in (dict, collections.OrderedDict) or \
+                not 0 < len(structure) <= width:
+            return encode(structure)
+        shape = tuple(structure)
+        try:
+            found = templates[shape]
+        except KeyError:
+            found = template(shape)
+            if len(templates) < shapes:
+                templates[shape] = found
+        if found is None:
+            return encode(structure)
+        order, fill = found
+        values = map(structure.__getitem__, order) if sort else six.itervalues(structure)
+        return fill % tuple([scalar(type(v), encode)(v) for v in values])
+    return inner
+
+
+def json_chunker(sort=True, size=1024, serializer=None):
+    """
+    Returns a function giving the same JSON as `json_serializer` as a sequence of
+    text chunks, for hashing or writing without holding the whole serialization of a
+    wide list or dict.
+
+    A list or dict of more than `size` members is rendered `size` members at a time
+    (with the dict's keys sorted beforehand, unless `sort=False`).  Anything smaller is
+    not streamed: it comes as a single chunk, serialized whole by `serializer` if given
+    (such as that of `templated_json_serializer`), which is quicker for the many small
+    nodes of a typical structure.  No chunk then holds more than `size` members, though a
+    member may itself be long, such as a long string.
+
+    JSON has no form for raw bytes, so a buffer (one of `merky.util.BUFFER_TYPES`) is
+    given as by `buffer_chunks` instead.
+    """
+    encode = json_serializer(sort=sort)
+    whole = encode if serializer is None else serializer
+    # Plain dicts encode faster, and keep their order where the encoder doesn't sort them
+    # from python 3.7.
+    part_map = dict if sort or sys.version_info >= (3, 7) else collections.OrderedDict
+
+    def chunks(structure):
+        if isinstance(structure, util.BUFFER_TYPES) and not isinstance(structure, digest.Token):
+            return buffer_chunks(structure)
+        if isinstance(structure, (list, tuple)) and len(structure) > size:
+            return _seq_chunks(structure)
+        if isinstance(structure, dict) and len(structure) > size:
+            return _map_chunks(structure)
+        return (whole(structure),)
+
+    def _seq_chunks(structure):
+        yield '['
+        for offset in range(0, len(structure), size):
+            if offset:
+                yield ','
+            yield encode(structure[offset:offset + size])[1:-1]
+        yield ']'
+
+    def _map_chunks(structure):
+        keys = sorted(structure) if sort else list(structure)
+        yield '{'
+        for offset in range(0, len(keys), size):
+            if offset:
+                yield ','
+            part = keys[offset:offset + size]
+            yield encode(part_map(zip(part, map(structure.__getitem__, part))))[1:-1]
+        yield '}'
+
+    return chunks
+
+
+# A compact binary alternative to JSON: CBOR (RFC 7049), restricted to one encoding per
+# value so that it can be hashed.  Strings are length-prefixed rather than escaped.  Lists
+# and dicts use the indefinite-length form (a start byte, the members, and a break byte),
+# so that they can be serialized a member at a time, as with `CBOR_FRAMING` for
+# `merky.digest.SequenceDigest`.  Integers take the shortest form, floats are always
+# 64 bits, and, as in JSON, `merky.digest.Token` objects are written as hex strings.
+
+CBOR_LIST = b'\x9f'
+CBOR_MAP = b'\xbf'
+CBOR_BREAK = b'\xff'
+CBOR_FRAMING = {'start': CBOR_LIST, 'separator': b'', 'end': CBOR_BREAK}
+
+_CBOR_SIMPLE = {False: b'\xf4', True: b'\xf5', None: b'\xf6'}
+_CBOR_SIMPLE_VALUES = {0xf4: False, 0xf5: True, 0xf6: None}
+_CBOR_WIDTHS = {24: '>B', 25: '>H', 26: '>I', 27: '>Q'}
+_CBOR_TEXT_TYPES = (six.text_type,) if six.PY3 else (six.text_type, str)
+_CBOR_HEADS = [[struct.pack('>B', major << 5 | n) for n in range(24)] for major in range(8)]
+
+
+def _cbor_head(major, n):
+    if n < 24:
+        return _CBOR_HEADS[major][n]
+    if n < 0x100:
+        return struct.pack('>BB', major << 5 | 24, n)
+    if n < 0x10000:
+        return struct.pack('>BH', major << 5 | 25, n)
+    if n < 0x100000000:
+        return struct.pack('>BI', major << 5 | 26, n)
+    return struct.pack('>BQ', major << 5 | 27, n)
+
+
+def _cbor_int(n):
+    major = 0
+    if n < 0:
+        major, n = 1, -1 - n
+    if n < 0x10000000000000000:
+        return _cbor_head(major, n)
+    hexed = '%x' % n
+    data = binascii.unhexlify('0' * (len(hexed) % 2) + hexed)
+    return _cbor_head(6, 2 + major) + _cbor_head(2, len(data)) + data
+
+
+def _cbor_float(f):
+    if f != f or f in (float('inf'), float('-inf')):
+        raise ValueError("Out of range float values are not allowed: %r" % f)
+    return b'\xfb' + struct.pack('>d', f)
+
+
+def _cbor_encoder(sort):
+    text_heads = _CBOR_HEADS[3]
+    int_heads = _CBOR_HEADS[0]
+    def encode(item, out):
+        if isinstance(item, _CBOR_TEXT_TYPES):
+            data = item.encode('utf-8')
+            n = len(data)
+            out.append(text_heads[n] if n < 24 else _cbor_head(3, n))
+            out.append(data)
+        elif isinstance(item, bool) or item is None:
+            out.append(_CBOR_SIMPLE[item])
+        elif isinstance(item, six.integer_types):
+            out.append(int_heads[item] if 0 <= item < 24 else _cbor_int(item))
+        elif isinstance(item, float):
+            out.append(_cbor_float(item))
+        elif isinstance(item, dict):
+            out.append(CBOR_MAP)
+            for k, v in (sorted(item.items()) if sort else item.items()):
+                encode(k, out)
+                encode(v, out)
+            out.append(CBOR_BREAK)
+        elif isinstance(item, (list, tuple)):
+            out.append(CBOR_LIST)
+            for member in item:
+                encode(member, out)
+            out.append(CBOR_BREAK)
+        elif isinstance(item, digest.Token):
+            encode(item.hex(), out)
+        elif isinstance(item, util.BUFFER_TYPES):
+            view = util.buffer_view(item)
+            out.append(_cbor_head(2, len(view)))
+            out.append(view)
+        elif hasattr(item, '__merky_annotated__'):
+            encode(item.__merky_annotated__, out)
+        else:
+            raise TypeError("object of type %s is not CBOR-serializable." % str(type(item)))
+    return encode
+
+
+def cbor_serializer(sort=True):
+    """
+    Returns a function that serializes to the canonical CBOR described above, giving `bytes`.
+
+    As with `json_serializer`, merky-annotated objects are serialized as the structure
+    they annotate, nans and infinities are disallowed, and dict keys are sorted unless
+    `sort=False`.  Where JSON would only accept strings as keys, any serializable value
+    is kept as is.
+    """
+    encode = _cbor_encoder(sort)
+    def inner(structure):
+        out = []
+        encode(structure, out)
+        return b''.join(out)
+    return inner
+
+
+def buffer_chunks(item):
+    """
+    Returns the CBOR of the buffer `item` (one of `merky.util.BUFFER_TYPES`) as two chunks:
+    its length-prefixed head, and a memoryview of its bytes, so that the bytes are hashed
+    where they lie, without a copy.  This is how buffers are tokenized whatever the
+    serialization format.
+    """
+    view = util.buffer_view(item)
+    return (_cbor_head(2, len(view)), view)
+
+
+def cbor_chunker(sort=True, size=1024):
+    """
+    Returns a function giving the same CBOR as `cbor_serializer` as a sequence of byte chunks,
+    `size` members at a time for a list or dict of more than `size` members, and otherwise
+    whole, as `json_chunker` does for JSON.
+    """
+    encode = _cbor_encoder(sort)
+
+    def chunks(structure):
+        if isinstance(structure, util.BUFFER_TYPES) and not isinstance(structure, digest.Token):
+            return buffer_chunks(structure)
+        if isinstance(structure, (list, tuple)) and len(structure) > size:
+            return _chunks(CBOR_LIST, structure)
+        if isinstance(structure, dict) and len(structure) > size:
+            items = sorted(structure.items()) if sort else list(structure.items())
+            return _chunks(CBOR_MAP, util.flatten(items))
+        out = []
+        encode(structure, out)
+        return (b''.join(out),)
+
+    def _chunks(start, members):
+        members = iter(members)
+        yield start
+        while True:
+            out = []
+            for member in itertools.islice(members, size):
+                encode(member, out)
+            if not out:
+                break
+            yield b''.join(out)
+        yield CBOR_BREAK
+
+    return chunks
+
+
+def cbor_deserializer():
+    """
+    Returns a function that deserializes the output of `cbor_serializer`, giving dicts as
+    `collections.OrderedDict` objects in their serialized order.
+
+    Only the forms that `cbor_serializer` writes are read; anything else raises a
+    `ValueError`.
+    """
+    def item(data, i):
+        initial = six.indexbytes(data, i)
+        major, info = initial >> 5, initial & 0x1f
+        i += 1
+        if major == 7:
+            if info == 27:
+                return struct.unpack_from('>d', data, i)[0], i + 8
+            if initial in _CBOR_SIMPLE_VALUES:
+                return _CBOR_SIMPLE_VALUES[initial], i
+            raise ValueError("Unsupported CBOR item 0x%02x at %d" % (initial, i - 1))
+        if info == 31:
+            if major == 4:
+                result = []
+                while six.indexbytes(data, i) != 0xff:
+                    member, i = item(data, i)
+                    result.append(member)
+                return result, i + 1
+            if major == 5:
+                result = collections.OrderedDict()
+                while six.indexbytes(data, i) != 0xff:
+                    key, i = item(data, i)
+                    result[key], i = item(data, i)
+                return result, i + 1
+            raise ValueError("Unsupported CBOR item 0x%02x at %d" % (initial, i - 1))
+        if info < 24:
+            n = info
+        elif info in _CBOR_WIDTHS:
+            n = struct.unpack_from(_CBOR_WIDTHS[info], data, i)[0]
+            i += 1 << (info - 24)
+        else:
+            raise ValueError("Unsupported CBOR item 0x%02x at %d" % (initial, i - 1))
+        if major == 0:
+            return n, i
+        if major == 1:
+            return -1 - n, i
+        if major == 2:
+            return bytes(data[i:i + n]), i + n
+        if major == 3:
+            return data[i:i + n].decode('utf-8'), i + n
+        if major == 6 and n in (2, 3):
+            value, i = item(data, i)
+            value = int(binascii.hexlify(value), 16)
+            return (value if n == 2 else -1 - value), i
+        raise ValueError("Unsupported CBOR item 0x%02x at %d" % (initial, i - 1))
+
+    def inner(data):
+        value, i = item(data, 0)
+        if i != len(data):
+            raise ValueError("Extra data after CBOR item at %d" % i)
+        return value
+    return inner
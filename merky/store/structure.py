@@ -1,7 +1,20 @@
+import base64
+import binascii
 import codecs
 import collections
+import contextlib
+import io
 import json
+import mmap
+import os
+import sqlite3
+import struct
+import tempfile
+import zlib
+import six
+from .. import digest
 from .. import serialization
+from .. import util
 
 class Structure(object):
     """
@@ -19,7 +32,19 @@ class Structure(object):
     allow for load of specific cases like the
     `merky.cases.attrgraph.AttributeGraph` and similar (the `from_token`
     classmethod).
+
+    The `algorithm` names the `merky.digest` hash algorithm that produced
+    the tokens; it defaults to `merky.digest.DEFAULT_ALGORITHM`.  Likewise,
+    the `format` names the serialization that was hashed (see the `format`
+    of `merky.transformer.Transformer`), "json" by default.
+
+    If `binary_tokens` is true, the tokens are kept as compact
+    `merky.digest.Token` objects, but lookups accept hex strings as well.
     """
+    algorithm = digest.DEFAULT_ALGORITHM
+    format = serialization.DEFAULT_FORMAT
+    binary_tokens = False
+
     def populate(self, token_structure_pairs):
         raise NotImplementedError("populate() not implemented.")
 
@@ -51,27 +76,43 @@ class TokenMapStructure(Structure):
         self.tokenmap.update(token_structure_pairs)
         self.head = next(iter(reversed(self.tokenmap))) if len(self.tokenmap) > 0 else None
 
+    def lookup_key(self, key):
+        """
+        Returns `key` in the form used by the internal map; with `binary_tokens`, hex strings
+        are converted to `merky.digest.Token` objects.
+        """
+        if self.binary_tokens and not isinstance(key, digest.Token):
+            try:
+                return digest.Token.fromhex(key)
+            except (TypeError, ValueError):
+                pass
+        return key
+
     def get(self, key):
         """
         Returns the corresponding structure from the internal map given the token `key`.
         """
-        return self.tokenmap.get(key)
+        return self.tokenmap.get(self.lookup_key(key))
 
     
     def __getitem__(self, key):
         """
         Returns the corresponding structure from the internal map given the token 'key'.
         """
-        return self.tokenmap[key]
+        return self.tokenmap[self.lookup_key(key)]
 
 
 class InMemoryStructure(TokenMapStructure):
     """
     An in-memory "store" that has both the read and write interfaces.
     """
-    def __init__(self, tokenmap=None, head=None):
+    def __init__(self, tokenmap=None, head=None, algorithm=digest.DEFAULT_ALGORITHM,
+                 binary_tokens=False, format=serialization.DEFAULT_FORMAT):
         self.tokenmap = self.default_tokenmap() if tokenmap is None else tokenmap
         self.head = head
+        self.algorithm = algorithm
+        self.format = format
+        self.binary_tokens = binary_tokens
 
     def close(self):
         pass
@@ -80,14 +121,47 @@ class InMemoryStructure(TokenMapStructure):
 class JSONStreamReadStructure(TokenMapStructure):
     """
     Reads merkified structure from a utf-8 JSON stream.
+
+    The JSON document is a list of the token map, the head token, and (unless
+    they are the defaults) the names of the hash algorithm and the serialization
+    format.  Buffers (see `merky.util.BUFFER_TYPES`), which JSON cannot hold,
+    follow as a fifth element mapping their tokens to base64; they are read back
+    as `bytes`.
+
+    With `binary_tokens`, the token map keys and the head are converted to
+    `merky.digest.Token` objects; tokens within the structures remain hex strings.
     """
-    def __init__(self, stream):
+    def __init__(self, stream, binary_tokens=False):
         self.stream = stream
-        self.tokenmap, self.head = self.deserialize_from_stream(stream)
+        self.binary_tokens = binary_tokens
+        self.load(self.deserialize_from_stream(stream))
+
+    def load(self, unpacked):
+        """
+        Sets the token map, head, algorithm and format from the result of `unpack`.
+        """
+        self.tokenmap, self.head, self.algorithm, self.format = unpacked
+        if self.binary_tokens:
+            self.tokenmap = collections.OrderedDict(
+                    (digest.Token.fromhex(k), v) for k, v in self.tokenmap.items())
+            if self.head is not None:
+                self.head = digest.Token.fromhex(self.head)
 
     @classmethod
     def deserialize_from_stream(cls, stream):
-        return json.load(stream, encoding='utf-8')
+        return cls.unpack(json.load(stream))
+
+    @staticmethod
+    def unpack(document):
+        """
+        Returns the `(tokenmap, head, algorithm, format)` given the deserialized `document`.
+        """
+        tokenmap, head = document[:2]
+        algorithm = document[2] if len(document) > 2 else digest.DEFAULT_ALGORITHM
+        format = document[3] if len(document) > 3 else serialization.DEFAULT_FORMAT
+        if len(document) > 4:
+            tokenmap.update((k, base64.b64decode(v)) for k, v in document[4].items())
+        return tokenmap, head, algorithm, format
 
 
 class JSONStreamWriteStructure(TokenMapStructure):
@@ -98,13 +172,49 @@ class JSONStreamWriteStructure(TokenMapStructure):
     at close().
     """
     serializer = serialization.json_serializer(sort=False)
+    # Whether the serializer can hold buffers within the token map itself.
+    inline_buffers = False
 
-    def __init__(self, stream):
+    def __init__(self, stream, algorithm=digest.DEFAULT_ALGORITHM,
+                 format=serialization.DEFAULT_FORMAT):
         self.tokenmap = self.default_tokenmap()
         self.stream = stream
+        self.algorithm = algorithm
+        self.format = format
+
+    def pack(self):
+        """
+        Returns the document to write: the token map, head, and any non-default algorithm
+        and format, followed by any buffers unless `inline_buffers` is set.
+
+        Any `merky.digest.Token` keys are rendered as hex strings, and buffers as base64.
+        """
+        tokenmap = self.tokenmap
+        if any(isinstance(k, digest.Token) for k in tokenmap):
+            tokenmap = collections.OrderedDict(
+                    (k.hex() if isinstance(k, digest.Token) else k, v) for k, v in tokenmap.items())
+        buffers = None
+        if not self.inline_buffers and any(self.is_buffer(v) for v in tokenmap.values()):
+            buffers = collections.OrderedDict(
+                    (k, base64.b64encode(util.buffer_view(v)).decode('ascii'))
+                    for k, v in tokenmap.items() if self.is_buffer(v))
+            tokenmap = collections.OrderedDict(
+                    (k, v) for k, v in tokenmap.items() if not self.is_buffer(v))
+        document = [tokenmap, self.head]
+        if buffers is not None:
+            document.extend([self.algorithm, self.format, buffers])
+        elif self.format != serialization.DEFAULT_FORMAT:
+            document.extend([self.algorithm, self.format])
+        elif self.algorithm != digest.DEFAULT_ALGORITHM:
+            document.append(self.algorithm)
+        return document
+
+    @staticmethod
+    def is_buffer(value):
+        return isinstance(value, util.BUFFER_TYPES) and not isinstance(value, digest.Token)
 
     def serialize_to_stream(self, stream):
-        stream.write(self.serializer([self.tokenmap, self.head]))
+        stream.write(self.serializer(self.pack()))
 
     def close(self):
         self.serialize_to_stream(self.stream)
@@ -115,9 +225,10 @@ class JSONFileReadStructure(JSONStreamReadStructure):
     """
     Reads merkified structure from utf-8 JSON file.
     """
-    def __init__(self, path):
+    def __init__(self, path, binary_tokens=False):
         self.path = path
-        self.tokenmap, self.head = self.deserialize_from_file(self.path)
+        self.binary_tokens = binary_tokens
+        self.load(self.deserialize_from_file(self.path))
 
     @classmethod
     def deserialize_from_file(cls, path):
@@ -132,9 +243,12 @@ class JSONFileWriteStructure(JSONStreamWriteStructure):
     The instance accumulates state internally and only serializes to the file
     at close().
     """
-    def __init__(self, path):
+    def __init__(self, path, algorithm=digest.DEFAULT_ALGORITHM,
+                 format=serialization.DEFAULT_FORMAT):
         self.tokenmap = self.default_tokenmap()
         self.path = path
+        self.algorithm = algorithm
+        self.format = format
 
     def serialize_to_file(self, path):
         """
@@ -150,3 +264,1040 @@ class JSONFileWriteStructure(JSONStreamWriteStructure):
         self.serialize_to_file(self.path)
 
 
+class CBORStreamReadStructure(JSONStreamReadStructure):
+    """
+    Reads merkified structure from a binary stream of the CBOR of `merky.serialization`.
+
+    The document is as for `JSONStreamReadStructure`, but in CBOR rather than JSON.
+    """
+    deserializer = staticmethod(serialization.cbor_deserializer())
+
+    @classmethod
+    def deserialize_from_stream(cls, stream):
+        return cls.unpack(cls.deserializer(stream.read()))
+
+
+class CBORStreamWriteStructure(JSONStreamWriteStructure):
+    """
+    Writes merkified structure to a binary stream in the CBOR of `merky.serialization`.
+
+    The instance accumulates state internally and only serializes to stream
+    at close().
+    """
+    serializer = staticmethod(serialization.cbor_serializer(sort=False))
+    inline_buffers = True
+
+
+class CBORFileReadStructure(CBORStreamReadStructure):
+    """
+    Reads merkified structure from a CBOR file.
+    """
+    def __init__(self, path, binary_tokens=False):
+        self.path = path
+        self.binary_tokens = binary_tokens
+        self.load(self.deserialize_from_file(self.path))
+
+    @classmethod
+    def deserialize_from_file(cls, path):
+        with open(path, mode="rb") as f:
+            return cls.deserialize_from_stream(f)
+
+
+class CBORFileWriteStructure(CBORStreamWriteStructure):
+    """
+    Writes merkified structure to a CBOR file.
+
+    The instance accumulates state internally and only serializes to the file
+    at close().
+    """
+    def __init__(self, path, algorithm=digest.DEFAULT_ALGORITHM,
+                 format=serialization.DEFAULT_FORMAT):
+        self.tokenmap = self.default_tokenmap()
+        self.path = path
+        self.algorithm = algorithm
+        self.format = format
+
+    def serialize_to_file(self, path):
+        """
+        Writes the current state to the `path` specified.
+        """
+        with open(path, mode="wb") as f:
+            self.serialize_to_stream(f)
+
+    def close(self):
+        """
+        Writes the state out to the file at `self.path`.
+        """
+        self.serialize_to_file(self.path)
+
+
+class JSONLinesStreamWriteStructure(Structure):
+    """
+    Writes merkified structure to a utf-8 JSON Lines stream as it is populated.
+
+    Each pair is written as `populate()` takes it from the transform, on a line of its own
+    holding the JSON list `[token, structure]` (or `[token, base64, "base64"]` for a buffer),
+    so memory use does not grow with the number of pairs, and the lines written survive an
+    interrupted transform.  `close()` writes a final line holding the JSON object
+    `{"head": token, "algorithm": name, "format": name}`.
+
+    Pairs are not deduplicated; a token given more than once is written more than once
+    (transform with `unique=True` to avoid that).  Nor are the pairs kept for `get()`.
+    """
+    serializer = serialization.json_serializer(sort=False)
+
+    def __init__(self, stream, algorithm=digest.DEFAULT_ALGORITHM,
+                 format=serialization.DEFAULT_FORMAT):
+        self.stream = stream
+        self.head = None
+        self.algorithm = algorithm
+        self.format = format
+
+    def populate(self, token_structure_pairs):
+        """
+        Writes out each of the `token_structure_pairs` as it comes, flushing the stream at
+        the end.
+
+        Sets `head` to the last token seen, if any.
+        """
+        serializer = self.serializer
+        write = self.write_line
+        token = None
+        for token, structure in token_structure_pairs:
+            write(serializer(self.pack_pair(token, structure)))
+        if token is not None:
+            self.head = token
+        self.stream.flush()
+
+    @staticmethod
+    def pack_pair(token, structure):
+        """
+        Returns the list to write for the pair of `token` and `structure`.
+        """
+        if JSONStreamWriteStructure.is_buffer(structure):
+            return [token, base64.b64encode(util.buffer_view(structure)).decode('ascii'),
+                    'base64']
+        return [token, structure]
+
+    def write_line(self, line):
+        self.stream.write(line)
+        self.stream.write(u'\n')
+
+    def close(self):
+        """
+        Writes the final line holding the head, algorithm and format.
+        """
+        self.write_line(self.serializer(collections.OrderedDict((
+            ('head', self.head), ('algorithm', self.algorithm), ('format', self.format)))))
+        self.stream.flush()
+
+
+class JSONLinesStreamReadStructure(JSONStreamReadStructure):
+    """
+    Reads merkified structure from a utf-8 JSON Lines stream as written by the
+    `JSONLinesStreamWriteStructure`.
+
+    Should the final line be missing, as when the writer was interrupted, the pairs written
+    are still read, but the `head` is `None`; a partial last line is ignored.  If there is
+    more than one final line (as when a file is appended to), the last one counts.
+    """
+    @classmethod
+    def deserialize_from_stream(cls, stream):
+        tokenmap = collections.OrderedDict()
+        head = None
+        algorithm = digest.DEFAULT_ALGORITHM
+        format = serialization.DEFAULT_FORMAT
+        for record in cls.records(stream):
+            if isinstance(record, dict):
+                head = record['head']
+                algorithm = record.get('algorithm', algorithm)
+                format = record.get('format', format)
+            else:
+                tokenmap[record[0]] = cls.unpack_pair(record)
+        return tokenmap, head, algorithm, format
+
+    @staticmethod
+    def unpack_pair(record):
+        """
+        Returns the structure of the pair on a line, given its JSON list `record`.
+        """
+        if len(record) > 2:
+            return base64.b64decode(record[1])
+        return record[1]
+
+    @staticmethod
+    def records(lines):
+        """
+        Yields the JSON value of each of the `lines` (text, as from iterating over a stream),
+        skipping blank lines and a partial last line.
+        """
+        decoder = json.JSONDecoder(object_pairs_hook=collections.OrderedDict)
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                yield decoder.decode(line)
+            except ValueError:
+                if line.endswith(u'\n'):
+                    raise
+                return
+
+    @classmethod
+    def pairs(cls, lines):
+        """
+        Yields the `(token, structure)` pairs on the `lines`, one at a time, for passing them
+        on (to another store's `populate`, say) without holding them all.
+        """
+        for record in cls.records(lines):
+            if not isinstance(record, dict):
+                yield record[0], cls.unpack_pair(record)
+
+
+class JSONLinesFileWriteStructure(JSONLinesStreamWriteStructure):
+    """
+    Writes merkified structure to a utf-8 JSON Lines file as it is populated; see
+    `JSONLinesStreamWriteStructure`.
+
+    The file is created (or truncated) at once, or appended to if `append` is true.  When
+    appending, a partial last line, as left by an interrupted writer, is cut off first.
+    """
+    def __init__(self, path, algorithm=digest.DEFAULT_ALGORITHM,
+                 format=serialization.DEFAULT_FORMAT, append=False):
+        stream = self.open_for_append(path) if append else io.open(path, mode='wb')
+        super(JSONLinesFileWriteStructure, self).__init__(stream, algorithm, format)
+        self.path = path
+
+    @staticmethod
+    def open_for_append(path, block=65536):
+        """
+        Opens the file at `path` (creating it if need be) positioned after its last line
+        feed, having truncated anything that follows.
+        """
+        f = io.open(path, mode='ab')
+        f.close()
+        f = io.open(path, mode='r+b')
+        size = f.seek(0, io.SEEK_END)
+        end = position = size
+        while position > 0:
+            step = min(block, position)
+            position -= step
+            f.seek(position)
+            found = f.read(step).rfind(b'\n')
+            if found >= 0:
+                end = position + found + 1
+                break
+        else:
+            end = 0
+        if end != size:
+            f.truncate(end)
+        f.seek(end)
+        return f
+
+    def write_line(self, line):
+        self.stream.write(digest.encoded(line) + b'\n')
+
+    def close(self):
+        """
+        Writes the final line and closes the file.
+        """
+        super(JSONLinesFileWriteStructure, self).close()
+        self.stream.close()
+
+
+class JSONLinesFileReadStructure(JSONLinesStreamReadStructure):
+    """
+    Reads merkified structure from a utf-8 JSON Lines file.
+    """
+    def __init__(self, path, binary_tokens=False):
+        self.path = path
+        self.binary_tokens = binary_tokens
+        self.load(self.deserialize_from_file(self.path))
+
+    @classmethod
+    def deserialize_from_file(cls, path):
+        return cls.deserialize_from_stream(cls.lines(path))
+
+    @staticmethod
+    def lines(path):
+        """
+        Yields the lines of the file at `path`, split only at line feeds (which JSON escapes
+        within strings) and decoded.
+        """
+        with io.open(path, mode='rb') as f:
+            for line in f:
+                yield line.decode('utf-8')
+
+
+@contextlib.contextmanager
+def replacing_file(path, keep_existing=False):
+    """
+    Yields a binary file to write in place of the file at `path`: a new temporary file in the
+    same directory, renamed over `path` once written, or removed should writing fail.  The
+    file at `path`, if any, is never partly written, and (but on Windows) is there until the
+    new one replaces it.
+
+    With `keep_existing`, a file at `path` is never replaced: the new file is linked there
+    only if there is none yet (atomically, where the filesystem has hard links), and is
+    otherwise dropped, so that of several writers racing to create `path` just one wins.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or os.curdir, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            yield f
+        if keep_existing:
+            _create_from(tmp, path)
+            return
+        try:
+            os.rename(tmp, path)
+        except OSError:
+            # Windows won't rename over a file.
+            if not os.path.exists(path):
+                raise
+            os.remove(path)
+            os.rename(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _create_from(tmp, path):
+    """
+    Moves the file at `tmp` to `path` unless there is a file there already, in which case
+    `tmp` is removed.
+    """
+    try:
+        try:
+            link = os.link
+        except AttributeError:
+            # Python 2 on Windows, which won't rename over a file either.
+            link = os.rename
+        link(tmp, path)
+    except OSError:
+        if not os.path.exists(path):
+            # No hard links on this filesystem.
+            os.rename(tmp, path)
+    if os.path.exists(tmp):
+        os.remove(tmp)
+
+
+class JSONLinesMappedReadStructure(Structure):
+    """
+    Reads merkified structure from a utf-8 JSON Lines file (see
+    `JSONLinesFileWriteStructure`) without loading it: the file is memory-mapped, and each
+    structure is decoded from its line when asked for by `get()` or `__getitem__`.
+
+    The lines are found via an index file, at `index_path` (by default, the `path` with
+    ".idx" appended), that holds the token of each line, sorted, with the offset and length
+    of the line, and the place of the final head line.  The index is mapped too, and
+    searched in place, so opening the store takes the same time however big it is, and
+    memory use follows the structures actually read.  If the index is missing, or was made
+    for a file of another size or modification time (as before the file was appended to),
+    it is (re)written by `write_index`, which reads the whole file once and sorts the tokens
+    in memory.
+
+    As with `JSONLinesStreamReadStructure`, `head` is `None` if the file has no head line.
+    Call `close()` when done, to unmap the files.
+    """
+    INDEX_MAGIC = b'MKYL'
+    INDEX_VERSION = 2
+    # Magic, version, token width, token count, file size and modification time (in
+    # nanoseconds), head line offset and length.
+    INDEX_HEADER = struct.Struct('>4sHHQQQQI')
+    # The offset and length of a line, following its token padded to the token width.
+    INDEX_ENTRY = struct.Struct('>QI')
+
+    def __init__(self, path, index_path=None, binary_tokens=False):
+        self.path = path
+        self.index_path = path + '.idx' if index_path is None else index_path
+        self.binary_tokens = binary_tokens
+        self.decoder = json.JSONDecoder(object_pairs_hook=collections.OrderedDict)
+        if not self.index_current(self.index_path, self.version(os.stat(path))):
+            self.write_index(path, self.index_path)
+        self.data = self.mapped(path)
+        self.index = self.mapped(self.index_path)
+        (_, _, self.width, self.count, _, _, head_offset,
+         head_length) = self.INDEX_HEADER.unpack_from(self.index)
+        self.entry_size = self.width + self.INDEX_ENTRY.size
+        self.head = None
+        if head_length:
+            record = self.decode(head_offset, head_length)
+            self.head = record['head']
+            self.algorithm = record.get('algorithm', self.algorithm)
+            self.format = record.get('format', self.format)
+            if self.binary_tokens and self.head is not None:
+                self.head = digest.Token.fromhex(self.head)
+
+    @staticmethod
+    def mapped(path):
+        """
+        Returns a read-only map of the file at `path` (or an empty `bytes` for an empty file,
+        which can't be mapped).
+        """
+        with io.open(path, mode='rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @staticmethod
+    def version(stat):
+        """
+        Returns the size and modification time in nanoseconds from the `os.stat` result.
+        """
+        mtime = getattr(stat, 'st_mtime_ns', None)
+        return stat.st_size, int(stat.st_mtime * 1e9) if mtime is None else mtime
+
+    @classmethod
+    def index_current(cls, index_path, version):
+        """
+        Returns whether there is an index at `index_path` for a file of the `version` given
+        (see `version`).
+        """
+        try:
+            with io.open(index_path, mode='rb') as f:
+                header = f.read(cls.INDEX_HEADER.size)
+        except (IOError, OSError):
+            return False
+        if len(header) < cls.INDEX_HEADER.size:
+            return False
+        magic, index_version, _, _, size, mtime, _, _ = cls.INDEX_HEADER.unpack(header)
+        return (magic == cls.INDEX_MAGIC and index_version == cls.INDEX_VERSION and
+                (size, mtime) == version)
+
+    @classmethod
+    def write_index(cls, path, index_path):
+        """
+        Writes the index of the JSON Lines file at `path` to `index_path`.
+
+        Where a token is on more than one line, the first is indexed.  A partial final line
+        is left out.  The index is written by way of a temporary file (see `replacing_file`),
+        so readers opening the file at once don't see each other's partial indexes.
+        """
+        entries = []
+        head_offset = head_length = 0
+        offset = 0
+        with io.open(path, mode='rb') as f:
+            # Taken first, so that a change while reading makes the index stale.
+            size, mtime = cls.version(os.fstat(f.fileno()))
+            for line in f:
+                length = len(line) - 1
+                if line.endswith(b'\n'):
+                    if line.startswith(b'["'):
+                        entries.append((line[2:line.index(b'"', 2)], offset, length))
+                    elif line.startswith(b'{'):
+                        head_offset, head_length = offset, length
+                offset += len(line)
+        entries.sort(key=lambda entry: entry[0])
+        width = max([len(entry[0]) for entry in entries] or [0])
+        with replacing_file(index_path) as f:
+            f.write(cls.INDEX_HEADER.pack(cls.INDEX_MAGIC, cls.INDEX_VERSION, width,
+                                          len(set(entry[0] for entry in entries)), size, mtime,
+                                          head_offset, head_length))
+            previous = None
+            for key, line_offset, length in entries:
+                if key != previous:
+                    f.write(key.ljust(width, b'\0') + cls.INDEX_ENTRY.pack(line_offset, length))
+                previous = key
+
+    def decode(self, offset, length):
+        return self.decoder.decode(self.data[offset:offset + length].decode('utf-8'))
+
+    def find(self, key):
+        """
+        Returns the offset and length of the line for the token `key`, or `None`.
+        """
+        if isinstance(key, digest.Token):
+            key = key.hex()
+        if isinstance(key, six.text_type):
+            try:
+                key = key.encode('ascii')
+            except UnicodeError:
+                return None
+        if not isinstance(key, bytes) or len(key) > self.width:
+            return None
+        key = key.ljust(self.width, b'\0')
+        index, width, size = self.index, self.width, self.entry_size
+        base = self.INDEX_HEADER.size
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = base + middle * size
+            if index[start:start + width] < key:
+                low = middle + 1
+            else:
+                high = middle
+        start = base + low * size
+        if low < self.count and index[start:start + width] == key:
+            return self.INDEX_ENTRY.unpack_from(index, start + width)
+        return None
+
+    def get(self, key):
+        """
+        Returns the structure for the token `key`, decoded from its line, or `None`.
+        """
+        found = self.find(key)
+        if found is None:
+            return None
+        return JSONLinesStreamReadStructure.unpack_pair(self.decode(*found))
+
+    def __getitem__(self, key):
+        """
+        Returns the structure for the token `key`, decoded from its line.
+        """
+        found = self.find(key)
+        if found is None:
+            raise KeyError(key)
+        return JSONLinesStreamReadStructure.unpack_pair(self.decode(*found))
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """
+        Unmaps the file and the index.
+        """
+        for mapped in (self.data, self.index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+
+PACK_MAGIC = b'MKYP\x00\x02\x00\x00'
+# Random bytes written after the magic of a pack and in the header of its index, that
+# match only for an index written with the pack.
+PACK_ID_SIZE = 16
+PACK_INDEX_MAGIC = b'MKYI'
+PACK_INDEX_VERSION = 2
+# Magic, version, digest size, metadata length, token count, pack id.
+PACK_INDEX_HEADER = struct.Struct('>4sHHIQ%ds' % PACK_ID_SIZE)
+# The cumulative token count by first digest byte.
+PACK_FANOUT = struct.Struct('>256I')
+# The offset and length of a node in the pack.
+PACK_ENTRY = struct.Struct('>QI')
+
+
+def raw_token(token):
+    """
+    Returns the raw digest bytes of the hex string or `merky.digest.Token` given, or `None`
+    if it is neither.
+    """
+    if isinstance(token, digest.Token):
+        return bytes(token)
+    try:
+        return binascii.unhexlify(token)
+    except (TypeError, ValueError):
+        return None
+
+
+def write_pack(source, path, index_path=None, compress=False):
+    """
+    Writes the token map of `source`, a `TokenMapStructure`, as a pack at `path` along with
+    its index at `index_path` (by default, the `path` with ".idx" appended).
+
+    The pack holds a random pack id, then the nodes one after another, each serialized as
+    CBOR (see `merky.serialization.cbor_serializer`), and compressed with zlib if `compress`
+    is true.  The index holds:
+        * a header, with the same pack id, followed by the JSON of the head, algorithm,
+          format and compression
+        * the fanout table: for each possible first byte of a digest, the count of tokens
+          whose digests begin with that byte or less
+        * the raw digests of the tokens, sorted
+        * the offset and length in the pack of the node of each digest, in the same order
+
+    Each file is written under a temporary name (see `replacing_file`), and only once both
+    are written are they renamed into place, the pack first.  Should the index not follow
+    (or a reader come between the two), the old index no longer matches the pack id, and
+    `PackFileReadStructure` refuses it rather than read the wrong nodes.
+
+    The tokens must be digests, all of the same size; otherwise a `ValueError` is raised
+    before anything is written.
+    """
+    index_path = path + '.idx' if index_path is None else index_path
+    serializer = serialization.cbor_serializer(sort=False)
+    raws = []
+    for token in source.tokenmap:
+        raw = raw_token(token)
+        if raw is None:
+            raise ValueError("Not a digest token: %r" % (token,))
+        raws.append(raw)
+    sizes = set(len(raw) for raw in raws)
+    if len(sizes) > 1:
+        raise ValueError("Tokens of different sizes: %s" % sorted(sizes))
+    entries = []
+    pack_id = os.urandom(PACK_ID_SIZE)
+    offset = len(PACK_MAGIC) + PACK_ID_SIZE
+    # The pack is renamed on leaving the inner block, and the index on leaving the outer.
+    with replacing_file(index_path) as index:
+        with replacing_file(path) as f:
+            f.write(PACK_MAGIC + pack_id)
+            for raw, structure in zip(raws, source.tokenmap.values()):
+                data = serializer(structure)
+                if compress:
+                    data = zlib.compress(data)
+                f.write(data)
+                entries.append((raw, offset, len(data)))
+                offset += len(data)
+            entries.sort(key=lambda entry: entry[0])
+            fanout = [0] * 256
+            for entry in entries:
+                fanout[six.indexbytes(entry[0], 0)] += 1
+            for i in range(1, 256):
+                fanout[i] += fanout[i - 1]
+            head = source.head.hex() if isinstance(source.head, digest.Token) else source.head
+            meta = digest.encoded(serialization.json_serializer(sort=False)(
+                collections.OrderedDict((('head', head), ('algorithm', source.algorithm),
+                                         ('format', source.format),
+                                         ('compressed', bool(compress))))))
+            index.write(PACK_INDEX_HEADER.pack(PACK_INDEX_MAGIC, PACK_INDEX_VERSION,
+                                               sizes.pop() if sizes else 0, len(meta),
+                                               len(entries), pack_id))
+            index.write(meta)
+            index.write(PACK_FANOUT.pack(*fanout))
+            for entry in entries:
+                index.write(entry[0])
+            for entry in entries:
+                index.write(PACK_ENTRY.pack(entry[1], entry[2]))
+
+class PackFileWriteStructure(TokenMapStructure):
+    """
+    Writes merkified structure to a pack and its index (see `write_pack`).
+
+    The instance accumulates state internally and only writes the files at close().
+    """
+    def __init__(self, path, algorithm=digest.DEFAULT_ALGORITHM,
+                 format=serialization.DEFAULT_FORMAT, index_path=None, compress=False):
+        self.tokenmap = self.default_tokenmap()
+        self.head = None
+        self.path = path
+        self.index_path = index_path
+        self.algorithm = algorithm
+        self.format = format
+        self.compress = compress
+
+    def close(self):
+        """
+        Writes the pack and index.
+        """
+        write_pack(self, self.path, self.index_path, self.compress)
+
+
+class PackFileReadStructure(Structure):
+    """
+    Reads merkified structure from a pack and its index (see `write_pack`), both of which
+    are memory-mapped, so that opening the pack takes the same time however big it is.
+
+    The node of a token is found by binary search of the digests in the index that begin
+    with the same byte, as given by the fanout table, then decoded from the pack.
+
+    Tokens may be given as hex strings or `merky.digest.Token` objects either way; with
+    `binary_tokens`, the `head` is a `merky.digest.Token`.  Call `close()` when done, to
+    unmap the files.
+    """
+    def __init__(self, path, index_path=None, binary_tokens=False):
+        self.path = path
+        self.index_path = path + '.idx' if index_path is None else index_path
+        self.binary_tokens = binary_tokens
+        self.deserializer = serialization.cbor_deserializer()
+        self.data = JSONLinesMappedReadStructure.mapped(path)
+        self.index = JSONLinesMappedReadStructure.mapped(self.index_path)
+        if self.data[:len(PACK_MAGIC)] != PACK_MAGIC:
+            raise ValueError("Not a pack: %s" % path)
+        magic, version, self.digest_size, meta_length, self.count, pack_id = \
+            PACK_INDEX_HEADER.unpack_from(self.index)
+        if magic != PACK_INDEX_MAGIC or version != PACK_INDEX_VERSION:
+            raise ValueError("Not a pack index: %s" % self.index_path)
+        if self.data[len(PACK_MAGIC):len(PACK_MAGIC) + PACK_ID_SIZE] != pack_id:
+            raise ValueError("Index %s is not that of pack %s" % (self.index_path, path))
+        start = PACK_INDEX_HEADER.size
+        meta = json.loads(self.index[start:start + meta_length].decode('utf-8'))
+        self.head = meta['head']
+        self.algorithm = meta['algorithm']
+        self.format = meta['format']
+        self.compressed = meta['compressed']
+        if self.binary_tokens and self.head is not None:
+            self.head = digest.Token.fromhex(self.head)
+        self.fanout = PACK_FANOUT.unpack_from(self.index, start + meta_length)
+        self.digests = start + meta_length + PACK_FANOUT.size
+        self.entries = self.digests + self.count * self.digest_size
+
+    def find(self, key):
+        """
+        Returns the offset and length in the pack of the node for the token `key`, or `None`.
+        """
+        raw = raw_token(key)
+        if raw is None or len(raw) != self.digest_size or not raw:
+            return None
+        first = six.indexbytes(raw, 0)
+        low = self.fanout[first - 1] if first else 0
+        high = self.fanout[first]
+        index, size, digests = self.index, self.digest_size, self.digests
+        while low < high:
+            middle = (low + high) // 2
+            start = digests + middle * size
+            if index[start:start + size] < raw:
+                low = middle + 1
+            else:
+                high = middle
+        start = digests + low * size
+        if low < self.fanout[first] and index[start:start + size] == raw:
+            return PACK_ENTRY.unpack_from(index, self.entries + low * PACK_ENTRY.size)
+        return None
+
+    def decode(self, offset, length):
+        data = self.data[offset:offset + length]
+        if self.compressed:
+            data = zlib.decompress(data)
+        return self.deserializer(data)
+
+    def get(self, key):
+        """
+        Returns the structure for the token `key`, decoded from the pack, or `None`.
+        """
+        found = self.find(key)
+        if found is None:
+            return None
+        return self.decode(*found)
+
+    def __getitem__(self, key):
+        """
+        Returns the structure for the token `key`, decoded from the pack.
+        """
+        found = self.find(key)
+        if found is None:
+            raise KeyError(key)
+        return self.decode(*found)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        """
+        Unmaps the pack and the index.
+        """
+        for mapped in (self.data, self.index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
+
+
+class SQLiteStructure(Structure):
+    """
+    Stores merkified structure in an SQLite database at `path`, read and written in place,
+    so that neither needs the whole structure in memory.
+
+    The database has three tables:
+        * `nodes`, of the raw digest of each token (the primary key) and the CBOR of its
+          structure (see `merky.serialization.cbor_serializer`)
+        * `heads`, of named head tokens
+        * `meta`, of the `algorithm` and `format` of the tokens
+
+    `populate()` inserts the pairs in transactions of `batch_size` pairs each, skipping
+    tokens already stored, and sets `head` to the last token.  The `head` is recorded in
+    `heads` under the name `head_name` by `commit()` and `close()`, and is read from there
+    when the database is opened; other heads can be kept by `set_head()` and `get_head()`.
+    The database uses write-ahead logging, so readers in other processes aren't blocked by
+    a writer.
+
+    The `algorithm` and `format` default to those recorded in the database, if any, or else
+    to the usual defaults; a `ValueError` is raised if they differ from those recorded.
+    Tokens must be digests, given as hex strings or `merky.digest.Token` objects either way;
+    with `binary_tokens`, the `head` is a `merky.digest.Token`.
+    """
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS nodes (token BLOB PRIMARY KEY, structure BLOB NOT NULL)"
+        " WITHOUT ROWID",
+        "CREATE TABLE IF NOT EXISTS heads (name TEXT PRIMARY KEY, token BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)",
+    )
+    INSERT = "INSERT OR IGNORE INTO nodes (token, structure) VALUES (?, ?)"
+    SELECT = "SELECT structure FROM nodes WHERE token = ?"
+
+    def __init__(self, path, algorithm=None, format=None, binary_tokens=False,
+                 head_name='head', batch_size=10000):
+        self.path = path
+        self.binary_tokens = binary_tokens
+        self.head_name = head_name
+        self.batch_size = batch_size
+        self.serializer = serialization.cbor_serializer(sort=False)
+        self.deserializer = serialization.cbor_deserializer()
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for statement in self.SCHEMA:
+                self.connection.execute(statement)
+            meta = dict(self.connection.execute("SELECT name, value FROM meta"))
+            for name, value, default in (('algorithm', algorithm, digest.DEFAULT_ALGORITHM),
+                                         ('format', format, serialization.DEFAULT_FORMAT)):
+                if name not in meta:
+                    meta[name] = default if value is None else value
+                    self.connection.execute("INSERT INTO meta (name, value) VALUES (?, ?)",
+                                            (name, meta[name]))
+                elif value is not None and value != meta[name]:
+                    raise ValueError("%s is %s, not %s" % (name, meta[name], value))
+        self.algorithm = meta['algorithm']
+        self.format = meta['format']
+        self.head = self.get_head(head_name)
+
+    def key(self, token):
+        raw = raw_token(token)
+        if raw is None:
+            raise ValueError("Not a digest token: %r" % (token,))
+        return sqlite3.Binary(raw)
+
+    def token(self, raw):
+        token = digest.Token(raw)
+        return token if self.binary_tokens else token.hex()
+
+    def populate(self, token_structure_pairs):
+        """
+        Inserts the `token_structure_pairs`, `batch_size` to a transaction.
+
+        Sets `head` to the last token seen, if any.
+        """
+        serializer, key = self.serializer, self.key
+        batch = []
+        token = None
+        for token, structure in token_structure_pairs:
+            batch.append((key(token), sqlite3.Binary(serializer(structure))))
+            if len(batch) >= self.batch_size:
+                with self.connection:
+                    self.connection.executemany(self.INSERT, batch)
+                batch = []
+        if batch:
+            with self.connection:
+                self.connection.executemany(self.INSERT, batch)
+        if token is not None:
+            self.head = token
+
+    def find(self, key):
+        """
+        Returns the CBOR of the structure for the token `key`, or `None`.
+        """
+        raw = raw_token(key)
+        if raw is None:
+            return None
+        row = self.connection.execute(self.SELECT, (sqlite3.Binary(raw),)).fetchone()
+        return None if row is None else bytes(row[0])
+
+    def get(self, key):
+        """
+        Returns the structure for the token `key`, or `None`.
+        """
+        found = self.find(key)
+        return None if found is None else self.deserializer(found)
+
+    def __getitem__(self, key):
+        """
+        Returns the structure for the token `key`.
+        """
+        found = self.find(key)
+        if found is None:
+            raise KeyError(key)
+        return self.deserializer(found)
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+
+    def get_head(self, name):
+        """
+        Returns the head token recorded under `name`, or `None`.
+        """
+        row = self.connection.execute("SELECT token FROM heads WHERE name = ?",
+                                      (name,)).fetchone()
+        return None if row is None else self.token(bytes(row[0]))
+
+    def set_head(self, name, token):
+        """
+        Records `token` as the head under `name`.
+        """
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO heads (name, token) VALUES (?, ?)",
+                                    (name, self.key(token)))
+
+    def commit(self):
+        """
+        Records the `head`, if any, under `head_name`.
+        """
+        if self.head is not None:
+            self.set_head(self.head_name, self.head)
+
+    def close(self):
+        """
+        Records the `head` and closes the database.
+        """
+        self.commit()
+        self.connection.close()
+
+
+class LooseObjectStructure(Structure):
+    """
+    Stores merkified structure in a directory at `root`, one file per token, in the manner of
+    git's loose objects: the CBOR of the structure of token "abcdef..." (see
+    `merky.serialization.cbor_serializer`) is in the file "ab/cdef..." under `root`.
+
+    `populate()` writes only the tokens not already there, each to a temporary file that is
+    then moved into place unless another has landed there first (see `replacing_file`), so
+    that a file is never seen half-written and any number of processes can populate the same
+    directory at once.  Nothing is read until asked for by `get()` or `__getitem__`.
+
+    As with `SQLiteStructure`, `populate()` sets `head` to the last token, and the `head` is
+    recorded by `commit()` and `close()` under the name `head_name` (in "heads/<name>"), from
+    where it is read when the directory is opened; other heads can be kept by `set_head()`
+    and `get_head()`.  The `algorithm` and `format`, recorded in "meta.json", default to those
+    recorded, if any, or else to the usual defaults; a `ValueError` is raised if they differ
+    from those recorded.  Tokens must be digests, given as hex strings or
+    `merky.digest.Token` objects either way; with `binary_tokens`, the `head` is a
+    `merky.digest.Token`.
+    """
+    def __init__(self, root, algorithm=None, format=None, binary_tokens=False,
+                 head_name='head'):
+        self.root = root
+        self.binary_tokens = binary_tokens
+        self.head_name = head_name
+        self.serializer = serialization.cbor_serializer(sort=False)
+        self.deserializer = serialization.cbor_deserializer()
+        self.makedirs(os.path.join(root, 'heads'))
+        meta_path = os.path.join(root, 'meta.json')
+        meta = self.read_meta(meta_path)
+        if meta is None:
+            # Another process may be creating the directory too: the first "meta.json" to
+            # land is kept, and read back.
+            created = {'algorithm': digest.DEFAULT_ALGORITHM if algorithm is None else algorithm,
+                       'format': serialization.DEFAULT_FORMAT if format is None else format}
+            with replacing_file(meta_path, keep_existing=True) as f:
+                f.write(digest.encoded(serialization.json_serializer()(created)))
+            meta = self.read_meta(meta_path)
+        for name, value in (('algorithm', algorithm), ('format', format)):
+            if value is not None and value != meta[name]:
+                raise ValueError("%s is %s, not %s" % (name, meta[name], value))
+        self.algorithm = meta['algorithm']
+        self.format = meta['format']
+        self.head = self.get_head(head_name)
+
+    @staticmethod
+    def makedirs(path):
+        # No exist_ok on python 2, and another process may be making the same directory.
+        try:
+            os.makedirs(path)
+        except OSError:
+            if not os.path.isdir(path):
+                raise
+
+    @staticmethod
+    def read_meta(path):
+        """
+        Returns the dict recorded in the "meta.json" at `path`, or `None` if there is none.
+        """
+        try:
+            with io.open(path, mode='rb') as f:
+                return json.loads(f.read().decode('utf-8'))
+        except (IOError, OSError):
+            return None
+
+    @staticmethod
+    def name_of(token):
+        """
+        Returns the hex string of `token`, or `None` if it isn't a digest.
+        """
+        raw = raw_token(token)
+        return binascii.hexlify(raw).decode('ascii') if raw else None
+
+    def path_of(self, token):
+        """
+        Returns the path of the file for `token`, or `None` if it isn't a digest.
+        """
+        name = self.name_of(token)
+        return None if name is None else os.path.join(self.root, name[:2], name[2:])
+
+    def token(self, name):
+        token = digest.Token.fromhex(name)
+        return token if self.binary_tokens else token.hex()
+
+    def populate(self, token_structure_pairs):
+        """
+        Writes a file for each of the `token_structure_pairs` whose token has none yet.
+
+        Sets `head` to the last token seen, if any.
+        """
+        shards = set()
+        token = None
+        for token, structure in token_structure_pairs:
+            path = self.path_of(token)
+            if path is None:
+                raise ValueError("Not a digest token: %r" % (token,))
+            if os.path.exists(path):
+                continue
+            shard = os.path.dirname(path)
+            if shard not in shards:
+                self.makedirs(shard)
+                shards.add(shard)
+            with replacing_file(path, keep_existing=True) as f:
+                f.write(self.serializer(structure))
+        if token is not None:
+            self.head = token
+
+    def find(self, key):
+        """
+        Returns the CBOR of the structure for the token `key`, or `None`.
+        """
+        path = self.path_of(key)
+        if path is None:
+            return None
+        try:
+            with io.open(path, mode='rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def get(self, key):
+        """
+        Returns the structure for the token `key`, or `None`.
+        """
+        found = self.find(key)
+        return None if found is None else self.deserializer(found)
+
+    def __getitem__(self, key):
+        """
+        Returns the structure for the token `key`.
+        """
+        found = self.find(key)
+        if found is None:
+            raise KeyError(key)
+        return self.deserializer(found)
+
+    def __len__(self):
+        return sum(len([name for name in os.listdir(os.path.join(self.root, shard))
+                        if not name.startswith('.')])
+                   for shard in os.listdir(self.root) if len(shard) == 2)
+
+    def get_head(self, name):
+        """
+        Returns the head token recorded under `name`, or `None`.
+        """
+        try:
+            with io.open(os.path.join(self.root, 'heads', name), mode='rb') as f:
+                return self.token(f.read().decode('ascii').strip())
+        except (IOError, OSError):
+            return None
+
+    def set_head(self, name, token):
+        """
+        Records `token` as the head under `name`.
+        """
+        hexed = self.name_of(token)
+        if hexed is None:
+            raise ValueError("Not a digest token: %r" % (token,))
+        with replacing_file(os.path.join(self.root, 'heads', name)) as f:
+            f.write(digest.encoded(hexed + u'\n'))
+
+    def commit(self):
+        """
+        Records the `head`, if any, under `head_name`.
+        """
+        if self.head is not None:
+            self.set_head(self.head_name, self.head)
+
+    def close(self):
+        """
+        Records the `head`.
+        """
+        self.commit()
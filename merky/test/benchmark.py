@@ -0,0 +1,608 @@
+"""
+Rough timing benchmarks for merky internals.
+
+Run as a script, naming the benchmarks to run (or none, to run them all):
+
+    python -m merky.test.benchmark [name ...]
+
+Each benchmark prints one line per variant measured.  Timings are the best of
+several repetitions, so they are comparable between variants within a run but
+not necessarily between machines.
+"""
+import collections
+import io
+import sys
+import timeit
+
+import six
+
+from merky import digest
+from merky import serialization
+from merky import transformer
+from merky import tree
+from merky import util
+from merky.cases import attrgraph
+from merky.store import structure
+from . import samples
+
+BENCHMARKS = collections.OrderedDict()
+
+def benchmark(func):
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def best_time(func, number, repeat=5):
+    """
+    Returns the best time in seconds for a single call of `func`.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(name, variant, value, unit):
+    six.print_("%-12s %-28s %12.3f %s" % (name, variant, value, unit))
+
+
+def sample_structures():
+    """
+    The natural forms of every structure in `merky.test.samples`.
+    """
+    return [getattr(samples, name) for name in sorted(dir(samples))
+            if name.endswith('_NATURAL')]
+
+
+def nodes(structure):
+    """
+    Every node of a natural `structure`, depth-first, including the structure itself.
+    """
+    stack = [structure]
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, dict):
+            stack.extend(six.itervalues(node))
+        elif isinstance(node, (list, tuple)):
+            stack.extend(node)
+
+
+def records(count, width=8):
+    """
+    A JSON-like list of `count` records, each a dict of `width` fields plus a nested
+    list and dict, as one would get from decoding a typical JSON document.
+    """
+    return [dict([("field%d" % f, "value %d/%d" % (r, f)) for f in range(width)] +
+                 [("id", r), ("active", r % 2 == 0), ("score", None),
+                  ("tags", ["tag%d" % (r % 7), "common"]),
+                  ("owner", {"name": "owner %d" % (r % 13), "level": r % 3})])
+            for r in range(count)]
+
+
+@benchmark
+def dispatch():
+    """
+    Per-node cost of handler dispatch over the sample structures.
+    """
+    items = [n for s in sample_structures() for n in nodes(s)]
+    handlers = (tree.string_handler,
+                tree.map_handler,
+                tree.seq_handler,
+                tree.default_handler)
+    for variant, dispatcher in (("probing", tree.dispatcher(*handlers)),
+                                ("type-cached", tree.caching_dispatcher(*handlers))):
+        def run():
+            for item in items:
+                dispatcher(item)
+        report("dispatch", variant, best_time(run, 200) / len(items) * 1e9, "ns/node")
+
+
+@benchmark
+def walk():
+    """
+    Transform time of JSON-native records with the generic and the JSON walker.
+    """
+    structure = records(2000)
+    t = transformer.Transformer()
+    for variant, walker in (("generic", tree.walker), ("json", tree.json_walker)):
+        def run():
+            for _ in walker(structure, t.dispatcher, t.tokenizer):
+                pass
+        report("walk", variant, best_time(run, 3) * 1e3, "ms")
+
+
+def peak_memory(func):
+    """
+    Returns the peak memory allocated (in bytes) while calling `func`.
+    """
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def deep(depth, width=10):
+    """
+    A structure nested `depth` levels deep, with `width` strings at each level.
+    """
+    structure = []
+    for level in range(depth):
+        structure = {"level %d" % level: ["member %d" % i for i in range(width)],
+                     "nested": structure}
+    return structure
+
+
+@benchmark
+def token_of():
+    """
+    Peak memory of consuming a whole transform versus computing only the top token.
+    """
+    t = transformer.Transformer()
+    def consume(structure):
+        for _ in t.transform(structure):
+            pass
+    for shape, make in (("long sequence", lambda: (str(i) for i in range(200000))),
+                        ("deep (500)", lambda: deep(500)),
+                        ("deep (2000)", lambda: deep(2000))):
+        for variant, func in (("transform", consume), ("token_of", t.token_of)):
+            structure = make()
+            report("token_of", "%s %s" % (shape, variant),
+                   peak_memory(lambda: func(structure)) / 1024.0, "KiB")
+
+
+@benchmark
+def algorithms():
+    """
+    Hashing throughput of each registered algorithm, for small and large nodes.
+    """
+    names = ['sha1', 'sha256', 'blake2b', 'blake2b-160', 'blake2s']
+    for size, label in ((64, "64B"), (1024, "1KiB"), (1 << 20, "1MiB")):
+        data = b'x' * size
+        number = max(1, (1 << 24) // size)
+        for name in names:
+            factory = digest.get_algorithm(name)
+            elapsed = best_time(lambda: factory(data).hexdigest(), number)
+            report("algorithms", "%s %s" % (name, label), size / elapsed / (1 << 20), "MiB/s")
+
+
+def graph(nodes, fanout=10):
+    """
+    An `AttributeGraph` of `nodes` distinct nodes, each with a small attrs dict.
+    """
+    ids = iter(range(nodes))
+    def build(size, depth):
+        attrs = {"id": next(ids), "depth": depth}
+        members = {}
+        size -= 1
+        for i in range(fanout):
+            share = size // (fanout - i)
+            if share:
+                members["member %d" % i] = build(share, depth + 1)
+                size -= share
+        return attrgraph.AttributeGraph(attrs, members)
+    return build(nodes, 0)
+
+
+@benchmark
+def store_memory(nodes=1000000):
+    """
+    Memory held by an in-memory store of a graph with hex versus binary tokens.
+    """
+    g = graph(nodes)
+    import tracemalloc
+    for variant, binary in (("hex", False), ("binary", True)):
+        t = transformer.AnnotationTransformer(binary_tokens=binary)
+        tracemalloc.start()
+        store = structure.InMemoryStructure(binary_tokens=binary)
+        store.populate(t.transform(g))
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        report("store_memory", "%s (%d tokens)" % (variant, len(store.tokenmap)),
+               held / float(1 << 20), "MiB")
+        del store
+
+
+@benchmark
+def fused():
+    """
+    Peak memory and time of tokenizing one wide node, serialized whole versus in chunks.
+    """
+    node = collections.OrderedDict(("key %06d" % i, "value %d" % i) for i in range(200000))
+    for variant, tokenizer in (
+            ("whole", digest.hexdigester(serialization.json_serializer())),
+            ("fused", digest.fused_digester(serialization.json_chunker()))):
+        report("fused", "%s peak" % variant,
+               peak_memory(lambda: tokenizer(node)) / 1024.0, "KiB")
+        report("fused", "%s time" % variant, best_time(lambda: tokenizer(node), 5) * 1e3, "ms")
+
+
+@benchmark
+def wide_dicts():
+    """
+    Time to build and tokenize the normal form of wide dicts, sorting again when collecting
+    and serializing versus relying on the order `map_handler` already gave.
+    """
+    for width in (10000, 100000):
+        node = dict(("key %d" % (i * 7919 % width), "value %d" % i) for i in range(width))
+        items = list(util.flatten(sorted(six.iteritems(node))))
+        for variant, collector, sort in (("sorted", util.ordered_map, True),
+                                         ("presorted", util.presorted_map, False)):
+            tokenizer = digest.fused_digester(serialization.json_chunker(sort=sort))
+            elapsed = best_time(lambda: tokenizer(collector(items)), 5)
+            report("wide_dicts", "%s (%d keys)" % (variant, width), elapsed * 1e3, "ms")
+
+
+@benchmark
+def formats():
+    """
+    Serialization throughput of JSON versus CBOR, over the normal forms of typical records
+    and of text-heavy records, and the time to load a store written in each.
+    """
+    text = " ".join(["Qu'est-ce que c'est? \"Ça\", dit-il;\ttab\u00e9"] * 20)
+    for shape, natural in (("records", records(2000)),
+                           ("text", [{"id": i, "note": text, "title": text[:40]}
+                                     for i in range(2000)])):
+        normals = [normal for _, normal in transformer.Transformer().transform(natural)]
+        size = sum(len(digest.encoded(serialization.json_serializer()(n))) for n in normals)
+        for variant, serializer in (("json", serialization.json_serializer(sort=False)),
+                                    ("cbor", serialization.cbor_serializer(sort=False))):
+            def run():
+                for normal in normals:
+                    digest.encoded(serializer(normal))
+            report("formats", "%s %s" % (shape, variant),
+                   size / best_time(run, 5) / (1 << 20), "MiB/s")
+        for variant, writer, reader, stream in (
+                ("json load", structure.JSONStreamWriteStructure,
+                 structure.JSONStreamReadStructure, six.StringIO()),
+                ("cbor load", structure.CBORStreamWriteStructure,
+                 structure.CBORStreamReadStructure, io.BytesIO())):
+            store = writer(stream)
+            store.populate(transformer.Transformer().transform(natural))
+            store.close()
+            def load():
+                stream.seek(0)
+                reader(stream)
+            report("formats", "%s %s" % (shape, variant), best_time(load, 5) * 1e3, "ms")
+
+
+@benchmark
+def templates():
+    """
+    Serialization time per row of the normal forms of records sharing a set of keys,
+    without and with templates.
+    """
+    for width in (8, 32):
+        normals = [normal for _, normal in transformer.Transformer().transform(records(5000, width))
+                   if isinstance(normal, dict)]
+        for variant, serializer in (
+                ("plain", serialization.json_serializer(sort=False)),
+                ("templated", serialization.templated_json_serializer(sort=False))):
+            def run():
+                for normal in normals:
+                    serializer(normal)
+            run()
+            report("templates", "%s (%d fields)" % (variant, width),
+                   best_time(run, 5) / len(normals) * 1e9, "ns/row")
+
+
+@benchmark
+def ndarray():
+    """
+    Transform time of a NumPy array, iterated as a nested list versus hashed by buffer,
+    whole or in 64KiB chunks.  Skipped without NumPy.
+    """
+    try:
+        import numpy
+    except ImportError:
+        six.print_("ndarray: numpy unavailable")
+        return
+    array = numpy.random.RandomState(0).random_sample((1000, 100))
+    t = transformer.Transformer()
+    for variant, item in (("as list", array.tolist()),
+                          ("buffer", array),
+                          ("chunked", util.chunked(array, 1 << 16))):
+        report("ndarray", variant, best_time(lambda: t.token_of(item), 3) * 1e3, "ms")
+
+
+@benchmark
+def chunked_sequences():
+    """
+    Transform time of a long list, whole versus chunked, and the number and total serialized
+    size of the new structures a store must take in after inserting one member at its front.
+    """
+    natural = ["member %d" % i for i in range(200000)]
+    edited = ["inserted"] + natural
+    serializer = serialization.json_serializer()
+    for variant, t in (("whole", transformer.Transformer()),
+                       ("chunked (64)", transformer.Transformer(chunk_sequences=64))):
+        report("chunked", "%s time" % variant,
+               best_time(lambda: list(t.transform(natural)), 3) * 1e3, "ms")
+        before = set(token for token, _ in t.transform(natural))
+        new = [normal for token, normal in t.transform(edited) if token not in before]
+        report("chunked", "%s insert (%d new)" % (variant, len(new)),
+               sum(len(digest.encoded(serializer(n))) for n in new) / 1024.0, "KiB")
+
+
+@benchmark
+def chunked_strings():
+    """
+    Transform time of a graph node holding a 4MB document among its attrs, whole versus
+    chunked, and the total serialized size of the new structures after editing one line.
+    """
+    doc = "".join("line %d of a long document\n" % i for i in range(160000))
+    edited = doc.replace("line 80000 ", "edited line ")
+    serializer = serialization.json_serializer()
+    for variant, t in (("whole", transformer.AnnotationTransformer()),
+                       ("chunked (16K)", transformer.AnnotationTransformer(chunk_strings=16384))):
+        natural = attrgraph.AttributeGraph({"doc": doc, "title": "long"})
+        report("chunked", "%s time" % variant,
+               best_time(lambda: list(t.transform(natural)), 3) * 1e3, "ms")
+        before = set(token for token, _ in t.transform(natural))
+        natural.attrs["doc"] = edited
+        new = [normal for token, normal in t.transform(natural) if token not in before]
+        report("chunked", "%s edit (%d new)" % (variant, len(new)),
+               sum(len(digest.encoded(serializer(n))) for n in new) / 1024.0, "KiB")
+
+
+@benchmark
+def inline_below():
+    """
+    Transform time, node count and JSON store size for rows of small nested structures,
+    tokenizing every structure versus inlining those whose serialization is below a threshold.
+    """
+    natural = [{"id": r, "point": {"x": r, "y": r * 2}, "tags": ["tag%d" % r, "common"],
+                "name": "row %d" % r, "notes": ["note %d/%d" % (r, n) for n in range(r % 4)]}
+               for r in range(20000)]
+    for threshold in (None, 64, 256):
+        t = transformer.Transformer(inline_below=threshold)
+        variant = "all" if threshold is None else "below %d" % threshold
+        report("inline", "%s time" % variant, best_time(lambda: list(t.transform(natural)), 3) * 1e3,
+               "ms")
+        stream = six.StringIO()
+        store = structure.JSONStreamWriteStructure(stream)
+        store.populate(t.transform(natural))
+        store.close()
+        report("inline", "%s nodes" % variant, len(store.tokenmap), "")
+        report("inline", "%s store" % variant, len(stream.getvalue()) / float(1 << 20), "MiB")
+
+
+@benchmark
+def exclusion():
+    """
+    Transform time and garbage collections of the `ExcludeAnnotationTransformer` over records
+    with every other one excluded, wrapping the members of excluded structures versus keeping
+    the exclusion on the walker's stack.
+    """
+    import gc
+    natural = [util.annotate(r) if i % 2 else r for i, r in enumerate(records(5000))]
+    t = transformer.ExcludeAnnotationTransformer()
+    for variant, walk in (
+            ("wrapping", lambda: tree.walker(natural, tree.exclude_annotation_dispatcher,
+                                             t.tokenizer)),
+            ("stacked", lambda: tree.exclusion_walker(natural, tree.annotation_dispatcher,
+                                                      t.tokenizer))):
+        report("exclusion", "%s time" % variant, best_time(lambda: list(walk()), 3) * 1e3, "ms")
+        gc.collect()
+        before = sum(stats["collections"] for stats in gc.get_stats())
+        list(walk())
+        report("exclusion", "%s collections" % variant,
+               sum(stats["collections"] for stats in gc.get_stats()) - before, "")
+
+
+@benchmark
+def jsonl_store(nodes=100000):
+    """
+    Peak memory and time of writing a graph to a file with the JSON file writer, which holds
+    every pair until `close()`, versus the JSON Lines writer, which writes each as it comes.
+    """
+    import os
+    import shutil
+    import tempfile
+    g = graph(nodes)
+    t = transformer.AnnotationTransformer(binary_tokens=True)
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, "store")
+        for variant, writer in (("json", structure.JSONFileWriteStructure),
+                                ("jsonl", structure.JSONLinesFileWriteStructure)):
+            def run():
+                store = writer(path)
+                store.populate(t.transform(g))
+                store.close()
+            report("jsonl_store", "%s peak" % variant, peak_memory(run) / float(1 << 20), "MiB")
+            report("jsonl_store", "%s time" % variant, best_time(run, 1, 3) * 1e3, "ms")
+    finally:
+        shutil.rmtree(workdir)
+
+
+@benchmark
+def mapped_store(nodes=100000):
+    """
+    Time and peak memory of opening a JSON Lines file of a graph and reading one node, loading
+    the whole file versus memory-mapping it; and the time of a `get()` from each.
+    """
+    import os
+    import shutil
+    import tempfile
+    g = graph(nodes)
+    t = transformer.AnnotationTransformer(unique=True)
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, "store.jsonl")
+        store = structure.JSONLinesFileWriteStructure(path)
+        store.populate(t.transform(g))
+        store.close()
+        tokens = [token for i, (token, _) in enumerate(t.transform(g)) if i % 1000 == 0]
+        structure.JSONLinesMappedReadStructure(path).close()
+        for variant, reader in (("loaded", structure.JSONLinesFileReadStructure),
+                                ("mapped", structure.JSONLinesMappedReadStructure)):
+            def run():
+                return reader(path).get(tokens[0])
+            report("mapped_store", "%s open" % variant, best_time(run, 1, 3) * 1e3, "ms")
+            report("mapped_store", "%s open peak" % variant,
+                   peak_memory(run) / float(1 << 20), "MiB")
+            store = reader(path)
+            report("mapped_store", "%s get" % variant,
+                   best_time(lambda: [store.get(token) for token in tokens], 10) * 1e6
+                   / len(tokens), "us")
+    finally:
+        shutil.rmtree(workdir)
+
+
+@benchmark
+def pack_store(nodes=100000):
+    """
+    Size on disk, time to open and time per `get()` of a graph in a JSON Lines file with its
+    index versus a pack, uncompressed and compressed, with its index.
+    """
+    import os
+    import shutil
+    import tempfile
+    g = graph(nodes)
+    t = transformer.AnnotationTransformer(binary_tokens=True)
+    source = structure.InMemoryStructure(binary_tokens=True)
+    source.populate(t.transform(g))
+    tokens = list(source.tokenmap)[::1000]
+    workdir = tempfile.mkdtemp()
+    try:
+        jsonl = os.path.join(workdir, "store.jsonl")
+        writer = structure.JSONLinesFileWriteStructure(jsonl)
+        writer.populate(source.tokenmap.items())
+        writer.head = source.head
+        writer.close()
+        variants = [("jsonl", jsonl, lambda: structure.JSONLinesMappedReadStructure(jsonl))]
+        for compress in (False, True):
+            path = os.path.join(workdir, "store-%d.pack" % compress)
+            elapsed = best_time(lambda: structure.write_pack(source, path, compress=compress),
+                                1, 3)
+            report("pack_store", "pack%s write" % (" zlib" if compress else ""),
+                   elapsed * 1e3, "ms")
+            variants.append(("pack%s" % (" zlib" if compress else ""), path,
+                             lambda path=path: structure.PackFileReadStructure(path)))
+        for variant, path, reader in variants:
+            reader().close()
+            size = os.path.getsize(path) + os.path.getsize(path + ".idx")
+            report("pack_store", "%s size" % variant, size / float(1 << 20), "MiB")
+            report("pack_store", "%s open" % variant, best_time(lambda: reader().close(), 10)
+                   * 1e3, "ms")
+            store = reader()
+            report("pack_store", "%s get" % variant,
+                   best_time(lambda: [store.get(token) for token in tokens], 10) * 1e6
+                   / len(tokens), "us")
+            store.close()
+    finally:
+        shutil.rmtree(workdir)
+
+
+@benchmark
+def sqlite_store(nodes=100000):
+    """
+    Time to write a graph, open the store, `get()` a node, and store the change to one node
+    (see `merky.transformer.Transformer.retransform`), with the JSON file store, read back
+    and written whole on every save, versus the SQLite store.
+    """
+    import os
+    import shutil
+    import tempfile
+    g = graph(nodes)
+    t = transformer.AnnotationTransformer(binary_tokens=True)
+    source = structure.InMemoryStructure(binary_tokens=True)
+    source.populate(t.transform(g))
+    tokens = list(source.tokenmap)[::1000]
+    workdir = tempfile.mkdtemp()
+    try:
+        json_path = os.path.join(workdir, "store.json")
+        sqlite_path = os.path.join(workdir, "store.sqlite")
+        def write_json(pairs):
+            store = structure.JSONFileWriteStructure(json_path)
+            store.populate(pairs)
+            store.close()
+        def write_sqlite(pairs):
+            store = structure.SQLiteStructure(sqlite_path)
+            store.populate(pairs)
+            store.close()
+        for variant, write, reader in (
+                ("json", write_json, lambda: structure.JSONFileReadStructure(json_path)),
+                ("sqlite", write_sqlite, lambda: structure.SQLiteStructure(sqlite_path))):
+            report("sqlite_store", "%s write" % variant,
+                   best_time(lambda: write(source.tokenmap.items()), 1, 3) * 1e3, "ms")
+            report("sqlite_store", "%s open" % variant, best_time(reader, 1, 3) * 1e3, "ms")
+            store = reader()
+            report("sqlite_store", "%s get" % variant,
+                   best_time(lambda: [store.get(token) for token in tokens], 10) * 1e6
+                   / len(tokens), "us")
+            # Retransform one node, deep in the graph; the JSON store has to be read and
+            # written whole to take the change.
+            path = [1, "member 9", 1, "member 9", 0, "changed"]
+            def update():
+                store = reader()
+                pairs = t.retransform(store.head, store.get, path, True)
+                if variant == "json":
+                    pairs = list(store.tokenmap.items()) + list(pairs)
+                write(pairs)
+            report("sqlite_store", "%s update" % variant, best_time(update, 1, 3) * 1e3, "ms")
+            report("sqlite_store", "%s size" % variant,
+                   os.path.getsize(json_path if variant == "json" else sqlite_path)
+                   / float(1 << 20), "MiB")
+    finally:
+        shutil.rmtree(workdir)
+
+
+@benchmark
+def loose_store(nodes=20000):
+    """
+    Time to write a graph, write it again, open the store, `get()` a node, and store the change
+    to one node, with the JSON file store versus loose objects.
+    """
+    import os
+    import shutil
+    import tempfile
+    g = graph(nodes)
+    t = transformer.AnnotationTransformer(binary_tokens=True)
+    source = structure.InMemoryStructure(binary_tokens=True)
+    source.populate(t.transform(g))
+    tokens = list(source.tokenmap)[::100]
+    workdir = tempfile.mkdtemp()
+    try:
+        json_path = os.path.join(workdir, "store.json")
+        loose_path = os.path.join(workdir, "objects")
+        def write_json(pairs):
+            store = structure.JSONFileWriteStructure(json_path)
+            store.populate(pairs)
+            store.close()
+        def write_loose(pairs):
+            store = structure.LooseObjectStructure(loose_path)
+            store.populate(pairs)
+            store.close()
+        for variant, write, reader in (
+                ("json", write_json, lambda: structure.JSONFileReadStructure(json_path)),
+                ("loose", write_loose, lambda: structure.LooseObjectStructure(loose_path))):
+            elapsed = best_time(lambda: write(source.tokenmap.items()), 1, 1)
+            report("loose_store", "%s write" % variant, elapsed * 1e3, "ms")
+            report("loose_store", "%s rewrite" % variant,
+                   best_time(lambda: write(source.tokenmap.items()), 1, 3) * 1e3, "ms")
+            report("loose_store", "%s open" % variant, best_time(reader, 1, 3) * 1e3, "ms")
+            store = reader()
+            report("loose_store", "%s get" % variant,
+                   best_time(lambda: [store.get(token) for token in tokens], 10) * 1e6
+                   / len(tokens), "us")
+            path = [1, "member 9", 1, "member 9", 0, "changed"]
+            def update():
+                store = reader()
+                pairs = t.retransform(store.head, store.get, path, True)
+                if variant == "json":
+                    pairs = list(store.tokenmap.items()) + list(pairs)
+                write(pairs)
+            report("loose_store", "%s update" % variant, best_time(update, 1, 3) * 1e3, "ms")
+    finally:
+        shutil.rmtree(workdir)
+
+
+def main(names):
+    for name in (names or BENCHMARKS):
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,109 @@
+import pickle
+
+from nose import tools
+from six.moves import StringIO
+from . import benchmark
+from . import samples
+from merky import digest
+from merky.cases import attrgraph
+from merky.cases import tokendict
+from merky.cases import walker
+from merky.store import structure
+import merky
+
+HEX = '1fdd21a94597f8df08e75f67100e1fdcf5714a14'
+
+
+def test_token():
+    t = digest.Token.fromhex(HEX)
+    tools.assert_equal(20, len(t))
+    tools.assert_equal(HEX, t.hex())
+    tools.assert_equal(HEX, str(t))
+    tools.assert_equal("Token('%s')" % HEX, repr(t))
+    tools.assert_equal(digest.Token.fromhex(HEX), t)
+    tools.assert_equal(hash(bytes(t)), hash(t))
+    tools.assert_not_equal(HEX, t)
+    tools.assert_equal(t, pickle.loads(pickle.dumps(t)))
+    tools.assert_true(isinstance(pickle.loads(pickle.dumps(t)), digest.Token))
+
+
+def hexed(value):
+    if isinstance(value, digest.Token):
+        return value.hex()
+    if isinstance(value, dict):
+        return type(value)((k, hexed(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [hexed(v) for v in value]
+    return value
+
+
+def test_same_tokens():
+    for cls in (merky.Transformer, merky.AnnotationTransformer, merky.ExcludeAnnotationTransformer):
+        for kw in ({}, {"stream_sequences": True}):
+            plain = cls(**kw)
+            binary = cls(binary_tokens=True, **kw)
+            for s in benchmark.sample_structures():
+                pairs = list(binary.transform(s))
+                for token, _ in pairs:
+                    tools.assert_true(isinstance(token, digest.Token))
+                tools.assert_equal(list(plain.transform(s)),
+                                   [(t.hex(), hexed(c)) for t, c in pairs])
+                tools.assert_equal(plain.token_of(s), binary.token_of(s).hex())
+
+
+def test_tokens_as_leaves():
+    t = digest.Token.fromhex(HEX)
+    for cls in (merky.Transformer, merky.AnnotationTransformer, merky.ExcludeAnnotationTransformer):
+        tools.assert_equal([tok for tok, _ in cls().transform([HEX, {"a": HEX}])],
+                           [tok for tok, _ in cls().transform([t, {"a": merky.annotate(t)}])])
+
+
+def test_walker():
+    store = structure.InMemoryStructure(binary_tokens=True)
+    store.populate(merky.Transformer(binary_tokens=True).transform(
+        samples.WALKER_DICT_CASE_NATURAL))
+    expected = samples.WALKER_DICT_CASE_TOKENS
+    w = walker.Walker(store.get, store.head)
+    tools.assert_equal(expected.token, w.token.hex())
+    tools.assert_equal(expected["list"][2].member, hexed(w["list"][2].structure))
+    # Lookups by hex string work too.
+    tools.assert_equal(w.structure, store.get(expected.token))
+    tools.assert_equal(w.structure, store[expected.token])
+    tools.assert_equal(None, store.get("not a token"))
+
+
+def versions():
+    static = attrgraph.AttributeGraph({"unchanging": "eternal"}, {})
+    return tokendict.TokenDict({
+        "v0": attrgraph.AttributeGraph({"version": 0}, {"static": static}),
+        "v1": attrgraph.AttributeGraph({"version": 1}, {"static": static,
+                                                        "new": attrgraph.AttributeGraph()})})
+
+
+def restore(reader, head):
+    restored = tokendict.TokenDict.from_token(head, reader, attrgraph.AttributeGraph.from_token)
+    tools.assert_equal({"version": 1}, dict(restored["v1"].attrs))
+    tools.assert_equal(["new", "static"], sorted(restored["v1"].members.keys()))
+    tools.assert_equal({"unchanging": "eternal"},
+                       dict(restored["v0"].members["static"].attrs))
+
+
+def test_json_round_trip():
+    stream = StringIO()
+    writer = structure.JSONStreamWriteStructure(stream)
+    writer.populate(merky.AnnotationTransformer(binary_tokens=True).transform(versions()))
+    restore(writer.get, writer.head)
+    writer.close()
+
+    # The file is as if written with hex tokens.
+    expected = StringIO()
+    plain = structure.JSONStreamWriteStructure(expected)
+    plain.populate(merky.AnnotationTransformer().transform(versions()))
+    plain.close()
+    tools.assert_equal(expected.getvalue(), stream.getvalue())
+
+    for binary in (False, True):
+        stream.seek(0)
+        reader = structure.JSONStreamReadStructure(stream, binary_tokens=binary)
+        tools.assert_equal(binary, isinstance(reader.head, digest.Token))
+        restore(reader.get, reader.head)
@@ -0,0 +1,74 @@
+import array
+import hashlib
+import io
+
+from nose import tools
+from nose.plugins.skip import SkipTest
+from six.moves import StringIO
+from . import benchmark
+from . import stream_test
+from merky import serialization
+from merky.store import structure
+import merky
+
+DATA = b'\x00\x01binary\xff'
+TOKEN = hashlib.sha1(b'\x49' + DATA).hexdigest()
+
+
+def buffers():
+    return [DATA, bytearray(DATA), memoryview(DATA), array.array('B', DATA),
+            memoryview(b'xx' + DATA)[2:]]
+
+
+def test_tokens():
+    for cls in stream_test.TRANSFORMERS:
+        for kw in ({}, {"format": "cbor"}):
+            t = cls(**kw)
+            for buf in buffers():
+                tools.assert_equal([(TOKEN, buf)], list(t.transform(buf)))
+                pairs = list(t.transform({"data": merky.annotate(buf), "name": "x"}))
+                tools.assert_equal((TOKEN, buf), pairs[0])
+                tools.assert_equal(TOKEN, pairs[-1][1]["data"])
+
+
+def test_not_contiguous():
+    view = memoryview(bytearray(b'a-b-c-'))[::2]
+    tools.assert_equal(merky.Transformer().token_of(b'abc'), merky.Transformer().token_of(view))
+
+
+def test_cbor():
+    s = serialization.cbor_serializer()
+    for buf in buffers():
+        tools.assert_equal(s(DATA), s(buf))
+    tools.assert_equal(DATA, serialization.cbor_deserializer()(s(bytearray(DATA))))
+
+
+def test_no_copy():
+    try:
+        import tracemalloc
+    except ImportError:
+        raise SkipTest("tracemalloc unavailable")
+    data = bytearray(8 << 20)
+    t = merky.Transformer()
+    peak = benchmark.peak_memory(lambda: t.token_of(data))
+    tools.assert_true(peak < 64 * 1024, "peak of %d bytes" % peak)
+
+
+def round_trip(writer, reader, stream):
+    store = writer(stream)
+    t = merky.Transformer()
+    natural = {"a": bytearray(DATA), "b": [array.array('B', DATA), "text"]}
+    store.populate(t.transform(natural))
+    store.close()
+    for binary in (False, True):
+        stream.seek(0)
+        read = reader(stream, binary_tokens=binary)
+        tools.assert_equal(DATA, read.get(TOKEN))
+        tools.assert_true(isinstance(read.get(TOKEN), bytes))
+        tools.assert_equal(TOKEN, read.get(read.get(read.head)["b"])[0])
+
+
+def test_stores():
+    round_trip(structure.JSONStreamWriteStructure, structure.JSONStreamReadStructure, StringIO())
+    round_trip(structure.CBORStreamWriteStructure, structure.CBORStreamReadStructure,
+               io.BytesIO())
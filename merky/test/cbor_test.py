@@ -0,0 +1,85 @@
+import binascii
+import collections
+import io
+
+from nose import tools
+from . import benchmark
+from . import binary_token_test
+from . import fused_test
+from . import stream_test
+from . import words
+from merky import digest
+from merky import serialization
+from merky.store import structure
+import merky
+
+VALUES = [0, 1, 23, 24, 255, 256, 65535, 65536, 2 ** 32, 2 ** 64 - 1, 2 ** 64, 2 ** 100,
+          -1, -24, -25, -2 ** 64, -2 ** 64 - 1, -2 ** 100, 1.5, -0.0, 1e300,
+          "", "a" * 30, "b" * 300, words.EUROS, True, False, None, [], {},
+          [1, [2, {"a": [3]}]], collections.OrderedDict([("b", 1), ("a", 2)])]
+
+
+def test_round_trip():
+    serializer = serialization.cbor_serializer(sort=False)
+    deserializer = serialization.cbor_deserializer()
+    for value in VALUES:
+        tools.assert_equal(value, deserializer(serializer(value)))
+    tools.assert_equal(b'\x00\x01', deserializer(serializer(b'\x00\x01')))
+
+
+def test_encoding():
+    s = serialization.cbor_serializer()
+    # Indefinite-length map and list, one-byte heads for small ints and short strings.
+    tools.assert_equal('bf61619f016178ff616201ff',
+                       binascii.hexlify(s({"b": 1, "a": [1, "x"]})).decode('ascii'))
+    tools.assert_equal('1818', binascii.hexlify(s(24)).decode('ascii'))
+    tools.assert_equal('3903e7', binascii.hexlify(s(-1000)).decode('ascii'))
+    tools.assert_equal('fb3ff8000000000000', binascii.hexlify(s(1.5)).decode('ascii'))
+    tools.assert_equal(s("a"), s(merky.annotate("a")))
+    tools.assert_raises(ValueError, s, float('nan'))
+    tools.assert_raises(ValueError, s, [float('inf')])
+    tools.assert_raises(TypeError, s, object())
+    tools.assert_raises(ValueError, serialization.cbor_deserializer(), s(1) + b'\x00')
+
+
+def test_chunks():
+    s = serialization.cbor_serializer()
+    for size in (1, 2, 1024):
+        chunker = serialization.cbor_chunker(size=size)
+        for structure in benchmark.sample_structures() + fused_test.wide() + VALUES:
+            tools.assert_equal(s(structure), b''.join(chunker(structure)))
+
+
+def test_tokens():
+    s = serialization.cbor_serializer()
+    for cls in stream_test.TRANSFORMERS:
+        t = cls(format='cbor')
+        streaming = cls(format='cbor', stream_sequences=True)
+        for structure in benchmark.sample_structures() + fused_test.wide():
+            pairs = list(t.transform(structure))
+            for token, normal in pairs:
+                tools.assert_equal(digest.hexdigest(s(normal)), token)
+            tools.assert_not_equal(pairs[-1][0], cls().token_of(structure))
+            tools.assert_equal(pairs, list(streaming.transform(structure)))
+            tools.assert_equal(pairs[-1][0], t.token_of(structure))
+            tools.assert_equal(pairs[-1][0], cls(format='cbor', binary_tokens=True)
+                               .token_of(structure).hex())
+
+
+def test_invalid_format():
+    tools.assert_raises(ValueError, merky.Transformer, format='xml')
+
+
+def test_store_round_trip():
+    stream = io.BytesIO()
+    writer = structure.CBORStreamWriteStructure(stream, format='cbor')
+    t = merky.AnnotationTransformer(format='cbor')
+    writer.populate(t.transform(binary_token_test.versions()))
+    writer.close()
+    stream.seek(0)
+    for binary in (False, True):
+        stream.seek(0)
+        reader = structure.CBORStreamReadStructure(stream, binary_tokens=binary)
+        tools.assert_equal('cbor', reader.format)
+        binary_token_test.restore(reader.get, reader.head)
+    tools.assert_equal(writer.head, t.token_of(binary_token_test.versions()))
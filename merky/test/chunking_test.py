@@ -0,0 +1,196 @@
+import pickle
+
+from nose import tools
+from . import benchmark
+from . import stream_test
+from merky import chunking
+from merky import util
+from merky.cases import attrgraph
+from merky.cases import walker
+from merky.store import structure
+import merky
+
+
+def long_list(count, start=0):
+    return ["member %d" % i for i in range(start, start + count)]
+
+
+def store_of(transformer, natural):
+    store = structure.InMemoryStructure()
+    store.populate(transformer.transform(natural))
+    return store
+
+
+def test_short_sequences_unchanged():
+    plain = merky.Transformer()
+    chunked = merky.Transformer(chunk_sequences=8)
+    for natural in benchmark.sample_structures() + [long_list(32), "scalar"]:
+        tools.assert_equal(list(plain.transform(natural)), list(chunked.transform(natural)))
+
+
+def test_manifest():
+    t = merky.Transformer(chunk_sequences=8)
+    natural = long_list(1000)
+    pairs = list(t.transform(natural))
+    token, manifest = pairs[-1]
+    tools.assert_true(chunking.is_chunked(manifest))
+    tools.assert_equal(1000, manifest["length"])
+    tools.assert_true(manifest["depth"] > 1)
+    tools.assert_true(len(manifest["chunks"]) <= 32)
+    for _, chunk in pairs[:-1]:
+        tools.assert_true(1 <= len(chunk) <= 32)
+    tools.assert_equal(token, t.token_of(natural))
+    store = store_of(t, natural)
+    tools.assert_equal(natural, list(chunking.iter_sequence(store.get(store.head), store.get)))
+
+
+def test_boundary_at_end():
+    # The last of these members hits a boundary, which must not add an empty chunk.
+    natural = ["m%d" % i for i in range(47)]
+    tools.assert_equal(47, list(chunking.boundaries(natural, None, 8, 2, 32))[-1])
+    pairs = list(merky.Transformer(chunk_sequences=8).transform(natural))
+    tools.assert_true(all(chunk for _, chunk in pairs[:-1]))
+    tools.assert_equal(len(pairs) - 1, len(pairs[-1][1]["chunks"]))
+
+
+def test_nested():
+    t = merky.Transformer(chunk_sequences=4)
+    natural = {"a": long_list(100), "b": [long_list(50, i) for i in range(3)]}
+    store = store_of(t, natural)
+    top = store.get(store.head)
+    tools.assert_equal(natural["a"], list(chunking.iter_sequence(store.get(top["a"]), store.get)))
+    b = list(chunking.iter_sequence(store.get(top["b"]), store.get))
+    tools.assert_equal(natural["b"],
+                       [list(chunking.iter_sequence(store.get(m), store.get)) for m in b])
+    for cls in (merky.AnnotationTransformer, merky.ExcludeAnnotationTransformer):
+        tools.assert_equal(list(cls(chunk_sequences=4, memo_size=10).transform(natural)),
+                           list(cls(chunk_sequences=4).transform(natural)))
+    tools.assert_equal(list(t.transform(natural)),
+                       list(merky.Transformer(chunk_sequences=4, memo_size=10).transform(natural)))
+
+
+def test_localized_edits():
+    t = merky.Transformer(chunk_sequences=16)
+    natural = long_list(20000)
+    before = set(token for token, _ in t.transform(natural))
+    for edited in (["inserted"] + natural,
+                   natural[:10000] + natural[10001:],
+                   natural[:5000] + ["changed"] + natural[5001:]):
+        after = [token for token, _ in t.transform(edited)]
+        tools.assert_true(len(set(after) - before) <= 8,
+                          "%d of %d new" % (len(set(after) - before), len(after)))
+
+
+def test_binary_tokens():
+    natural = [long_list(100), long_list(100, 1)] * 100
+    plain = merky.Transformer(chunk_sequences=4)
+    binary = merky.Transformer(chunk_sequences=4, binary_tokens=True)
+    tools.assert_equal(plain.token_of(natural), binary.token_of(natural).hex())
+
+
+def test_pickled():
+    t = pickle.loads(pickle.dumps(merky.Transformer(chunk_sequences=8)))
+    tools.assert_equal(8, t.chunk_sequences)
+    tools.assert_equal(merky.Transformer(chunk_sequences=8).token_of(long_list(100)),
+                       t.token_of(long_list(100)))
+
+
+def test_retransform():
+    t = merky.Transformer(chunk_sequences=4)
+    natural = {"a": long_list(100), "b": {"c": 1}}
+    store = store_of(t, natural)
+    natural["b"]["c"] = long_list(50)
+    tools.assert_equal(t.token_of(natural),
+                       list(t.retransform(store.head, store.get, ["b", "c"], long_list(50)))[-1][0])
+    tools.assert_raises(ValueError, list, t.retransform(store.head, store.get, ["a", 0], "x"))
+
+
+def test_options():
+    tools.assert_raises(ValueError, merky.Transformer, chunk_sequences=1)
+    tools.assert_raises(ValueError, merky.Transformer, chunk_sequences=8, stream_sequences=True)
+
+
+def document(lines, prefix="line"):
+    return u"".join(u"%s %d of the document é\n" % (prefix, i) for i in range(lines))
+
+
+def test_short_strings_unchanged():
+    plain = merky.Transformer()
+    chunked = merky.Transformer(chunk_strings=64)
+    for natural in benchmark.sample_structures() + [{"a": "x" * 256}, "scalar"]:
+        tools.assert_equal(list(plain.transform(natural)), list(chunked.transform(natural)))
+
+
+def test_text_boundaries():
+    for text in (document(2000), u"word " * 20000, u"x" * 10000 + u" y", u"\n" * 5000):
+        ends = list(chunking.text_boundaries(text, 64))
+        tools.assert_equal(len(text), ends[-1])
+        sizes = [end - start for start, end in zip([0] + ends, ends)]
+        tools.assert_true(max(sizes) <= 256)
+        tools.assert_true(min(sizes[:-1]) >= 16)
+
+
+def test_strings():
+    t = merky.Transformer(chunk_strings=64)
+    natural = {"doc": document(1000), "name": "short"}
+    pairs = list(t.transform(natural))
+    tools.assert_equal(t.token_of(natural), pairs[-1][0])
+    top = pairs[-1][1]
+    tools.assert_equal("short", top["name"])
+    store = store_of(t, natural)
+    manifest = store.get(chunking.referenced_text(top["doc"]))
+    tools.assert_true(chunking.is_chunked(manifest, "text"))
+    tools.assert_equal(len(natural["doc"]), manifest["length"])
+    tools.assert_equal(natural["doc"], chunking.restore_text(top["doc"], store.get))
+    tools.assert_equal("short", chunking.restore_text("short", store.get))
+    # The bare token of the manifest is an ordinary string.
+    token = chunking.referenced_text(top["doc"])
+    tools.assert_equal(token, chunking.restore_text(token, store.get))
+    w = walker.Walker(store.get, store.head)["doc"]
+    tools.assert_equal(natural["doc"], w.text())
+    tools.assert_equal(len(manifest["chunks"]), len(list(w.iter_text())))
+    tools.assert_equal(pairs, list(merky.Transformer(chunk_strings=64,
+                                                     memo_size=10).transform(natural)))
+
+
+def test_annotated_strings():
+    doc = document(1000)
+    for cls in stream_test.TRANSFORMERS:
+        t = cls(chunk_strings=64)
+        for natural in ({"doc": doc}, [doc], doc):
+            expect = list(t.transform(natural))
+            tools.assert_true(len(expect) > 2)
+            annotated = util.annotate(doc)
+            wrapped = {"doc": annotated} if isinstance(natural, dict) else \
+                [annotated] if isinstance(natural, list) else annotated
+            tools.assert_equal(expect, list(t.transform(wrapped)))
+            tools.assert_equal(expect[-1][0], list(t.transform_parallel(wrapped))[-1][0])
+
+
+def test_string_edits():
+    t = merky.AnnotationTransformer(chunk_strings=256)
+    doc = document(20000)
+    graph = attrgraph.AttributeGraph({"doc": doc, "title": "a document"})
+    store = store_of(t, graph)
+    before = set(store.tokenmap)
+    edited = doc.replace(u"line 10000 ", u"edited line ")
+    graph.attrs["doc"] = edited
+    after = [token for token, _ in t.transform(graph)]
+    # At most two chunks, the manifest, the attrs and the graph.
+    tools.assert_true(len(set(after) - before) <= 5)
+    store.populate(t.transform(graph))
+    restored = attrgraph.AttributeGraph.from_token(store.head, store.get)
+    tools.assert_equal({"doc": edited, "title": "a document"}, dict(restored.attrs))
+    # An attribute that happens to hold the token of a manifest is left alone.
+    manifest = chunking.referenced_text(store.get(store.get(store.head)[0])["doc"])
+    graph.attrs["title"] = manifest
+    store.populate(t.transform(graph))
+    restored = attrgraph.AttributeGraph.from_token(store.head, store.get)
+    tools.assert_equal({"doc": edited, "title": manifest}, dict(restored.attrs))
+
+
+def test_string_options():
+    tools.assert_raises(ValueError, merky.Transformer, chunk_strings=1)
+    t = merky.Transformer(chunk_strings=4)
+    store = store_of(t, {"a": u"x" * 100})
+    tools.assert_raises(ValueError, list, t.retransform(store.head, store.get, ["a", 0], "y"))
@@ -0,0 +1,46 @@
+import hashlib
+
+from nose import tools
+from . import any_nesting_test as anytest
+from merky import digest
+import merky
+
+
+def test_registered():
+    for name in ('sha1', 'sha256', 'blake2b', 'blake2s'):
+        tools.assert_equal(getattr(hashlib, name)(b'abc').hexdigest(),
+                           digest.hexdigest(u'abc', name))
+
+
+def test_sized():
+    tools.assert_equal(hashlib.blake2b(b'abc', digest_size=20).hexdigest(),
+                       digest.hexdigest(u'abc', 'blake2b-160'))
+    tools.assert_equal(hashlib.blake2s(b'abc', digest_size=16).hexdigest(),
+                       digest.hexdigest(u'abc', 'blake2s-128'))
+
+
+def test_unsupported():
+    for name in ('md6', 'sha1-160', 'blake2b-12', 'blake2s-512', 'blake2b-'):
+        tools.assert_raises(ValueError, digest.get_algorithm, name)
+    tools.assert_raises(ValueError, merky.Transformer, algorithm='md6')
+
+
+def test_register():
+    digest.register('test-md5', hashlib.md5)
+    try:
+        tools.assert_equal(hashlib.md5(b'"x"').hexdigest(),
+                           merky.Transformer(algorithm='test-md5').token_of("x"))
+    finally:
+        del digest.ALGORITHMS['test-md5']
+
+
+def test_transformer_algorithm():
+    for name in ('sha256', 'blake2b-256'):
+        serializer = merky.Transformer().serializer
+        t = merky.Transformer(algorithm=name)
+        pairs = list(t.transform(anytest.NESTING_LIST))
+        for token, canonical in pairs:
+            tools.assert_equal(digest.hexdigest(serializer(canonical), name), token)
+        streamed = merky.Transformer(algorithm=name, stream_sequences=True)
+        tools.assert_equal(pairs, list(streamed.transform(anytest.NESTING_LIST)))
+        tools.assert_equal(pairs[-1][0], t.token_of(anytest.NESTING_LIST))
@@ -0,0 +1,101 @@
+import collections
+
+from nose import tools
+from nose.plugins.skip import SkipTest
+from . import benchmark
+from merky import tree
+from merky import util
+import merky
+
+HANDLERS = (tree.string_handler,
+            tree.map_handler,
+            tree.seq_handler,
+            tree.default_handler)
+
+
+def normalize(result):
+    item, collector, tokenize = result
+    if collector:
+        item = list(item)
+    return item, collector, tokenize
+
+
+def test_matches_probing():
+    probing = tree.dispatcher(*HANDLERS)
+    cached = tree.caching_dispatcher(*HANDLERS)
+    for structure in benchmark.sample_structures():
+        for node in benchmark.nodes(structure):
+            # Twice, so the second goes through the cache.
+            tools.assert_equal(normalize(probing(node)), normalize(cached(node)))
+            tools.assert_equal(normalize(probing(node)), normalize(cached(node)))
+
+
+def test_learns_types():
+    d = tree.caching_dispatcher(*HANDLERS)
+    d("string")
+    d({"a": "b"})
+    d([1])
+    d(1)
+    tools.assert_equal({str: tree.string_handler,
+                        dict: tree.map_handler,
+                        list: tree.seq_handler,
+                        int: tree.default_handler},
+                       d.cache)
+
+
+def test_delegates_not_cached():
+    d = tree.caching_dispatcher(*HANDLERS)
+    s = util.annotate("s")
+    tools.assert_equal((s, None, False), d(s))
+    tools.assert_equal([("a", "b")], list(util.pairwise(d(util.annotate({"a": "b"}))[0])))
+    tools.assert_false(util.annotate in d.cache)
+
+
+def test_rejection_falls_back():
+    d = tree.caching_dispatcher(*HANDLERS)
+    d({"a": "b"})
+    # Unsortable keys (under python 3) are rejected by map_handler; the cached
+    # dispatcher must then do whatever probing would.
+    mixed = {1: "a", "b": 2}
+    tools.assert_equal(normalize(tree.dispatcher(*HANDLERS)(mixed)), normalize(d(mixed)))
+    tools.assert_equal(tree.map_handler, d.cache[dict])
+
+
+def test_no_handler():
+    d = tree.caching_dispatcher(tree.string_handler)
+    tools.assert_raises(TypeError, d, 1)
+
+
+
+def test_content_rejection_not_cached():
+    d = tree.caching_dispatcher(*HANDLERS)
+    # The mixed keys come first: the seq_handler that takes them must not be remembered.
+    mixed = {1: "a", "b": 2}
+    tools.assert_equal(normalize(tree.dispatcher(*HANDLERS)(mixed)), normalize(d(mixed)))
+    tools.assert_false(dict in d.cache)
+    tools.assert_equal([("a", 2), ("b", 1)], list(util.pairwise(d({"b": 1, "a": 2})[0])))
+    tools.assert_equal(tree.map_handler, d.cache[dict])
+
+
+def test_content_rejection_transform():
+    tree.annotation_dispatcher.cache.pop(dict, None)
+    list(merky.AnnotationTransformer().transform({1: "a", "b": 2}))
+    nested = {"x": {"b": 1, "a": 2}}
+    tools.assert_equal(list(merky.AnnotationTransformer().transform(nested)),
+                       list(merky.AnnotationTransformer(memo_size=1).transform(nested)))
+    tools.assert_equal(collections.OrderedDict([("x", collections.OrderedDict(
+        [("a", 2), ("b", 1)]))]), list(merky.AnnotationTransformer().transform(nested))[-1][1])
+
+
+def test_object_array_not_cached():
+    try:
+        import numpy
+    except ImportError:
+        raise SkipTest("numpy unavailable")
+    d = tree.caching_dispatcher(tree.ndarray_handler, tree.map_handler, tree.seq_handler,
+                                tree.default_handler)
+    objects = numpy.array([{"a": 1}, None], dtype=object)
+    tools.assert_equal(list, d(objects)[1])
+    tools.assert_false(numpy.ndarray in d.cache)
+    tools.assert_equal(util.presorted_map, d(numpy.arange(3.0))[1])
+    tools.assert_equal(tree.ndarray_handler, d.cache[numpy.ndarray])
@@ -0,0 +1,77 @@
+import collections
+
+from nose import tools
+from . import benchmark
+from . import words
+from merky import transformer
+from merky import tree
+from merky import util
+from merky.cases import attrgraph
+import merky
+
+TOKENIZER = transformer.Transformer().tokenizer
+
+
+def unwrapped(value):
+    # The wrapping walker leaves annotated leaves wrapped within included structures.
+    value = getattr(value, '__merky_annotated__', value)
+    if isinstance(value, dict):
+        return type(value)((k, unwrapped(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return [unwrapped(v) for v in value]
+    return value
+
+
+def wrapping(structure, top=True, memo=None):
+    return [(t, unwrapped(v)) for t, v in
+            tree.walker(structure, tree.exclude_annotation_dispatcher, TOKENIZER,
+                        top=top, memo=memo)]
+
+
+def stacked(structure, top=True, memo=None):
+    return list(tree.exclusion_walker(structure, tree.annotation_dispatcher, TOKENIZER,
+                                      top=top, memo=memo))
+
+
+def same(structure):
+    tools.assert_equal(wrapping(structure), stacked(structure))
+    tools.assert_equal(wrapping(structure, top=False), stacked(structure, top=False))
+    tools.assert_equal(wrapping(structure, memo=util.LRUCache(100)),
+                       stacked(structure, memo=util.LRUCache(100)))
+
+
+def annotated():
+    shared = {"shared": [1, 2]}
+    return {"excluded": merky.annotate({"a": [1, {"b": "B"}], "c": (words.EUROS, shared)}),
+            "included": {"a": [1, {"b": "B"}], "s": shared},
+            "leaf": merky.annotate("annotated leaf"),
+            "buffer": merky.annotate([bytearray(b"in an excluded list")]),
+            "graph": attrgraph.AttributeGraph({"a": {"nested": "A"}},
+                                              {"m": attrgraph.AttributeGraph({"b": "B"})}),
+            "nested": [merky.annotate([merky.annotate({"x": ["y"]}), {"z": 1}]), ("w",)]}
+
+
+def test_samples():
+    for structure in benchmark.sample_structures():
+        same(structure)
+
+
+def test_annotated():
+    same(annotated())
+    same(merky.annotate(annotated()))
+    same(merky.annotate("top"))
+
+
+def test_unwraps_leaves():
+    pairs = stacked({"a": merky.annotate(["x", merky.annotate("y")])})
+    tools.assert_equal([(pairs[0][0], collections.OrderedDict([("a", ["x", "y"])]))], pairs)
+    tools.assert_equal(list, type(pairs[0][1]["a"]))
+    tools.assert_equal(str, type(pairs[0][1]["a"][1]))
+
+
+def test_transformer_selects_exclusion_walker():
+    tools.assert_equal("exclusion_walker",
+                       merky.ExcludeAnnotationTransformer().walker({}).__name__)
+    for kw in ({}, {"memo_size": 10}, {"stream_sequences": True}):
+        tools.assert_equal(wrapping(annotated()),
+                           list(merky.ExcludeAnnotationTransformer(**kw).transform(annotated())))
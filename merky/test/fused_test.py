@@ -0,0 +1,94 @@
+import collections
+
+from nose import tools
+from . import benchmark
+from . import stream_test
+from . import words
+from merky import digest
+from merky import serialization
+import merky
+
+
+class ListSink(object):
+    def __init__(self):
+        self.pending = []
+        self.committed = []
+
+    def write(self, data):
+        self.pending.append(data)
+
+    def commit(self, token):
+        self.committed.append((token, b''.join(self.pending)))
+        self.pending = []
+
+
+def wide():
+    return [{"wide dict": dict(("key %d" % i, [i, words.EUROS]) for i in range(3000)),
+             "wide list": [str(i) for i in range(2500)]}]
+
+
+def test_chunks():
+    s = serialization.json_serializer()
+    for size in (1, 2, 1024):
+        chunker = serialization.json_chunker(size=size)
+        for structure in benchmark.sample_structures() + wide() + [[], {}, "a", 1, None]:
+            tools.assert_equal(s(structure), ''.join(chunker(structure)))
+    chunker = serialization.json_chunker(sort=False, size=2)
+    ordered = collections.OrderedDict([("b", 1), ("a", 2), ("c", 3)])
+    tools.assert_equal(serialization.json_serializer(sort=False)(ordered), ''.join(chunker(ordered)))
+
+    # Only lists and dicts of more than `size` members are split.
+    chunker = serialization.json_chunker(size=3)
+    tools.assert_equal(1, len(list(chunker([1, 2, 3]))))
+    tools.assert_equal(1, len(list(chunker({"a": "x" * 5000}))))
+    tools.assert_equal(["[", "1,2,3", ",", "4", "]"], list(chunker([1, 2, 3, 4])))
+
+
+def test_same_tokens():
+    s = serialization.json_serializer()
+    chunker = serialization.json_chunker(size=10)
+    for binary in (False, True):
+        for algorithm in ('sha1', 'sha256'):
+            digester = (digest.binary_digester if binary else digest.hexdigester)(s, algorithm)
+            fused = digest.fused_digester(chunker, algorithm, binary=binary)
+            for structure in benchmark.sample_structures() + wide():
+                tools.assert_equal(digester(structure), fused(structure))
+
+
+def test_sink():
+    for cls in stream_test.TRANSFORMERS:
+        for structure in benchmark.sample_structures() + wide() + ["scalar"]:
+            sink = ListSink()
+            t = cls(sink=sink)
+            pairs = list(t.transform(structure))
+            tools.assert_equal([token for token, _ in pairs],
+                               [token for token, _ in sink.committed])
+            for token, data in sink.committed:
+                tools.assert_equal(token, digest.hexdigest(data.decode('utf-8')))
+            tools.assert_equal(pairs[-1][0], t.token_of(structure))
+            tools.assert_equal([], sink.pending)
+
+
+def test_sink_serialization():
+    sink = ListSink()
+    t = merky.Transformer(sink=sink)
+    pairs = list(t.transform(wide()))
+    tools.assert_equal([(token, t.serializer(structure).encode('utf-8'))
+                        for token, structure in pairs],
+                       sink.committed)
+
+
+def test_custom_serializer():
+    class Custom(merky.Transformer):
+        def get_serializer(self):
+            return lambda structure: repr(structure)
+    t = Custom()
+    tools.assert_equal(None, t.chunker)
+    tools.assert_equal(digest.hexdigest(repr(["a"])), list(t.transform(["a"]))[-1][0])
+    tools.assert_raises(ValueError, Custom, sink=ListSink())
+
+
+def test_invalid_options():
+    tools.assert_raises(ValueError, merky.Transformer, sink=ListSink(), stream_sequences=True)
+    t = merky.Transformer(sink=ListSink())
+    tools.assert_raises(ValueError, list, t.transform_parallel(["a"], object()))
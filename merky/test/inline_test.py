@@ -0,0 +1,95 @@
+from concurrent import futures
+
+from nose import tools
+from . import benchmark
+from . import fused_test
+from merky import digest
+from merky import serialization
+import merky
+
+SERIALIZER = serialization.json_serializer()
+
+
+def size(structure):
+    return len(digest.encoded(SERIALIZER(structure)))
+
+
+def inline_members(structure):
+    """
+    The dicts and lists nested within the normal `structure`, at any depth.
+    """
+    members = list(structure.values() if isinstance(structure, dict) else structure)
+    while members:
+        member = members.pop()
+        if isinstance(member, (dict, list)):
+            yield member
+            members.extend(member.values() if isinstance(member, dict) else member)
+
+
+def structures():
+    return benchmark.sample_structures() + [benchmark.records(50), benchmark.deep(20)]
+
+
+def test_extremes():
+    for natural in structures():
+        tools.assert_equal(list(merky.Transformer().transform(natural)),
+                           list(merky.Transformer(inline_below=0).transform(natural)))
+        tools.assert_equal(list(merky.AnnotationTransformer().transform(natural)),
+                           list(merky.Transformer(inline_below=1 << 30).transform(natural)))
+
+
+def test_threshold():
+    for threshold in (16, 64, 256):
+        for natural in structures():
+            pairs = list(merky.Transformer(inline_below=threshold).transform(natural))
+            for token, normal in pairs[:-1]:
+                tools.assert_true(size(normal) >= threshold)
+                tools.assert_equal(digest.hexdigest(SERIALIZER(normal)), token)
+            for _, normal in pairs:
+                for member in inline_members(normal):
+                    tools.assert_true(size(member) < threshold)
+
+
+def test_same_tokens():
+    natural = structures()
+    expected = list(merky.Transformer(inline_below=64).transform(natural))
+    tools.assert_equal(expected,
+                       list(merky.Transformer(inline_below=64, memo_size=100).transform(natural)))
+    tools.assert_equal(expected[-1][0], merky.Transformer(inline_below=64).token_of(natural))
+    tools.assert_equal(expected[-1][0],
+                       merky.Transformer(inline_below=64, binary_tokens=True).token_of(natural).hex())
+    with futures.ThreadPoolExecutor(2) as executor:
+        tools.assert_equal(expected, list(merky.Transformer(inline_below=64).transform_parallel(
+            natural, executor, levels=2)))
+
+
+def test_sink():
+    sink = fused_test.ListSink()
+    t = merky.Transformer(inline_below=64, sink=sink)
+    pairs = list(t.transform(benchmark.records(20)))
+    tools.assert_equal([token for token, _ in pairs], [token for token, _ in sink.committed])
+    tools.assert_equal([digest.encoded(SERIALIZER(normal)) for _, normal in pairs],
+                       [data for _, data in sink.committed])
+
+
+def test_buffers_always_tokenized():
+    pairs = list(merky.Transformer(inline_below=1 << 20).transform({"a": bytearray(b"x")}))
+    tools.assert_equal(2, len(pairs))
+    tools.assert_equal(bytearray(b"x"), pairs[0][1])
+
+
+def test_options():
+    tools.assert_raises(ValueError, merky.Transformer, inline_below=64, stream_sequences=True)
+    t = merky.Transformer(inline_below=64)
+    tools.assert_raises(ValueError, list, t.retransform("head", {}.get, ["a"], 1))
+
+
+def test_top_not_memoized():
+    inner = {"a": [1, 2]}
+    for cls in (merky.Transformer, merky.AnnotationTransformer, merky.ExcludeAnnotationTransformer):
+        natural = merky.annotate({"x": inner}) if cls is merky.AnnotationTransformer \
+            else {"x": inner}
+        t = cls(inline_below=100, memo_size=10)
+        list(t.transform(inner))
+        tools.assert_equal(list(cls(inline_below=100).transform(natural)),
+                           list(t.transform(natural)))
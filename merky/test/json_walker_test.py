@@ -0,0 +1,68 @@
+import collections
+
+from nose import tools
+from . import benchmark
+from . import words
+from merky import transformer
+from merky import tree
+from merky.cases import attrgraph
+import merky
+
+TOKENIZER = transformer.Transformer().tokenizer
+
+
+def generic(structure, top=True):
+    return list(tree.walker(structure, tree.full_nesting_dispatcher, TOKENIZER, top=top))
+
+
+def fast(structure, top=True):
+    return list(tree.json_walker(structure, tree.full_nesting_dispatcher, TOKENIZER, top=top))
+
+
+def same(structure):
+    tools.assert_equal(generic(structure), fast(structure))
+    tools.assert_equal(generic(structure, top=False), fast(structure, top=False))
+
+
+def test_samples():
+    for structure in benchmark.sample_structures():
+        same(structure)
+
+
+def test_scalars():
+    for scalar in ("what?", words.EUROS, 54321, -1.5, True, False, None):
+        same(scalar)
+
+
+def test_empty():
+    same({})
+    same([])
+    same([{}, [], ()])
+
+
+def test_non_native_members():
+    same({"ordered": collections.OrderedDict((("b", 1), ("a", 2))),
+          "graph": attrgraph.AttributeGraph({"a": "A"}, {}),
+          "annotated": merky.annotate(["x", {"y": "Y"}]),
+          "frozen": frozenset(["only"]),
+          "nested": [{"deeper": [(1, 2), {"deepest": None}]}]})
+
+
+def test_unsortable_keys():
+    # Under python 3, mixed keys can't be sorted; both walkers treat it as a sequence.
+    same({1: "a", "b": 2})
+
+
+def test_non_scalar_keys():
+    # Keys that the dispatcher normalizes (here, to tokens) are left to it.
+    same({(1, 2): "a", (0, 5): "b"})
+    same({frozenset([3]): "x", frozenset([1, 2]): "y"})
+    same({"k": {(9,): 1, (1,): 2}, "j": [{frozenset([2]): None}]})
+    tools.assert_equal("3156a3431682a9657e164618972a2c998e346924",
+                       merky.Transformer().token_of({(1, 2): "a", (0, 5): "b"}))
+
+
+def test_transformer_selects_fast_walker():
+    tools.assert_equal("json_walker", merky.Transformer().walker({}).__name__)
+    tools.assert_equal("walker", merky.Transformer(memo_size=1).walker({}).__name__)
+    tools.assert_equal("walker", merky.AnnotationTransformer().walker({}).__name__)
@@ -0,0 +1,118 @@
+from nose import tools
+from . import any_nesting_test as anytest
+from merky.cases import attrgraph
+from merky import util
+import merky
+
+
+class CountingDict(dict):
+    """
+    A dict that counts how often the walker asks for its items.
+    """
+    def __init__(self, *p, **kw):
+        super(CountingDict, self).__init__(*p, **kw)
+        self.calls = 0
+
+    def items(self):
+        self.calls += 1
+        return super(CountingDict, self).items()
+
+    def iteritems(self):
+        self.calls += 1
+        return super(CountingDict, self).iteritems()
+
+
+def test_lru_cache_eviction():
+    c = util.LRUCache(2)
+    c["a"] = 1
+    c["b"] = 2
+    tools.assert_equal(1, c.get("a"))
+    c["c"] = 3
+    # "b" was least recently used.
+    tools.assert_false("b" in c)
+    tools.assert_equal(None, c.get("b"))
+    tools.assert_equal(1, c.get("a"))
+    tools.assert_equal(3, c.get("c"))
+    tools.assert_equal(2, len(c))
+    c.clear()
+    tools.assert_equal(0, len(c))
+
+
+def test_lru_cache_size():
+    tools.assert_raises(ValueError, util.LRUCache, 0)
+
+
+def test_memo_disabled_by_default():
+    tools.assert_equal(None, merky.Transformer().memo)
+
+
+def test_shared_object_walked_once():
+    shared = CountingDict(anytest.BASIC)
+    t = merky.Transformer(memo_size=10)
+    r = list(t.transform({"another string": "more strings!",
+                          "honesty": True,
+                          "lies": False,
+                          "a": shared,
+                          "c": shared}))
+    tools.assert_equal(1, shared.calls)
+    # The memo hit still yields its own pair.
+    tools.assert_equal([(anytest.BASIC_HASH, anytest.BASIC_ORDERED),
+                        (anytest.BASIC_HASH, anytest.BASIC_ORDERED),
+                        (anytest.NESTING_DICT_HASH, anytest.NESTING_DICT_ORDERED)],
+                       r)
+
+
+def test_memo_spans_transforms():
+    shared = CountingDict(anytest.BASIC)
+    t = merky.Transformer(memo_size=10)
+    tools.assert_equal([(anytest.BASIC_HASH, anytest.BASIC_ORDERED)],
+                       list(t.transform(shared)))
+    tools.assert_equal([(anytest.BASIC_HASH, anytest.BASIC_ORDERED)],
+                       list(t.transform(shared)))
+    tools.assert_equal(1, shared.calls)
+    t.memo.clear()
+    list(t.transform(shared))
+    tools.assert_equal(2, shared.calls)
+
+
+def test_memo_skips_descendant_pairs():
+    inner = {"inner": ["a", "b"]}
+    outer = [inner, inner]
+    plain = list(merky.Transformer().transform(outer))
+    memoed = list(merky.Transformer(memo_size=10).transform(outer))
+    tools.assert_equal(plain[-1], memoed[-1])
+    tools.assert_equal(len(plain) - 1, len(memoed))
+    tools.assert_equal(set(tok for tok, _ in plain), set(tok for tok, _ in memoed))
+
+
+def test_annotation_flag_distinguishes():
+    shared = {"c": "C", "d": "D"}
+    structure = [merky.annotate(shared), shared, merky.annotate(shared)]
+    t = merky.AnnotationTransformer(memo_size=10)
+    tools.assert_equal(list(merky.AnnotationTransformer().transform(structure)),
+                       list(t.transform(structure)))
+    # Unannotated use of a memoized object is still inlined.
+    tools.assert_equal(list(merky.AnnotationTransformer().transform([shared])),
+                       list(t.transform([shared])))
+
+
+def test_attribute_graph_reuse():
+    static = attrgraph.AttributeGraph({"unchanging": "eternal"}, {})
+    versions = [
+        attrgraph.AttributeGraph({"version": v}, {"static": static})
+        for v in range(3)
+    ]
+    plain = list(merky.AnnotationTransformer().transform(versions))
+    t = merky.AnnotationTransformer(memo_size=10)
+    memoed = list(t.transform(versions))
+    tools.assert_equal(plain[-1], memoed[-1])
+    tools.assert_equal(set(tok for tok, _ in plain), set(tok for tok, _ in memoed))
+
+
+def test_eviction_recomputes():
+    a = CountingDict(x="X")
+    b = CountingDict(y="Y")
+    t = merky.Transformer(memo_size=1)
+    list(t.transform([a, b, a]))
+    tools.assert_equal(2, a.calls)
+    tools.assert_equal(1, b.calls)
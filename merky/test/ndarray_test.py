@@ -0,0 +1,95 @@
+import io
+
+from nose import tools
+from nose.plugins.skip import SkipTest
+from six.moves import StringIO
+from . import stream_test
+from merky import util
+from merky.cases import arrays
+from merky.store import structure
+import merky
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def setup():
+    if numpy is None:
+        raise SkipTest("numpy unavailable")
+
+
+def samples():
+    return [numpy.arange(12, dtype='<f8').reshape(3, 4),
+            numpy.arange(12, dtype='>i2').reshape(4, 3).T,
+            numpy.array([True, False]),
+            numpy.array(3.5),
+            numpy.zeros((0, 5), dtype='u1'),
+            numpy.array([(1, 2.0), (3, 4.0)], dtype=[('a', '<i4'), ('b', '<f8')])]
+
+
+def test_by_buffer():
+    t = merky.Transformer()
+    a = numpy.arange(6, dtype='<f8').reshape(2, 3)
+    pairs = list(t.transform(a))
+    tools.assert_equal(bytes(memoryview(a).cast('B')), bytes(pairs[0][1]))
+    normal = pairs[-1][1]
+    tools.assert_equal(['data', 'dtype', 'shape'], list(normal))
+    tools.assert_equal('<f8', normal['dtype'])
+    # The same values in another layout, dtype, or shape make another token.
+    tools.assert_equal(t.token_of(a), t.token_of(numpy.asfortranarray(a)))
+    tools.assert_not_equal(t.token_of(a), t.token_of(a.astype('>f8')))
+    tools.assert_not_equal(t.token_of(a), t.token_of(a.reshape(3, 2)))
+
+
+def test_chunks():
+    t = merky.Transformer()
+    a = numpy.arange(1000, dtype='<i8')
+    before = dict(t.transform(util.chunked(a, 1024)))
+    a[500] = -1
+    after = list(t.transform(util.chunked(a, 1024)))
+    tools.assert_equal(8, len(dict(after)[after[-1][1]["data"]]))
+    new = [token for token, _ in after if token not in before]
+    # The modified chunk, the list of chunks, and the array itself.
+    tools.assert_equal(3, len(new))
+    tools.assert_raises(ValueError, util.chunked, a, 0)
+
+
+def test_objects_iterated():
+    t = merky.Transformer()
+    tools.assert_equal(t.token_of([1, "x"]), t.token_of(numpy.array([1, "x"], dtype=object)))
+
+
+def round_trip(writer, reader, stream):
+    for cls in stream_test.TRANSFORMERS:
+        for sample in samples():
+            for item in (sample, util.chunked(sample, 7)):
+                stream.seek(0)
+                stream.truncate()
+                store = writer(stream)
+                store.populate(cls().transform({"array": merky.annotate(item)}))
+                store.close()
+                stream.seek(0)
+                read = reader(stream)
+                restored = arrays.from_token(read.get(read.head)["array"], read.get)
+                tools.assert_equal(sample.dtype, restored.dtype)
+                tools.assert_equal(sample.shape, restored.shape)
+                tools.assert_true((sample == restored).all())
+
+
+def test_stores():
+    round_trip(structure.JSONStreamWriteStructure, structure.JSONStreamReadStructure, StringIO())
+    round_trip(structure.CBORStreamWriteStructure, structure.CBORStreamReadStructure,
+               io.BytesIO())
+
+
+def test_binary_tokens():
+    for sample in samples():
+        for item in (sample, util.chunked(sample, 7)):
+            store = structure.InMemoryStructure(binary_tokens=True)
+            store.populate(merky.Transformer(binary_tokens=True).transform(item))
+            restored = arrays.from_token(store.head, store.get)
+            tools.assert_equal(sample.dtype, restored.dtype)
+            tools.assert_equal(sample.shape, restored.shape)
+            tools.assert_true((sample == restored).all())
@@ -0,0 +1,64 @@
+from nose import tools
+from . import benchmark
+from . import stream_test
+from merky import digest
+from merky import serialization
+from merky import tree
+from merky import util
+import merky
+
+
+def structures():
+    wide = dict(("key %d" % (i * 7919 % 5000), i) for i in range(5000))
+    return benchmark.sample_structures() + [wide, {"b": {"d": 1, "c": [{"z": 0, "y": 1}]}, "a": 2}]
+
+
+def test_same_as_sorted():
+    sorted_json = serialization.json_serializer()
+    for cls in stream_test.TRANSFORMERS:
+        t = cls()
+        tools.assert_false(t.sort_keys())
+        for structure in structures():
+            for token, normal in t.transform(structure):
+                tools.assert_equal(digest.hexdigest(sorted_json(normal)), token)
+
+
+def unsorted_map_handler(item):
+    try:
+        return util.flatten(item.items()), lambda i: dict(util.pairwise(i)), True
+    except AttributeError:
+        raise TypeError
+
+
+def test_other_dispatcher_sorts():
+    class Unsorted(merky.Transformer):
+        def get_dispatcher(self):
+            return tree.dispatcher(tree.string_handler,
+                                   unsorted_map_handler,
+                                   tree.seq_handler,
+                                   tree.default_handler)
+    t = Unsorted()
+    tools.assert_true(t.sort_keys())
+    for structure in structures():
+        tools.assert_equal(merky.Transformer().token_of(structure), t.token_of(structure))
+
+
+# Dicts whose keys are normalized to tokens, with the tokens the baseline gave them.
+NORMALIZED_KEYS = (
+    ({(1, 2): "a", (0, 5): "b"}, "3156a3431682a9657e164618972a2c998e346924"),
+    ({"k": {(9,): 1, (1,): 2}}, "80e53675e5843249516c571a40cd0c2f2fe73d6a"),
+    ({frozenset([3]): "x", frozenset([1, 2]): "y"}, "a6b00a87ed6f083426f85c19f9d0629d5070e2b7"),
+)
+
+
+def test_normalized_keys_sorted():
+    sorted_json = serialization.json_serializer()
+    for structure, token in NORMALIZED_KEYS:
+        for t in (merky.Transformer(), merky.Transformer(memo_size=10),
+                  merky.ExcludeAnnotationTransformer()):
+            pairs = list(t.transform(structure))
+            tools.assert_equal(token, str(pairs[-1][0]))
+            for pair_token, normal in pairs:
+                tools.assert_equal(digest.hexdigest(sorted_json(normal)), str(pair_token))
+        tools.assert_equal(token, str(merky.Transformer().token_of(structure)))
+        tools.assert_equal(token, str(list(merky.Transformer().transform_parallel(structure))[-1][0]))
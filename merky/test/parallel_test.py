@@ -0,0 +1,56 @@
+import pickle
+
+from concurrent import futures
+from nose import tools
+from . import benchmark
+from . import samples
+from merky.cases import attrgraph
+from merky.cases import tokendict
+import merky
+
+
+def versions():
+    static = attrgraph.AttributeGraph({"unchanging": "eternal"}, {})
+    return tokendict.TokenDict(dict(
+        ("v%d" % v, attrgraph.AttributeGraph({"version": v},
+                                             {"static": static,
+                                              "changing": attrgraph.AttributeGraph({"v": v})}))
+        for v in range(6)))
+
+
+def same(transformer, structure, executor, **kw):
+    tools.assert_equal(list(transformer.transform(structure)),
+                       list(transformer.transform_parallel(structure, executor, **kw)))
+
+
+def test_matches_serial():
+    with futures.ThreadPoolExecutor(4) as executor:
+        for transformer in (merky.Transformer(),
+                            merky.AnnotationTransformer(),
+                            merky.ExcludeAnnotationTransformer(),
+                            merky.Transformer(unique=True, prune=True)):
+            for structure in benchmark.sample_structures() + [versions(), "scalar", 1, []]:
+                same(transformer, structure, executor)
+                same(transformer, structure, executor, levels=2)
+                same(transformer, structure, executor, levels=0)
+
+
+def test_process_pool():
+    structure = {"records": benchmark.records(50), "graphs": versions()}
+    t = merky.AnnotationTransformer()
+    tools.assert_equal(list(t.transform(structure)),
+                       list(t.transform_parallel(structure, max_workers=2, levels=2)))
+
+
+def test_pickling():
+    t = merky.Transformer(memo_size=5, unique=True)
+    list(t.transform(samples.WALKER_DICT_CASE_NATURAL))
+    restored = pickle.loads(pickle.dumps(t))
+    tools.assert_equal(5, restored.memo_size)
+    tools.assert_equal(0, len(restored.memo))
+    tools.assert_true(restored.unique)
+    tools.assert_equal(list(t.transform(samples.WALKER_LIST_CASE_NATURAL)),
+                       list(restored.transform(samples.WALKER_LIST_CASE_NATURAL)))
+
+    a = pickle.loads(pickle.dumps(merky.annotate({"a": "A"})))
+    tools.assert_equal({"a": "A"}, a.__merky_annotated__)
@@ -0,0 +1,89 @@
+import collections
+
+from nose import tools
+from merky.store import structure
+import merky
+
+
+def natural():
+    return {"name": "root",
+            "items": [{"id": i, "tags": ["t%d" % i, "common"]} for i in range(20)],
+            "meta": {"owner": {"name": "someone", "groups": ["a", "b"]}}}
+
+
+def stored(transformer, structure_):
+    store = structure.InMemoryStructure()
+    store.populate(transformer.transform(structure_))
+    return store
+
+
+def check(transformer, path, value, expected_natural):
+    store = stored(transformer, natural())
+    full = collections.OrderedDict(transformer.transform(expected_natural))
+    partial = list(transformer.retransform(store.head, store.get, path, value))
+    # Same head as transforming the whole modified structure.
+    tools.assert_equal(list(full.items())[-1], partial[-1])
+    # And every pair is one the full transform would have produced.
+    for token, canonical in partial:
+        tools.assert_equal(full[token], canonical)
+    return partial
+
+
+def test_leaf_change():
+    n = natural()
+    n["items"][7]["tags"][0] = "changed"
+    partial = check(merky.Transformer(), ("items", 7, "tags", 0), "changed", n)
+    # Only the tags list, the item, the items list and the root.
+    tools.assert_equal(4, len(partial))
+
+
+def test_subtree_change():
+    n = natural()
+    n["meta"]["owner"] = {"name": "another", "groups": ["c"]}
+    partial = check(merky.Transformer(), ("meta", "owner"),
+                    {"name": "another", "groups": ["c"]}, n)
+    # The new owner and its groups, then meta and root.
+    tools.assert_equal(4, len(partial))
+
+
+def test_new_key():
+    n = natural()
+    n["meta"]["created"] = "today"
+    check(merky.Transformer(), ("meta", "created"), "today", n)
+
+
+def test_empty_path():
+    t = merky.Transformer()
+    store = stored(t, natural())
+    tools.assert_equal(list(t.transform(["replaced"])),
+                       list(t.retransform(store.head, store.get, (), ["replaced"])))
+
+
+def test_inline_path():
+    # With annotation, most structures are inline within their tokenized parent.
+    def annotated(n):
+        n["meta"] = merky.annotate(n["meta"])
+        return n
+
+    t = merky.AnnotationTransformer()
+    store = stored(t, annotated(natural()))
+    n = annotated(natural())
+    n["items"][3]["tags"] = merky.annotate(["x"])
+    partial = list(t.retransform(store.head, store.get, ("items", 3, "tags"),
+                                 merky.annotate(["x"])))
+    full = list(t.transform(n))
+    # The untouched "meta" token isn't yielded again.
+    tools.assert_equal([full[0], full[2]], partial)
+
+    n = annotated(natural())
+    n["meta"].__merky_annotated__["owner"]["name"] = "another"
+    partial = list(t.retransform(store.head, store.get, ("meta", "owner", "name"), "another"))
+    full = list(t.transform(n))
+    tools.assert_equal(full, partial)
+
+
+def test_missing_token():
+    t = merky.Transformer()
+    store = stored(t, natural())
+    tools.assert_raises(KeyError, list,
+                        t.retransform(store.head, store.get, ("name", 0), "x"))
@@ -1,11 +1,14 @@
 import codecs
 import collections
+import io
+import json
 import os
 import tempfile
 import shutil
 from nose import tools
 from six.moves import StringIO
 from .. import words
+from merky import serialization
 from merky.store import structure
 
 def od(*p, **kw):
@@ -164,3 +167,582 @@ class TestFileStructure(TestStreamStructure):
         with codecs.open(self.path, mode='rb', encoding='utf-8') as f:
             tools.assert_equal(self.json(head), f.read())
 
+
+
+class TestCBORStreamStructure(TestInMemoryStructure):
+    def cbor(self, head):
+        return serialization.cbor_serializer(sort=False)([od(self.PAIRS), head])
+
+    def get_read_store(self):
+        self.stream = io.BytesIO(self.cbor(self.HEAD_TOKEN))
+        return structure.CBORStreamReadStructure(self.stream)
+
+    def get_write_store(self):
+        self.stream = io.BytesIO()
+        return structure.CBORStreamWriteStructure(self.stream)
+
+    def verify_write(self, store, head):
+        tools.assert_equal(0, self.stream.tell())
+        store.close()
+        tools.assert_equal(self.cbor(head), self.stream.getvalue())
+
+
+class TestCBORFileStructure(TestCBORStreamStructure):
+    def setup(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, "some-file.cbor")
+
+    def teardown(self):
+        shutil.rmtree(self.workdir)
+
+    def get_read_store(self):
+        with open(self.path, mode="wb") as f:
+            f.write(self.cbor(self.HEAD_TOKEN))
+        return structure.CBORFileReadStructure(self.path)
+
+    def get_write_store(self):
+        return structure.CBORFileWriteStructure(self.path)
+
+    def verify_write(self, store, head):
+        tools.assert_false(os.path.exists(self.path))
+        store.close()
+        with open(self.path, mode="rb") as f:
+            tools.assert_equal(self.cbor(head), f.read())
+
+
+class TestJSONLinesStreamStructure(TestInMemoryStructure):
+    def jsonl(self, head):
+        lines = [jl(q(token), json.dumps(structure, ensure_ascii=False, separators=(",", ":")))
+                 for token, structure in self.PAIRS]
+        lines.append(jd(('"head"', q(head)), ('"algorithm"', '"sha1"'), ('"format"', '"json"')))
+        return u"".join(line + u"\n" for line in lines)
+
+    def get_read_store(self):
+        self.stream = StringIO(self.jsonl(self.HEAD_TOKEN))
+        return structure.JSONLinesStreamReadStructure(self.stream)
+
+    def get_write_store(self):
+        self.stream = StringIO()
+        return structure.JSONLinesStreamWriteStructure(self.stream)
+
+    def verify_write(self, store, head):
+        # Pairs are written as they come; only the head waits for close().
+        tools.assert_equal(self.jsonl(head).rsplit(u"{", 1)[0], self.stream.getvalue())
+        store.close()
+        tools.assert_equal(self.jsonl(head), self.stream.getvalue())
+
+
+class TestJSONLinesFileStructure(TestJSONLinesStreamStructure):
+    def setup(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, "some-file.jsonl")
+
+    def teardown(self):
+        shutil.rmtree(self.workdir)
+
+    def get_read_store(self):
+        with io.open(self.path, mode="wb") as f:
+            f.write(self.jsonl(self.HEAD_TOKEN).encode("utf-8"))
+        return structure.JSONLinesFileReadStructure(self.path)
+
+    def get_write_store(self):
+        return structure.JSONLinesFileWriteStructure(self.path)
+
+    def read(self):
+        with io.open(self.path, mode="rb") as f:
+            return f.read().decode("utf-8")
+
+    def verify_write(self, store, head):
+        tools.assert_equal(self.jsonl(head).rsplit(u"{", 1)[0], self.read())
+        store.close()
+        tools.assert_equal(self.jsonl(head), self.read())
+
+    def test_append(self):
+        store = self.get_write_store()
+        store.populate(iter(self.PAIRS[:1]))
+        store.close()
+        store = structure.JSONLinesFileWriteStructure(self.path, append=True)
+        store.populate(iter(self.PAIRS[1:]))
+        store.close()
+        read = structure.JSONLinesFileReadStructure(self.path)
+        tools.assert_equal(od(self.PAIRS), read.tokenmap)
+        tools.assert_equal(self.HEAD_TOKEN, read.head)
+
+    def test_append_after_interruption(self):
+        store = self.get_write_store()
+        store.populate(iter(self.PAIRS[:2]))
+        store.close()
+        with io.open(self.path, mode="r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 7)
+        store = structure.JSONLinesFileWriteStructure(self.path, append=True)
+        store.populate(iter(self.PAIRS[2:]))
+        store.close()
+        read = structure.JSONLinesFileReadStructure(self.path)
+        tools.assert_equal(od(self.PAIRS), read.tokenmap)
+        tools.assert_equal(self.HEAD_TOKEN, read.head)
+        mapped = structure.JSONLinesMappedReadStructure(self.path)
+        tools.assert_equal(3, len(mapped))
+        self.verify_dict(mapped[self.HEAD_TOKEN], self.HEAD)
+        mapped.close()
+        # Nor does appending to a file of only a partial line leave any of it.
+        with io.open(self.path, mode="wb") as f:
+            f.write(b'["sometoken",')
+        store = structure.JSONLinesFileWriteStructure(self.path, append=True)
+        store.populate(iter(self.PAIRS))
+        store.close()
+        tools.assert_equal(self.jsonl(self.HEAD_TOKEN), self.read())
+
+
+    def test_separators_within_strings(self):
+        pairs = [("sometoken", [u"line\u2028separator", u"new\nline"])]
+        store = self.get_write_store()
+        store.populate(iter(pairs))
+        store.close()
+        tools.assert_equal(od(pairs), structure.JSONLinesFileReadStructure(self.path).tokenmap)
+
+
+class TestJSONLinesMappedStructure(TestJSONLinesFileStructure):
+    def get_read_store(self):
+        super(TestJSONLinesMappedStructure, self).get_read_store()
+        return structure.JSONLinesMappedReadStructure(self.path)
+
+    def test_index(self):
+        store = self.get_read_store()
+        tools.assert_true(os.path.exists(self.path + ".idx"))
+        tools.assert_equal(3, len(store))
+        for key in ("", "some", "sometoptokenx", u"\u20ac", 5):
+            tools.assert_equal(None, store.get(key))
+        store.close()
+        # The index is reused while the file is unchanged, and rewritten once it has grown.
+        with io.open(self.path + ".idx", mode="r+b") as f:
+            # The length of the line of the last token in order.
+            f.seek(-4, os.SEEK_END)
+            f.write(b"\xff\xff\xff\xff")
+        store = structure.JSONLinesMappedReadStructure(self.path)
+        tools.assert_raises(ValueError, store.get, self.HEAD_TOKEN)
+        store.close()
+        writer = structure.JSONLinesFileWriteStructure(self.path, append=True)
+        writer.populate(iter([("anothertoken", {"a": 1}), (self.LIST_TOKEN, self.LIST)]))
+        writer.close()
+        store = structure.JSONLinesMappedReadStructure(self.path)
+        tools.assert_equal(4, len(store))
+        tools.assert_equal({"a": 1}, store["anothertoken"])
+        tools.assert_equal(self.LIST_TOKEN, store.head)
+        self.verify_dict(store.get(self.HEAD_TOKEN), self.HEAD)
+        store.close()
+
+    def test_rewritten_same_size(self):
+        self.get_read_store().close()
+        stat = os.stat(self.path)
+        # Swap the list's token for another of the same length.
+        with io.open(self.path, mode="r+b") as f:
+            data = f.read().replace(self.LIST_TOKEN.encode("ascii"), b"somelistTOKEN")
+            f.seek(0)
+            f.write(data)
+        os.utime(self.path, (stat.st_atime, stat.st_mtime + 1))
+        tools.assert_equal(stat.st_size, os.path.getsize(self.path))
+        store = structure.JSONLinesMappedReadStructure(self.path)
+        tools.assert_equal(None, store.get(self.LIST_TOKEN))
+        self.verify_list(store["somelistTOKEN"], self.LIST)
+        store.close()
+
+    def test_concurrent_indexing(self):
+        from concurrent import futures
+        super(TestJSONLinesMappedStructure, self).get_read_store()
+        def read(_):
+            store = structure.JSONLinesMappedReadStructure(self.path)
+            try:
+                return store.head, store.get(self.DICT_TOKEN)
+            finally:
+                store.close()
+        with futures.ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(read, range(32)))
+        tools.assert_equal([(self.HEAD_TOKEN, self.DICT)] * 32, results)
+        tools.assert_equal(sorted(["some-file.jsonl", "some-file.jsonl.idx"]),
+                           sorted(os.listdir(self.workdir)))
+
+
+    def test_empty(self):
+        io.open(self.path, mode="wb").close()
+        store = structure.JSONLinesMappedReadStructure(self.path)
+        tools.assert_equal((None, 0, None), (store.head, len(store), store.get("x")))
+        store.close()
+
+    def test_transformed(self):
+        import merky
+        from merky.cases import attrgraph
+        from merky.cases import walker
+        graph = attrgraph.AttributeGraph({"name": words.EUROS, "data": bytearray(b"\x00\x01")},
+                                         {"member": attrgraph.AttributeGraph({"n": 1})})
+        t = merky.AnnotationTransformer(binary_tokens=True, algorithm="sha256")
+        writer = structure.JSONLinesFileWriteStructure(self.path, algorithm="sha256")
+        writer.populate(t.transform(graph))
+        writer.close()
+        store = structure.JSONLinesMappedReadStructure(self.path, binary_tokens=True)
+        tools.assert_equal(t.token_of(graph), store.head)
+        tools.assert_equal("sha256", store.algorithm)
+        restored = attrgraph.AttributeGraph.from_token(store.head, store.get)
+        tools.assert_equal(b"\x00\x01", store.get(restored.attrs["data"]))
+        tools.assert_equal(1, restored.members["member"].attrs["n"])
+        w = walker.Walker(store.get, store.head.hex())
+        tools.assert_equal({"n": 1}, w[1]["member"][0].structure)
+        store.close()
+
+
+
+def normal(structure):
+    # Tokens within structures are read back as hex strings, and buffers as bytes.
+    if isinstance(structure, (bytes, bytearray)):
+        return bytes(structure)
+    return serialization.json_serializer()(structure)
+
+class TestPackFileStructure(TestInMemoryStructure):
+    HEAD_TOKEN = '01' * 20
+    LIST_TOKEN = 'fe' * 20
+    DICT_TOKEN = '01' * 19 + '00'
+    HEAD = od((('a', LIST_TOKEN), ('b', DICT_TOKEN)))
+    PAIRS = (
+            (LIST_TOKEN, TestInMemoryStructure.LIST),
+            (DICT_TOKEN, TestInMemoryStructure.DICT),
+            (HEAD_TOKEN, HEAD),
+        )
+    compress = False
+
+    def setup(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, "some-file.pack")
+        self.stores = []
+
+    def teardown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.workdir)
+
+    def read(self, **kw):
+        store = structure.PackFileReadStructure(self.path, **kw)
+        self.stores.append(store)
+        return store
+
+    def get_read_store(self):
+        structure.write_pack(structure.InMemoryStructure(od(self.PAIRS), self.HEAD_TOKEN),
+                             self.path, compress=self.compress)
+        return self.read()
+
+    def get_write_store(self):
+        return structure.PackFileWriteStructure(self.path, compress=self.compress)
+
+    def verify_write(self, store, head):
+        tools.assert_false(os.path.exists(self.path))
+        store.close()
+        read = self.read()
+        tools.assert_equal(head, read.head)
+        tools.assert_equal(len(self.PAIRS), len(read))
+        for token, expect in self.PAIRS:
+            tools.assert_equal(expect, read[token])
+
+    def test_lookups(self):
+        store = self.get_read_store()
+        for key in ("", "00" * 20, "01" * 19 + "02", "ff" * 20, "01" * 21, u"\u20ac", 5):
+            tools.assert_equal(None, store.get(key))
+        from merky import digest
+        tools.assert_equal(self.LIST, store.get(digest.Token.fromhex(self.LIST_TOKEN)))
+        tools.assert_equal(digest.Token.fromhex(self.HEAD_TOKEN),
+                           self.read(binary_tokens=True).head)
+
+    def test_transformed(self):
+        import merky
+        from .. import benchmark
+        natural = {"graph": benchmark.graph(500), "data": bytearray(b"\x00\x01"),
+                   "text": words.EUROS}
+        for algorithm in ("sha1", "sha256"):
+            source = structure.InMemoryStructure(binary_tokens=True, algorithm=algorithm)
+            t = merky.AnnotationTransformer(binary_tokens=True, algorithm=algorithm)
+            source.populate(t.transform(natural))
+            structure.write_pack(source, self.path, compress=self.compress)
+            store = self.read()
+            tools.assert_equal(source.head.hex(), store.head)
+            tools.assert_equal(algorithm, store.algorithm)
+            tools.assert_equal(len(source.tokenmap), len(store))
+            for token, expect in source.tokenmap.items():
+                tools.assert_equal(normal(expect), normal(store[token]))
+
+    def test_not_digests(self):
+        tools.assert_raises(ValueError, structure.write_pack,
+                            structure.InMemoryStructure(od([("sometoken", [])])), self.path)
+        tools.assert_raises(ValueError, structure.write_pack,
+                            structure.InMemoryStructure(od([("00", []), ("0000", [])])),
+                            self.path)
+        # Nor does a failure while writing leave anything behind.
+        tools.assert_raises(TypeError, structure.write_pack,
+                            structure.InMemoryStructure(od([("00", []), ("01", object())])),
+                            self.path)
+        tools.assert_equal([], os.listdir(self.workdir))
+
+    def test_empty(self):
+        structure.write_pack(structure.InMemoryStructure(), self.path)
+        store = self.read()
+        tools.assert_equal((None, 0, None), (store.head, len(store), store.get("")))
+
+    def test_index_of_other_pack(self):
+        structure.write_pack(structure.InMemoryStructure(od(self.PAIRS), self.HEAD_TOKEN),
+                             self.path, compress=self.compress)
+        with open(self.path + ".idx", "rb") as f:
+            old_index = f.read()
+        # The pack is renamed into place first, so after a crash between the two renames,
+        # the old index is left with the new pack.
+        class Crash(Exception):
+            pass
+        renamed = []
+        rename = os.rename
+        def crashing_rename(src, dst):
+            renamed.append(dst)
+            if dst == self.path + ".idx":
+                raise Crash()
+            rename(src, dst)
+        os.rename = crashing_rename
+        try:
+            tools.assert_raises(Crash, structure.write_pack,
+                                structure.InMemoryStructure(od(self.PAIRS[:1]), self.LIST_TOKEN),
+                                self.path, compress=self.compress)
+        finally:
+            os.rename = rename
+        tools.assert_equal([self.path, self.path + ".idx"], renamed)
+        tools.assert_equal(sorted(["some-file.pack", "some-file.pack.idx"]),
+                           sorted(os.listdir(self.workdir)))
+        with open(self.path + ".idx", "rb") as f:
+            tools.assert_equal(old_index, f.read())
+        tools.assert_raises(ValueError, structure.PackFileReadStructure, self.path)
+
+
+class TestCompressedPackFileStructure(TestPackFileStructure):
+    compress = True
+
+
+class TestSQLiteStructure(TestInMemoryStructure):
+    HEAD_TOKEN = TestPackFileStructure.HEAD_TOKEN
+    LIST_TOKEN = TestPackFileStructure.LIST_TOKEN
+    DICT_TOKEN = TestPackFileStructure.DICT_TOKEN
+    HEAD = TestPackFileStructure.HEAD
+    PAIRS = TestPackFileStructure.PAIRS
+
+    def setup(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, "some-file.sqlite")
+        self.stores = []
+
+    def teardown(self):
+        for store in self.stores:
+            store.connection.close()
+        shutil.rmtree(self.workdir)
+
+    def open(self, **kw):
+        store = structure.SQLiteStructure(self.path, **kw)
+        self.stores.append(store)
+        return store
+
+    def get_read_store(self):
+        store = self.open()
+        store.populate(iter(self.PAIRS))
+        store.close()
+        return self.open()
+
+    def get_write_store(self):
+        return self.open(batch_size=2)
+
+    def verify_write(self, store, head):
+        # The pairs are stored as they come; the head is recorded on close().
+        read = self.open()
+        tools.assert_equal(len(self.PAIRS), len(read))
+        tools.assert_equal(None, read.head)
+        store.close()
+        tools.assert_equal(head, read.get_head("head"))
+        for token, expect in self.PAIRS:
+            tools.assert_equal(expect, read[token])
+
+    def test_duplicates(self):
+        store = self.get_write_store()
+        store.populate(iter(self.PAIRS))
+        store.populate(iter(self.PAIRS[:2]))
+        tools.assert_equal(3, len(store))
+        tools.assert_equal(self.DICT_TOKEN, store.head)
+
+    def test_heads(self):
+        from merky import digest
+        store = self.get_read_store()
+        store.set_head("other", self.LIST_TOKEN)
+        store.set_head("other", digest.Token.fromhex(self.DICT_TOKEN))
+        store.close()
+        store = self.open(head_name="other", binary_tokens=True)
+        tools.assert_equal(digest.Token.fromhex(self.DICT_TOKEN), store.head)
+        tools.assert_equal(digest.Token.fromhex(self.HEAD_TOKEN), store.get_head("head"))
+        tools.assert_equal(None, store.get_head("none"))
+
+    def test_meta(self):
+        self.open(algorithm="sha256", format="cbor").close()
+        store = self.open()
+        tools.assert_equal(("sha256", "cbor"), (store.algorithm, store.format))
+        tools.assert_equal("sha256", self.open(algorithm="sha256").algorithm)
+        tools.assert_raises(ValueError, self.open, algorithm="sha1")
+
+    def test_not_digests(self):
+        store = self.open()
+        tools.assert_raises(ValueError, store.populate, iter([("sometoken", [])]))
+        tools.assert_equal(None, store.get("sometoken"))
+
+    def test_transformed(self):
+        import merky
+        from merky.cases import attrgraph
+        from .. import benchmark
+        g = benchmark.graph(500)
+        t = merky.AnnotationTransformer(binary_tokens=True)
+        store = self.open(binary_tokens=True)
+        store.populate(t.transform(g))
+        store.close()
+        store = self.open()
+        tools.assert_equal(t.token_of(g).hex(), store.head)
+        restored = attrgraph.AttributeGraph.from_token(store.head, store.get)
+        tools.assert_equal(t.token_of(g), t.token_of(restored))
+
+
+class TestLooseObjectStructure(TestSQLiteStructure):
+    def setup(self):
+        self.workdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.workdir, "objects")
+        self.stores = []
+
+    def teardown(self):
+        shutil.rmtree(self.workdir)
+
+    def open(self, **kw):
+        return structure.LooseObjectStructure(self.path, **kw)
+
+    def get_write_store(self):
+        return self.open()
+
+    def test_layout(self):
+        store = self.get_read_store()
+        path = os.path.join(self.path, self.LIST_TOKEN[:2], self.LIST_TOKEN[2:])
+        tools.assert_true(os.path.isfile(path))
+        tools.assert_equal(
+            sorted(["meta.json", "heads", self.LIST_TOKEN[:2], self.HEAD_TOKEN[:2]]),
+            sorted(os.listdir(self.path)))
+        tools.assert_equal(sorted([self.HEAD_TOKEN[2:], self.DICT_TOKEN[2:]]),
+                           sorted(os.listdir(os.path.join(self.path, self.HEAD_TOKEN[:2]))))
+        # Tokens already present are not written again.
+        with io.open(path, mode="wb") as f:
+            f.write(serialization.cbor_serializer()(["left", "alone"]))
+        store.populate(iter(self.PAIRS))
+        tools.assert_equal(["left", "alone"], store[self.LIST_TOKEN])
+
+    def test_concurrent(self):
+        import merky
+        from concurrent import futures
+        from .. import benchmark
+        g = benchmark.graph(300)
+        t = merky.AnnotationTransformer()
+        pairs = list(t.transform(g))
+        def populate(i):
+            store = self.open()
+            store.populate(iter(pairs[i::2] + pairs[::-1]))
+        with futures.ThreadPoolExecutor(4) as executor:
+            list(executor.map(populate, range(8)))
+        store = self.open()
+        tools.assert_equal(len(dict(pairs)), len(store))
+        tools.assert_equal([name for name in os.listdir(self.path) if name.startswith(".")], [])
+        for token, expect in pairs:
+            tools.assert_equal(normal(expect), normal(store[token]))
+
+    def test_concurrent_meta(self):
+        from concurrent import futures
+        def open_as(algorithm):
+            try:
+                return self.open(algorithm=algorithm).algorithm
+            except ValueError:
+                return None
+        algorithms = ["sha1", "sha256"] * 8
+        with futures.ThreadPoolExecutor(8) as executor:
+            opened = list(executor.map(open_as, algorithms))
+        # Just one "meta.json" was kept, and all opened agree with it.
+        recorded = self.open().algorithm
+        tools.assert_equal([a if a == recorded else None for a in algorithms], opened)
+        tools.assert_equal([name for name in os.listdir(self.path) if name.startswith(".")], [])
+
+    def test_keep_existing(self):
+        path = os.path.join(self.workdir, "some-file")
+        def write(data, **kw):
+            with structure.replacing_file(path, **kw) as f:
+                f.write(data)
+            with io.open(path, mode="rb") as f:
+                return f.read()
+        tools.assert_equal(b"first", write(b"first", keep_existing=True))
+        tools.assert_equal(b"first", write(b"second", keep_existing=True))
+        tools.assert_equal(b"third", write(b"third"))
+        tools.assert_equal(["some-file"], os.listdir(self.workdir))
+
+def test_jsonl_interrupted():
+    stream = StringIO()
+    store = structure.JSONLinesStreamWriteStructure(stream)
+    store.populate(iter(TestInMemoryStructure.PAIRS))
+    # No close(), and a partial line as from a write cut short.
+    stream.write(u'["partial", {"a":')
+    stream.seek(0)
+    read = structure.JSONLinesStreamReadStructure(stream)
+    tools.assert_equal(od(TestInMemoryStructure.PAIRS), read.tokenmap)
+    tools.assert_equal(None, read.head)
+    stream.seek(0)
+    tools.assert_equal(list(TestInMemoryStructure.PAIRS),
+                       list(structure.JSONLinesStreamReadStructure.pairs(stream)))
+
+
+def test_jsonl_same_as_json():
+    from merky import digest
+    import merky
+    natural = {"a": bytearray(b"some bytes"), "b": [words.EUROS, {"c": words.SHEKELS}]}
+    t = merky.Transformer(binary_tokens=True, algorithm='sha256')
+    read = []
+    for writer, reader in ((structure.JSONStreamWriteStructure, structure.JSONStreamReadStructure),
+                           (structure.JSONLinesStreamWriteStructure,
+                            structure.JSONLinesStreamReadStructure)):
+        stream = StringIO()
+        store = writer(stream, algorithm='sha256')
+        store.populate(t.transform(natural))
+        store.close()
+        stream.seek(0)
+        read.append(reader(stream, binary_tokens=True))
+    tools.assert_true(isinstance(read[1].head, digest.Token))
+    tools.assert_equal(read[0].head, read[1].head)
+    tools.assert_equal('sha256', read[1].algorithm)
+    tools.assert_equal(dict(read[0].tokenmap), dict(read[1].tokenmap))
+
+def test_format_recorded():
+    for writer, reader, stream in (
+            (structure.JSONStreamWriteStructure, structure.JSONStreamReadStructure, StringIO()),
+            (structure.CBORStreamWriteStructure, structure.CBORStreamReadStructure, io.BytesIO())):
+        store = writer(stream, format='cbor')
+        store.populate(iter(TestInMemoryStructure.PAIRS))
+        store.close()
+        stream.seek(0)
+        read = reader(stream)
+        tools.assert_equal(('sha1', 'cbor'), (read.algorithm, read.format))
+        tools.assert_equal(TestInMemoryStructure.HEAD_TOKEN, read.head)
+
+
+def test_algorithm_recorded():
+    stream = StringIO()
+    store = structure.JSONStreamWriteStructure(stream, algorithm='sha256')
+    store.populate(iter(TestInMemoryStructure.PAIRS))
+    store.close()
+    stream.seek(0)
+    tools.assert_equal('sha256', structure.JSONStreamReadStructure(stream).algorithm)
+
+
+def test_default_algorithm_not_written():
+    stream = StringIO()
+    store = structure.JSONStreamWriteStructure(stream)
+    store.populate(iter(TestInMemoryStructure.PAIRS))
+    store.close()
+    stream.seek(0)
+    tools.assert_equal(2, len(json.load(stream)))
+    stream.seek(0)
+    read = structure.JSONStreamReadStructure(stream)
+    tools.assert_equal(('sha1', 'json'), (read.algorithm, read.format))
@@ -0,0 +1,59 @@
+from nose import tools
+from . import any_nesting_test as anytest
+from . import benchmark
+from . import words
+from merky import digest
+from merky import serialization
+import merky
+
+TRANSFORMERS = (merky.Transformer,
+                merky.AnnotationTransformer,
+                merky.ExcludeAnnotationTransformer)
+
+
+def test_sequence_digest():
+    s = serialization.json_serializer()
+    for seq in ([], ["a"], [words.EUROS, 1, None, True, {"a": ["b"]}]):
+        d = digest.SequenceDigest(s)
+        for member in seq:
+            d.append(member)
+        tools.assert_equal(digest.hexdigest(s(seq)), d.hexdigest())
+        tools.assert_equal(seq, d.members)
+
+
+def test_sequence_digest_without_retention():
+    d = digest.sequence_digester(serialization.json_serializer(), retain=False)()
+    d.append("a")
+    tools.assert_equal(None, d.members)
+    # The digest can be taken more than once.
+    tools.assert_equal(d.hexdigest(), d.hexdigest())
+
+
+def test_same_pairs():
+    for cls in TRANSFORMERS:
+        plain = cls()
+        streaming = cls(stream_sequences=True)
+        for structure in benchmark.sample_structures() + [anytest.NESTING_LIST, "scalar"]:
+            tools.assert_equal(list(plain.transform(structure)),
+                               list(streaming.transform(structure)))
+
+
+def test_without_retention():
+    t = merky.Transformer(stream_sequences=True, retain_sequences=False)
+    r = list(t.transform(anytest.NESTING_LIST))
+    tools.assert_equal([(anytest.BASIC_HASH, anytest.BASIC_ORDERED),
+                        (anytest.LIST_HASH, None),
+                        (anytest.NESTING_LIST_HASH, None)],
+                       r)
+
+
+def test_long_generator():
+    t = merky.Transformer(stream_sequences=True, retain_sequences=False)
+    count = 20000
+    expected = merky.Transformer().transform([str(i) for i in range(count)])
+    tools.assert_equal([(next(expected)[0], None)],
+                       list(t.transform(str(i) for i in range(count))))
+
+
+def test_retention_requires_streaming():
+    tools.assert_raises(ValueError, merky.Transformer, retain_sequences=False)
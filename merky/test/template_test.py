@@ -0,0 +1,47 @@
+import collections
+
+from nose import tools
+from . import benchmark
+from . import words
+from merky import digest
+from merky import serialization
+import merky
+
+
+def rows():
+    return benchmark.records(50) + [
+        {"100%": "%s%%", words.EUROS: words.SHEKELS, "float": 1.5, "big": 10 ** 30},
+        {"100%": "%d", words.EUROS: "", "float": -0.0, "big": -1},
+        {"nested": {"b": [1, {"d": None, "c": True}], "a": False}, "token": merky.annotate("x")},
+        {1: "int key", 2: "int key"},
+        {"a": digest.Token.fromhex('00ff')},
+        {}]
+
+
+def test_same_json():
+    for sort in (True, False):
+        plain = serialization.json_serializer(sort=sort)
+        templated = serialization.templated_json_serializer(sort=sort)
+        for _ in range(2):
+            for structure in benchmark.sample_structures():
+                tools.assert_equal(plain(structure), templated(structure))
+            for row in rows():
+                tools.assert_equal(plain(row), templated(row))
+                reordered = collections.OrderedDict(reversed(list(row.items())))
+                tools.assert_equal(plain(reordered), templated(reordered))
+
+
+def test_limits():
+    plain = serialization.json_serializer()
+    templated = serialization.templated_json_serializer(shapes=2, width=3)
+    for row in rows():
+        tools.assert_equal(plain(row), templated(row))
+    wide = dict(("key %d" % i, i) for i in range(10))
+    tools.assert_equal(plain(wide), templated(wide))
+
+
+def test_errors():
+    templated = serialization.templated_json_serializer()
+    for _ in range(2):
+        tools.assert_raises(ValueError, templated, {"a": float('nan')})
+        tools.assert_raises(TypeError, templated, {"a": object()})
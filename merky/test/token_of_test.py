@@ -0,0 +1,35 @@
+from nose import tools
+from nose.plugins.skip import SkipTest
+from . import benchmark
+from . import stream_test
+import merky
+
+
+def last_token(transformer, structure):
+    return list(transformer.transform(structure))[-1][0]
+
+
+def test_matches_transform():
+    structures = benchmark.sample_structures() + [benchmark.deep(50), "scalar", 12, [], {}]
+    for cls in stream_test.TRANSFORMERS:
+        for t in (cls(), cls(memo_size=10), cls(unique=True, prune=True)):
+            for structure in structures:
+                tools.assert_equal(last_token(t, structure), t.token_of(structure))
+
+
+def test_memo_stays_valid():
+    shared = ["a", "b"]
+    t = merky.Transformer(memo_size=10)
+    t.token_of([shared])
+    tools.assert_equal([(last_token(merky.Transformer(), shared), shared)],
+                       list(t.transform(shared)))
+
+
+def test_constant_memory_for_sequences():
+    try:
+        import tracemalloc
+    except ImportError:
+        raise SkipTest("tracemalloc unavailable")
+    t = merky.Transformer()
+    peak = benchmark.peak_memory(lambda: t.token_of(str(i) for i in range(100000)))
+    tools.assert_true(peak < 64 * 1024, "peak of %d bytes" % peak)
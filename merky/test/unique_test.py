@@ -0,0 +1,63 @@
+from nose import tools
+from . import any_nesting_test as anytest
+from .memo_test import CountingDict
+from merky.cases import tokendict
+from merky.cases import attrgraph
+import merky
+
+
+def test_unique_pairs():
+    tools.assert_equal([("a", 1), ("b", 2)],
+                       list(merky.util.unique_pairs([("a", 1), ("b", 2), ("a", 1)])))
+
+
+def test_duplicates_yielded_once():
+    t = merky.Transformer(unique=True)
+    r = t.transform(anytest.NESTING_DICT)
+    tools.assert_equal((anytest.BASIC_HASH, anytest.BASIC_ORDERED), next(r))
+    tools.assert_equal((anytest.NESTING_DICT_HASH, anytest.NESTING_DICT_ORDERED), next(r))
+    tools.assert_raises(StopIteration, next, r)
+
+
+def test_scalar_root():
+    t = merky.Transformer(unique=True, prune=True)
+    tools.assert_equal([("348162101fc6f7e624681b7400b085eeac6df7bd", 54321)],
+                       list(t.transform(54321)))
+
+
+def test_prune_requires_unique():
+    tools.assert_raises(ValueError, merky.Transformer, prune=True)
+
+
+def test_prune_skips_repeated_objects():
+    shared = CountingDict(anytest.BASIC)
+    structure = {"another string": "more strings!",
+                 "honesty": True,
+                 "lies": False,
+                 "a": shared,
+                 "c": shared}
+    t = merky.Transformer(unique=True, prune=True)
+    tools.assert_equal([(anytest.BASIC_HASH, anytest.BASIC_ORDERED),
+                        (anytest.NESTING_DICT_HASH, anytest.NESTING_DICT_ORDERED)],
+                       list(t.transform(structure)))
+    tools.assert_equal(1, shared.calls)
+
+    # The pruning memo only lasts for the call.
+    list(t.transform(structure))
+    tools.assert_equal(2, shared.calls)
+
+
+def test_version_history():
+    static = attrgraph.AttributeGraph({"unchanging": "eternal"}, {})
+    s0 = attrgraph.AttributeGraph({"version": 0}, {"static": static})
+    s1 = attrgraph.AttributeGraph({"version": 1}, {"static": static})
+    versions = tokendict.TokenDict({"v0": s0, "v1": s0, "v2": s1, "v3": s1})
+
+    everything = list(merky.AnnotationTransformer().transform(versions))
+    for t in (merky.AnnotationTransformer(unique=True),
+              merky.AnnotationTransformer(unique=True, prune=True)):
+        unique = list(t.transform(versions))
+        tokens = [tok for tok, _ in unique]
+        tools.assert_equal(len(set(tokens)), len(tokens))
+        tools.assert_equal(set(tok for tok, _ in everything), set(tokens))
+        tools.assert_equal(everything[-1], unique[-1])
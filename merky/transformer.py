@@ -1,6 +1,39 @@
+import collections
+import itertools
+import six
+
+from . import chunking
 from . import digest
 from . import serialization
 from . import tree
+from . import util
+
+def _substitute(structure, keys, value):
+    """
+    Returns a copy of the normal `structure` with the item at the `keys` path replaced
+    by `value`, copying only the structures along that path.
+    """
+    key = keys[0]
+    if len(keys) > 1:
+        value = _substitute(structure[key], keys[1:], value)
+    if isinstance(structure, dict):
+        if key in structure:
+            result = collections.OrderedDict(structure)
+            result[key] = value
+            return result
+        return util.ordered_map(util.flatten(
+            itertools.chain(six.iteritems(structure), ((key, value),))))
+    result = list(structure)
+    result[key] = value
+    return result
+
+
+def _nested_pairs(transformer, structure, top):
+    """
+    Walks `structure`; this is the job run for `Transformer.transform_parallel`.
+    """
+    return list(transformer.walker(structure, top=top))
+
 
 class Transformer(object):
     """
@@ -27,6 +60,10 @@ class Transformer(object):
     * Dict-like structures get sorted by key and converted to
       ``collections.OrderedDict``.
     * Sequences get converted to `list` objects.
+    * Buffers (`bytes` under python 3, `bytearray`, `memoryview`, and `array.array`; see
+      `merky.util.BUFFER_TYPES`) are left as is, but always tokenized, even where
+      annotations would otherwise leave a structure inline.  Their bytes are hashed where
+      they lie, without copying, as the CBOR of `merky.serialization.buffer_chunks`.
 
     This gives a result that can in principle produce a deterministic serialized
     form suitable for sha1 hashing.  Note that floating point values cannot be
@@ -36,17 +73,170 @@ class Transformer(object):
 
     JSON is used for the serialization, and allows for unicode characters in
     strings and disallows the use of nan.
+
+    The hash is sha1 by default; another algorithm registered with `merky.digest` can be
+    chosen by name via `algorithm` (such as "sha256", "blake2b", or "blake2b-160" for a
+    BLAKE2b digest of 160 bits).  The tokens of a given structure depend on the algorithm,
+    so stores record it (see `merky.store.structure`).
+
+    Structures are serialized as JSON by default.  With `format="cbor"`, they are serialized
+    as the compact, length-prefixed binary form of `merky.serialization.cbor_serializer`
+    instead, which saves escaping strings; the tokens then differ from those of JSON, so
+    stores record the format along with the algorithm.
+
+    With `binary_tokens=True` (python 3 only), tokens are `merky.digest.Token` objects holding
+    the raw digest bytes, rendered as hex only on demand; they take roughly half the memory of
+    hex strings, both as keys in a store and within the normal structures that reference them.
+    Since a `Token` serializes as its hex string, the tokens are otherwise the same as without.
+
+    Memoization is opt-in via `memo_size`: when given, the transformer keeps an
+    LRU cache of up to that many tokenized substructures, keyed by object identity,
+    across calls to `transform`.  A substructure object seen again is not re-walked;
+    its cached pair is yielded and its token substituted, but the pairs of its
+    descendants are not yielded a second time.  This is only correct if the structures
+    given are treated as immutable; mutating a memoized object in place will yield stale
+    tokens.  Call `self.memo.clear()` after mutating, or before sending a transform to a
+    store that did not receive the earlier pairs.
+
+    With `unique=True`, each token is yielded at most once per call to `transform`,
+    which spares a store from ingesting the same canonical structure repeatedly.
+    Adding `prune=True` also skips walking any object already tokenized within the
+    same call (tracked by identity, as with `memo_size`, but only for the duration of
+    the call), so repeated objects cost a lookup rather than a walk.
+
+    With `stream_sequences=True`, tokenized sequences are hashed member by member as the
+    walk produces them, rather than collected and serialized whole; the tokens are the same.
+    If `retain_sequences` is also false, the members are not kept at all, and sequences are
+    yielded with a canonical form of `None`.  Memory use for even the longest sequence is then
+    constant, which suits callers that only need tokens.
+
+    Each structure is hashed as its serialization is produced, in chunks (see `get_chunker`),
+    so that lists and dicts of more than 1024 members are never serialized whole; smaller
+    ones are serialized whole, as that is quicker.  A `sink` given here receives those
+    chunks too, as UTF-8 bytes via `sink.write(data)`, followed by `sink.commit(token)` once
+    a structure is complete; a store can thereby take in every serialized structure as it is
+    hashed.  A sink cannot be combined with `stream_sequences`.
+
+    With `chunk_sequences` set to an average chunk length, sequences more than four times
+    that long are split into chunks at boundaries chosen by a rolling hash of their members
+    (see `merky.chunking`), and stand for a manifest of the chunk tokens rather than a single
+    list.  Inserting into or removing from a long sequence then changes only the chunks around
+    the edit (and one per level of the chunk tree above them), so a store dedupes the rest.
+    A chunked sequence reads back with `merky.chunking.iter_sequence`.  The tokens differ
+    from those of unchunked sequences, and `chunk_sequences` cannot be combined with
+    `stream_sequences`.
+
+    With `chunk_strings` set to an average chunk length, strings more than four times that
+    long are split likewise, at line or word breaks chosen by the text itself (see
+    `merky.chunking.string_dispatcher`): each chunk is tokenized as a string, and wherever
+    the string appears, a reference to the manifest of their tokens stands for it.  Editing part of
+    a long document then re-stores only the chunks around the edit.  Dict keys are split too,
+    should any be that long.  The generic `merky.tree.walker` is always used, and the string
+    reads back with `merky.chunking.restore_text` (or lazily, with the `iter_text` method of
+    a `merky.cases.walker.Walker`).
+
+    With `inline_below` set to a size in bytes, a structure is only tokenized if its serialization
+    (with any small structures within it inline) comes to at least that many bytes; smaller ones
+    are left inline within their containers, as annotation would leave them.  This trades how
+    finely structures are deduplicated for fewer, larger nodes in a store.  The top-level
+    structure, buffers, arrays and chunks are always tokenized.  It cannot be combined with
+    `stream_sequences`, nor used with `retransform`.
+
+    A `Transformer` can be pickled (as `transform_parallel` requires); only its options
+    are kept, and the serializer, chunker, tokenizer, dispatcher, memo, sequencer and splitter
+    are rebuilt on unpickling, as is the policy.
     """
-    def __init__(self):
+    DERIVED = ('serializer', 'chunker', 'tokenizer', 'dispatcher', 'memo', 'sequencer',
+               'splitter', 'policy')
+
+    def __init__(self, memo_size=None, unique=False, prune=False,
+                 stream_sequences=False, retain_sequences=True,
+                 algorithm=digest.DEFAULT_ALGORITHM, binary_tokens=False, sink=None,
+                 format=serialization.DEFAULT_FORMAT, chunk_sequences=None, chunk_strings=None,
+                 inline_below=None):
+        if binary_tokens and six.PY2:
+            raise ValueError("binary_tokens requires python 3")
+        if prune and not unique:
+            raise ValueError("prune requires unique")
+        if not (stream_sequences or retain_sequences):
+            raise ValueError("retain_sequences=False requires stream_sequences")
+        if sink is not None and stream_sequences:
+            raise ValueError("sink cannot be combined with stream_sequences")
+        if format not in serialization.FORMATS:
+            raise ValueError("Unsupported serialization format: %s" % format)
+        if chunk_sequences is not None and stream_sequences:
+            raise ValueError("chunk_sequences cannot be combined with stream_sequences")
+        if chunk_sequences is not None and chunk_sequences < 2:
+            raise ValueError("chunk_sequences must be at least 2")
+        if chunk_strings is not None and chunk_strings < 2:
+            raise ValueError("chunk_strings must be at least 2")
+        if inline_below is not None and stream_sequences:
+            raise ValueError("inline_below cannot be combined with stream_sequences")
+        digest.get_algorithm(algorithm)
+        self.algorithm = algorithm
+        self.format = format
+        self.binary_tokens = binary_tokens
+        self.memo_size = memo_size
+        self.unique = unique
+        self.prune = prune
+        self.stream_sequences = stream_sequences
+        self.retain_sequences = retain_sequences
+        self.sink = sink
+        self.chunk_sequences = chunk_sequences
+        self.chunk_strings = chunk_strings
+        self.inline_below = inline_below
+        self.setup()
+
+    def setup(self):
+        """
+        Builds the dispatcher, serializer, chunker, tokenizer, memo, sequencer, splitter and
+        policy from the `get_*` methods.  With `chunk_strings`, the dispatcher is wrapped in a
+        `merky.chunking.string_dispatcher`.
+        """
+        self.dispatcher = self.get_dispatcher()
+        if self.chunk_strings is not None:
+            self.dispatcher = chunking.string_dispatcher(self.dispatcher, self.chunk_strings)
         self.serializer = self.get_serializer()
+        self.chunker = self.get_chunker()
         self.tokenizer = self.get_tokenizer()
-        self.dispatcher = self.get_dispatcher()
+        self.memo = self.get_memo(self.memo_size)
+        self.sequencer = self.get_sequencer()
+        self.splitter = self.get_splitter()
+        self.policy = self.get_policy()
+
+    def __getstate__(self):
+        return dict((k, v) for k, v in six.iteritems(self.__dict__) if k not in self.DERIVED)
 
-    def walker(self, structure):
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.setup()
+
+    def walker(self, structure, top=True, sequencer=None):
         """
-        Returns the `merky.tree.walker` for `structure` given self's `dispatcher` and `tokenizer`.
+        Returns the `merky.tree.walker` for `structure` given self's `dispatcher`, `tokenizer`,
+        `memo`, `splitter`, `policy`, and `sequencer` (unless another `sequencer` is given).  When pruning without a
+        `memo`, a memo private to this walk is used.
+
+        When the `dispatcher` is the `merky.tree.full_nesting_dispatcher` and there is no memo,
+        the faster but otherwise equivalent `merky.tree.json_walker` is used instead.  Likewise,
+        for the `merky.tree.exclude_annotation_dispatcher`, the `merky.tree.exclusion_walker`
+        is used with the `merky.tree.annotation_dispatcher`.
         """
-        return tree.walker(structure, self.dispatcher, self.tokenizer)
+        memo = self.memo
+        if memo is None and self.prune:
+            memo = {}
+        if sequencer is None:
+            sequencer = self.sequencer
+        if self.dispatcher is tree.exclude_annotation_dispatcher:
+            return tree.exclusion_walker(structure, tree.annotation_dispatcher, self.tokenizer,
+                                         memo=memo, top=top, sequencer=sequencer,
+                                         splitter=self.splitter, policy=self.policy)
+        if memo is None and self.dispatcher is tree.full_nesting_dispatcher:
+            return tree.json_walker(structure, self.dispatcher, self.tokenizer, top=top,
+                                    sequencer=sequencer, splitter=self.splitter,
+                                    policy=self.policy)
+        return tree.walker(structure, self.dispatcher, self.tokenizer, memo=memo, top=top,
+                           sequencer=sequencer, splitter=self.splitter, policy=self.policy)
 
 
     def transform(self, structure):
@@ -55,26 +245,263 @@ class Transformer(object):
         the rules of `self.dispatcher`.
 
         If the same substructure appears multiple times within `structure`, it should be yielded
-        with its corresponding sha1 hash the same number of times; duplicates are not filtered.
+        with its corresponding sha1 hash the same number of times; duplicates are not filtered,
+        unless `self.unique` is set.
         """
+        pairs = self.walker(structure)
+        if self.unique:
+            pairs = util.unique_pairs(pairs)
         seen = False
-        for pair in self.walker(structure):
+        for pair in pairs:
             yield pair
             seen = True
         if not seen:
             yield (self.tokenizer(structure), structure)
 
 
+    def token_of(self, structure):
+        """
+        Returns only the token (sha1) of the top-level `structure`, as the last pair of
+        `transform` would give it.
+
+        Nothing is retained beyond what the walk needs: each normal structure is dropped as soon
+        as its token is folded into its container, and sequences are hashed member by member
+        without being kept.  Peak memory is therefore proportional to the depth of `structure`
+        (and the width of the dicts along the way) rather than to its size.
+
+        With a `memo`, sequences are kept as usual, so that the memo remains valid for `transform`;
+        likewise with a `sink`, so that every structure still reaches it, with `chunk_sequences`,
+        since a sequence is only split once complete, and with `inline_below`, since a sequence
+        may be left inline.
+        """
+        sequencer = None
+        if (self.memo is None and self.sink is None and self.splitter is None and
+                self.policy is None):
+            sequencer = self._sequence_digester(retain=False)
+        token = None
+        for token, _ in self.walker(structure, sequencer=sequencer):
+            pass
+        if token is None:
+            token = self.tokenizer(structure)
+        return token
+
+
+    def transform_parallel(self, structure, executor=None, max_workers=None, levels=1):
+        """
+        Like `transform`, but transforms the members of the top-level structure concurrently
+        in a `concurrent.futures` executor, yielding the same pairs in the same order.
+
+        The top `levels` levels of `structure` are walked here; every member below them (the
+        members of the top-level structure, for the default `levels=1`) is transformed as a
+        separate job.  The results are merged back in depth-first order, and the containing
+        structures tokenized here.  Each job needs both the member and the transformer to be
+        picklable.
+
+        If no `executor` is given, a `concurrent.futures.ProcessPoolExecutor` with `max_workers`
+        is used for the duration of the call.
+
+        Each job has its own memo, if any, so with `memo_size` (but without `unique`) descendants
+        of objects repeated across jobs may be yielded more often than by `transform`.
+
+        A transformer with a `sink` cannot be used in parallel; a `ValueError` is raised.
+        """
+        if self.sink is not None:
+            raise ValueError("transform_parallel cannot be used with a sink")
+        if executor is None:
+            from concurrent import futures
+            with futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+                for pair in self.transform_parallel(structure, executor, levels=levels):
+                    yield pair
+            return
+
+        plan = self._plan(structure, executor, levels, True)
+        if plan[0] == 'leaf':
+            yield (self.tokenizer(structure), structure)
+            return
+
+        pairs = (pair for pair in self._gather(plan) if pair[0] is not None)
+        if self.unique:
+            pairs = util.unique_pairs(pairs)
+        for pair in pairs:
+            yield pair
+
+
+    def _plan(self, item, executor, levels, top=False):
+        """
+        Dispatches the top `levels` of `item`, submitting a job to `executor` for each member
+        below them.  Everything is submitted before any results are needed.
+        """
+        next_item, collector, tokenize = self.dispatcher(item)
+        if not collector:
+            return ('leaf', next_item)
+        if levels < 1:
+            return ('job', executor.submit(_nested_pairs, self, item, top))
+        return ('node', collector, tree.ALWAYS if top else tokenize,
+                [self._plan(member, executor, levels - 1) for member in next_item])
+
+
+    def _gather(self, plan):
+        """
+        Yields the pairs for an executed `plan` in depth-first order, ending with the
+        `(None, value)` pair giving the value that stands in for it.
+        """
+        if plan[0] == 'leaf':
+            yield (None, plan[1])
+        elif plan[0] == 'job':
+            for pair in plan[1].result():
+                yield pair
+        else:
+            _, collector, tokenize, members = plan
+            accum = []
+            for member in members:
+                for token, value in self._gather(member):
+                    if token is None:
+                        accum.append(value)
+                    else:
+                        yield (token, value)
+            value = collector(accum)
+            if tokenize:
+                pairs = self._tokenize(value, tokenize)
+                for token, value in pairs:
+                    yield (token, value)
+                if pairs:
+                    value = token
+            yield (None, value)
+
+
+    def _tokenize(self, value, tokenize=tree.ALWAYS):
+        """
+        Returns the `(token, normal_structure)` pairs for tokenizing the normal `value`, the
+        last of which stands for it: several if `self.splitter` splits it, none if
+        `self.policy` leaves it inline (unless `tokenize` is `merky.tree.ALWAYS`), or else one.
+        """
+        if self.splitter is not None and type(value) is list:
+            pairs = self.splitter(value)
+            if pairs is not None:
+                return pairs
+        if self.policy is not None and tokenize is True:
+            token = self.policy(value)
+            return [] if token is None else [(token, value)]
+        return [(self.tokenizer(value), value)]
+
+
+    def retransform(self, head, reader, path, value):
+        """
+        Yields the `(sha1, normal_structure)` pairs that change when the item at `path` within
+        a previously transformed structure is replaced by `value`.
+
+        The previous transform is given by its `head` token and a `reader` function that returns
+        the normal structure for a token (such as `merky.store.structure.TokenMapStructure.get`),
+        with dicts in key order as the transform gave them.
+        The `path` is the sequence of keys/indices leading from the top-level structure to the
+        item being replaced; it may pass through tokens and through untokenized (inline) dicts
+        and lists alike.  Replacing a key missing from a dict adds it.
+
+        Only `value` itself and the structures along `path` are transformed, so the cost is
+        proportional to the depth of the path and the size of the structures along it rather
+        than to the size of the whole.  The final pair yielded is the new head.
+
+        The `path` cannot lead into a sequence or string chunked by `chunk_sequences` or
+        `chunk_strings`; a `ValueError` is raised.  Nor can a transformer with `inline_below`
+        retransform, as the structures along the path might move inline or out of it.
+        """
+        if self.policy is not None:
+            raise ValueError("retransform cannot be used with inline_below")
+        path = list(path)
+        if not path:
+            for pair in self.transform(value):
+                yield pair
+            return
+
+        pairs = self._retransform(self._resolve_path(head, reader, path), value)
+        if self.unique:
+            pairs = util.unique_pairs(pairs)
+        for pair in pairs:
+            yield pair
+
+
+    @staticmethod
+    def _resolve_path(head, reader, path):
+        """
+        Returns the `(normal_structure, keys)` frames for each tokenized structure visited
+        along `path`, where `keys` leads through that structure's inline members.
+        """
+        current = reader(head)
+        frames = [(current, [])]
+        for i, key in enumerate(path):
+            if chunking.is_chunked(current) and key not in current:
+                raise ValueError("path cannot lead into a chunked sequence or string")
+            frames[-1][1].append(key)
+            if i == len(path) - 1:
+                break
+            current = current[key]
+            if chunking.referenced_text(current) is not None:
+                raise ValueError("path cannot lead into a chunked sequence or string")
+            if not isinstance(current, (dict, list)):
+                token = current
+                current = reader(token)
+                if current is None:
+                    raise KeyError(token)
+                frames.append((current, []))
+        return frames
+
+
+    def _retransform(self, frames, value):
+        for token, replacement in self.walker(value, top=False):
+            if token is not None:
+                yield (token, replacement)
+
+        for structure, keys in reversed(frames):
+            for replacement, structure in self._tokenize(_substitute(structure, keys, replacement)):
+                yield (replacement, structure)
+
+
     def get_serializer(self):
         """
         Returns a function to be used for structure serialization.  This implementation uses
         JSON with unicode support, no nans, and sorted keys.  The serialization must be consistent
         between uses to expect a consistent hash for the same input structure.
 
+        The JSON is that of the `merky.serialization.templated_json_serializer`, which saves
+        working out the order and JSON of the keys of every dict anew when many share a set
+        of keys, as the records of a long list do.  With `format="cbor"`, the
+        `merky.serialization.cbor_serializer` is used instead, giving bytes rather than text.
+
+        When `get_dispatcher` gives one of the `merky.tree.ORDERED_DISPATCHERS`, the normal structures
+        to serialize already have their keys in order, and the encoder is spared sorting them
+        again; so this serializer is only suited to normal structures.
+
         Subclasses could override this to use an alternate serialization approach; the result must
         support `encode()`.
         """
-        return serialization.json_serializer()
+        if self.format == 'cbor':
+            return serialization.cbor_serializer(sort=self.sort_keys())
+        return serialization.templated_json_serializer(sort=self.sort_keys())
+
+
+    def sort_keys(self):
+        """
+        Returns whether the serializer needs to sort keys, as it does unless the dispatcher of
+        `get_dispatcher` is one of the `merky.tree.ORDERED_DISPATCHERS`.
+        """
+        return self.get_dispatcher() not in tree.ORDERED_DISPATCHERS
+
+
+    def get_chunker(self):
+        """
+        Returns a function giving the serialization of a structure as a sequence of text chunks,
+        for the tokenizer to hash as they come, or `None` to hash each serialization whole.
+
+        This implementation uses the `merky.serialization.json_chunker` (or `cbor_chunker`), which
+        matches the default `get_serializer`; if a subclass overrides `get_serializer` (but not
+        this), `None` is returned so that the tokens follow the subclass serializer.
+        """
+        if (six.get_unbound_function(type(self).get_serializer) is not
+                six.get_unbound_function(Transformer.get_serializer)):
+            return None
+        if self.format == 'cbor':
+            return serialization.cbor_chunker(sort=self.sort_keys())
+        return serialization.json_chunker(sort=self.sort_keys(), serializer=self.serializer)
 
 
     def get_dispatcher(self):
@@ -88,12 +515,80 @@ class Transformer(object):
     def get_tokenizer(self):
         """
         Returns a function to use to convert structures to "tokens" (hashes); this assumes that
-        the serializer from `get_serializer` is already available at `self.serializer`.
+        the serializer and chunker from `get_serializer` and `get_chunker` are already available
+        at `self.serializer` and `self.chunker`.
+
+        This implementation uses the `merky.digest.fused_digester` over `self.chunker` for
+        `self.algorithm` (passing along `self.sink` and `self.binary_tokens`), so that the
+        serialization is hashed in chunks.  Without a chunker, it uses the serializer of
+        `get_serializer` and the hexdigest of `merky.digest.hexdigester`, or the
+        `merky.digest.binary_digester` if `self.binary_tokens` is set.
+        """
+        if self.chunker is not None:
+            return digest.fused_digester(self.chunker, self.algorithm, binary=self.binary_tokens,
+                                         sink=self.sink)
+        if self.sink is not None:
+            raise ValueError("a sink requires a chunker")
+        if self.binary_tokens:
+            return digest.binary_digester(self.serializer, self.algorithm)
+        return digest.hexdigester(self.serializer, self.algorithm)
+
+
+    def get_memo(self, size):
+        """
+        Returns the identity memo used by the walker, or `None` when memoization is disabled.
+
+        This implementation uses a `merky.util.LRUCache` bounded to `size` entries.
+        """
+        if not size:
+            return None
+        return util.LRUCache(size)
+
 
-        This implementation uses the JSON serializer of `get_serializer` and the sha1 hexdigest
-        of `merky.digest.hexdigest`.
+    def get_sequencer(self):
+        """
+        Returns the factory for the `merky.digest.SequenceDigest` used to hash sequences as they
+        are walked, or `None` if `self.stream_sequences` is not set.  This assumes that the
+        serializer from `get_serializer` is already available at `self.serializer`.
+        """
+        if not self.stream_sequences:
+            return None
+        return self._sequence_digester(retain=self.retain_sequences)
+
+
+    def get_policy(self):
+        """
+        Returns the policy that gives the token of a structure, or `None` to leave it inline, or
+        `None` if `self.inline_below` is not set.  This implementation uses the
+        `merky.digest.threshold_digester` over `self.chunker` (or over the serializer, without a
+        chunker), passing along `self.sink`, so that its tokens match those of `self.tokenizer`.
         """
-        return digest.hexdigester(self.serializer)
+        if self.inline_below is None:
+            return None
+        chunker = self.chunker
+        if chunker is None:
+            serializer = self.serializer
+            chunker = lambda structure: (serializer(structure),)
+        return digest.threshold_digester(chunker, self.inline_below, self.algorithm,
+                                         binary=self.binary_tokens, sink=self.sink)
+
+
+    def get_splitter(self):
+        """
+        Returns the function that splits long sequences into chunks, or `None` if
+        `self.chunk_sequences` is not set.  This implementation uses the
+        `merky.chunking.sequence_splitter` over `self.tokenizer` and `self.serializer`.
+        """
+        if self.chunk_sequences is None:
+            return None
+        return chunking.sequence_splitter(self.tokenizer, self.serializer,
+                                          average=self.chunk_sequences)
+
+
+    def _sequence_digester(self, retain):
+        framing = serialization.CBOR_FRAMING if self.format == 'cbor' else {}
+        return digest.sequence_digester(self.serializer, retain=retain, algorithm=self.algorithm,
+                                        binary=self.binary_tokens, **framing)
 
 
 class AnnotationTransformer(Transformer):
@@ -1,7 +1,61 @@
+import collections
+import functools
+import sys
+
 import six
 
+from . import digest
 from . import util
 
+# Handlers give `ALWAYS` rather than `True` for structures to be tokenized even where a
+# walker's `policy` would leave them inline, such as buffers and arrays.
+ALWAYS = 2
+
+
+class ContentError(TypeError):
+    """
+    Raised by a handler that rejects an item for its contents rather than its type, such as a
+    dict whose keys can't be sorted, so that `caching_dispatcher` doesn't remember whichever
+    handler takes the item instead for all items of the type.
+    """
+
+def token_handler(item):
+    if isinstance(getattr(item, '__merky_annotated__', item), digest.Token):
+        return item, None, False
+    raise TypeError
+
+
+def buffer_handler(item):
+    buf = getattr(item, '__merky_annotated__', item)
+    if isinstance(buf, util.BUFFER_TYPES):
+        return iter(()), lambda _: buf, ALWAYS
+    raise TypeError
+
+
+def ndarray_handler(item):
+    """
+    Handles a `numpy.ndarray` (or one wrapped by `merky.util.chunked`) as a dict of its
+    "dtype", "shape" and "data", where the data is a buffer of its bytes in C order (or,
+    when chunked, a list of such buffers), so that they are hashed without iteration.
+    NumPy is never imported here; if it hasn't been imported already, there are no arrays.
+
+    Arrays of Python objects are rejected, leaving them to the sequence handler.
+    """
+    item = getattr(item, '__merky_annotated__', item)
+    array, size = (item.item, item.size) if type(item) is util.chunked else (item, None)
+    numpy = sys.modules.get('numpy')
+    if numpy is None or not isinstance(array, numpy.ndarray):
+        raise TypeError
+    if array.dtype.hasobject:
+        raise ContentError
+    dtype = array.dtype.str if array.dtype.fields is None else str(array.dtype.descr)
+    data = memoryview(numpy.ascontiguousarray(array).reshape(-1).view(numpy.uint8))
+    if size is not None:
+        data = [data[i:i + size] for i in range(0, len(data), size)]
+    return iter(("data", data, "dtype", dtype, "shape", list(array.shape))), \
+        util.presorted_map, ALWAYS
+
+
 def string_handler(item):
     if hasattr(item, "encode"):
         return item, None, False
@@ -10,10 +64,19 @@ def string_handler(item):
 
 def map_handler(item):
     try:
-        i = util.flatten(sorted(six.iteritems(item)))
-        return i, util.ordered_map, True
+        pairs = six.iteritems(item)
     except AttributeError:
         raise TypeError
+    try:
+        pairs = sorted(pairs)
+    except TypeError:
+        # Keys that can't be sorted against each other (under python 3).
+        raise ContentError
+    # Keys of other types are normalized (to tokens, say) in an order of their own, so the
+    # map is sorted again once they are.
+    collector = util.presorted_map if JSON_SCALARS.issuperset(type(k) for k, _ in pairs) \
+        else util.ordered_map
+    return util.flatten(pairs), collector, True
 
 
 def seq_handler(item):
@@ -47,31 +110,251 @@ def dispatcher(*handlers):
     return inner
 
 
-def walker(structure, dispatcher, tokenizer):
+def caching_dispatcher(*handlers):
+    """
+    Like `dispatcher`, but learns which handler accepts each concrete type.
+
+    The first item of a given type is probed against `handlers` in order, and the
+    winning handler is remembered for that type; later items of the type go straight
+    to it.  Should the remembered handler reject an item, the item is probed as
+    `dispatcher` would.  A handler is not remembered if one before it rejected the item
+    with a `ContentError`, as it might not win for other items of the type; so results
+    never differ from `dispatcher`, provided handlers that reject items of a type they
+    otherwise accept do so with a `ContentError`.
+
+    Types that delegate attribute lookup through `__getattr__` (like
+    `merky.util.annotate`) are never cached, since the handler their instances
+    need depends on what each one wraps.
+
+    The cache is exposed as the `cache` attribute of the returned function.
+    """
+    probe = dispatcher(*handlers)
+    cache = {}
+    def inner(item):
+        cls = type(item)
+        handler = cache.get(cls)
+        if handler is not None:
+            try:
+                return handler(item)
+            except TypeError:
+                return probe(item)
+        cacheable = not hasattr(cls, '__getattr__')
+        for handler in handlers:
+            try:
+                result = handler(item)
+            except ContentError:
+                cacheable = False
+                continue
+            except TypeError:
+                continue
+            if cacheable:
+                cache[cls] = handler
+            return result
+        raise TypeError("No handler could be found for item of type %s" % cls)
+    inner.cache = cache
+    return inner
+
+
+def memo_key(item):
+    """
+    Returns the identity key under which `walker` memoizes `item`.
+
+    The key combines the identity of the object (looking through any
+    `merky.util.annotate` wrapper) with its annotation flag, as the flag
+    is all that distinguishes how the dispatchers treat the same object.
+    """
+    return (id(getattr(item, '__merky_annotated__', item)),
+            bool(getattr(item, '__merky__', False)))
+
+
+def streamed(accum):
+    """
+    The collector for sequences accumulated by a `merky.digest.SequenceDigest`.
+    """
+    return accum.members
+
+
+def walker(structure, dispatcher, tokenizer, memo=None, top=True, sequencer=None,
+           splitter=None, policy=None):
+    """
+    Walks `structure` depth-first, yielding a `(token, canonical)` pair
+    for each substructure that `dispatcher` says to tokenize.
+
+    If `memo` is given, it is a mapping (such as a `merky.util.LRUCache`)
+    from `memo_key` to the `(object, token, canonical)` result of each
+    tokenized substructure.  A substructure found in the memo is not walked
+    again: its memoized pair is yielded and its token substituted directly,
+    but the pairs of its own descendants are not repeated.  The memo holds
+    a reference to each object so its identity cannot be recycled; the
+    objects are assumed not to be mutated while memoized.
+
+    The top-level `structure` is always tokenized unless `top` is false, in which
+    case it is treated like any nested structure, and a final `(None, value)` pair
+    gives the `value` (token or canonical form) that would stand in for `structure`
+    within a containing structure.
+
+    If `sequencer` is given, each tokenized sequence is accumulated by a new
+    `merky.digest.SequenceDigest` from `sequencer()` rather than in a list, hashing
+    members as they arrive; its token comes from the digest rather than `tokenizer`,
+    and its canonical form is `None` if the digest does not retain members.
+
+    If `splitter` is given (see `merky.chunking.sequence_splitter`), each tokenized
+    sequence is passed to it, and if it splits the sequence into chunks, the pairs for
+    the chunks are yielded first, and the pair for the final manifest stands for the
+    sequence.
+
+    If `policy` is given (see `merky.digest.threshold_digester`), it gives the token of
+    each structure to tokenize instead of `tokenizer`, or `None` to leave the structure
+    inline within its container (and out of the `memo`).  It is not consulted for the
+    top-level `structure` (unless `top` is false), which is then left out of the `memo` too,
+    for sequences streamed by `sequencer`, or for structures that the dispatcher says to
+    tokenize `ALWAYS`.
+    """
     stack = []
     accum = []
-    top_flag = True
+    top_flag = top
+    key = source = None
     current, collector, tokenize = iter((structure,)), lambda x: x, False
     while True:
         try:
-            next_item, next_col, next_tok = dispatcher(next(current))
+            item = next(current)
+            if memo is not None:
+                key = memo_key(item)
+                hit = memo.get(key)
+                if hit is not None:
+                    yield hit[1:]
+                    accum.append(hit[1])
+                    continue
+            next_item, next_col, next_tok = dispatcher(item)
             if next_col:
-                stack.append((current, collector, tokenize, accum))
+                stack.append((current, collector, tokenize, accum, source))
+                # The top level is tokenized regardless of the policy, so unless the policy
+                # would tokenize it anyway, its token can't stand for it when nested.
+                memoize = memo is not None and next_tok and not (
+                    top_flag and policy is not None and next_tok is not ALWAYS)
                 current, collector, tokenize, accum, top_flag = next_item, \
                                                                 next_col, \
-                                                                (next_tok or top_flag), \
+                                                                (ALWAYS if top_flag else next_tok), \
                                                                 [], \
                                                                 False
+                source = (key, item) if memoize else None
+                if tokenize and sequencer is not None and collector is list:
+                    collector, accum = streamed, sequencer()
             else:
                 accum.append(next_item)
         except StopIteration:
             value = collector(accum)
             if tokenize:
-                t = tokenizer(value)
-                yield (t, value)
-                value = t
+                chunks = splitter(value) if splitter is not None and collector is list else None
+                if chunks is not None:
+                    for pair in chunks[:-1]:
+                        yield pair
+                    t, value = chunks[-1]
+                elif collector is streamed:
+                    t = accum.token()
+                elif policy is not None and tokenize is True:
+                    t = policy(value)
+                else:
+                    t = tokenizer(value)
+                if t is not None:
+                    yield (t, value)
+                    if source is not None:
+                        memo[source[0]] = (source[1], t, value)
+                    value = t
 
             if not stack:
+                if not top:
+                    yield (None, value[0])
+                break
+
+            current, collector, tokenize, accum, source = stack.pop()
+            accum.append(value)
+
+
+JSON_SCALARS = frozenset(six.integer_types + (six.text_type, float, bool, type(None)))
+if six.PY2:
+    JSON_SCALARS = JSON_SCALARS | frozenset((str,))
+
+
+def json_walker(structure, dispatcher, tokenizer, top=True, sequencer=None, splitter=None,
+                policy=None):
+    """
+    A `walker` specialized for structures made of JSON-native builtin types, giving the
+    same results as `walker` with the `full_nesting_dispatcher`.
+
+    Items whose type is exactly `dict`, `list`, `tuple`, a string, number, boolean,
+    or `None` are handled inline, without the handlers: dicts whose keys are all strings,
+    numbers, booleans or `None` are walked in sorted key order and reassembled directly from
+    their keys, rather than being flattened into a key/value sequence and paired up again.  Any other item is handed to `dispatcher`
+    as usual, so arbitrary types may still appear within the structure.
+
+    Memoization is not supported; see `walker` for the meaning of `top`, `sequencer`,
+    `splitter` and `policy`.
+    """
+    stack = []
+    accum = []
+    top_flag = top
+    current, collector, tokenize = iter((structure,)), None, False
+    while True:
+        for item in current:
+            cls = type(item)
+            if cls in JSON_SCALARS:
+                accum.append(item)
+                continue
+            if cls is dict:
+                try:
+                    keys = sorted(item)
+                except TypeError:
+                    keys = None
+                # Other keys are normalized by the dispatcher, as they would be by `walker`.
+                if keys is not None and JSON_SCALARS.issuperset(map(type, keys)):
+                    stack.append((current, collector, tokenize, accum))
+                    current, collector, tokenize, accum, top_flag = \
+                            iter([item[k] for k in keys]), keys, \
+                            (ALWAYS if top_flag else True), [], False
+                    break
+            elif cls is list or cls is tuple:
+                stack.append((current, collector, tokenize, accum))
+                current, collector, tokenize, accum, top_flag = \
+                        iter(item), list, (ALWAYS if top_flag else True), [], False
+                if sequencer is not None:
+                    collector, accum = streamed, sequencer()
+                break
+            next_item, next_col, next_tok = dispatcher(item)
+            if next_col:
+                stack.append((current, collector, tokenize, accum))
+                current, collector, tokenize, accum, top_flag = \
+                        next_item, next_col, (ALWAYS if top_flag else next_tok), [], False
+                if tokenize and sequencer is not None and collector is list:
+                    collector, accum = streamed, sequencer()
+                break
+            accum.append(next_item)
+        else:
+            if collector is None or collector is list:
+                value = accum
+            elif type(collector) is list:
+                value = collections.OrderedDict(zip(collector, accum))
+            else:
+                value = collector(accum)
+            if tokenize:
+                chunks = splitter(value) if splitter is not None and collector is list else None
+                if chunks is not None:
+                    for pair in chunks[:-1]:
+                        yield pair
+                    t, value = chunks[-1]
+                elif collector is streamed:
+                    t = accum.token()
+                elif policy is not None and tokenize is True:
+                    t = policy(value)
+                else:
+                    t = tokenizer(value)
+                if t is not None:
+                    yield (t, value)
+                    value = t
+
+            if not stack:
+                if not top:
+                    yield (None, value[0])
                 break
 
             current, collector, tokenize, accum = stack.pop()
@@ -81,22 +364,28 @@ def walker(structure, dispatcher, tokenizer):
 map_annotation_handler = annotation_handler(map_handler, 'map_annotation_handler')
 seq_annotation_handler = annotation_handler(seq_handler, 'seq_annotation_handler')
 
-full_nesting_dispatcher = dispatcher(string_handler,
-                                     map_handler,
-                                     seq_handler,
-                                     default_handler)
+full_nesting_dispatcher = caching_dispatcher(token_handler,
+                                             buffer_handler,
+                                             ndarray_handler,
+                                             string_handler,
+                                             map_handler,
+                                             seq_handler,
+                                             default_handler)
 
-annotation_dispatcher = dispatcher(string_handler,
-                                   map_annotation_handler,
-                                   seq_annotation_handler,
-                                   default_handler)
+annotation_dispatcher = caching_dispatcher(token_handler,
+                                           buffer_handler,
+                                           ndarray_handler,
+                                           string_handler,
+                                           map_annotation_handler,
+                                           seq_annotation_handler,
+                                           default_handler)
 
-def excluder_handler(handler, converter, collector, name):
+def excluder_handler(handler, converter, name):
     def handle(item):
         next_item, next_col, next_tok = handler(item)
         if next_tok:
             next_item = converter(next_item)
-            next_col = collector
+            next_col = functools.partial(_unmerked, next_col)
         return next_item, next_col, not next_tok
     handle.__name__ = name
     return handle
@@ -105,18 +394,113 @@ def _unmerk(items):
     for i in items:
         yield getattr(i, '__merky_annotated__', i)
 
-exclude_annotation_dispatcher = dispatcher(
+def _unmerked(collector, items):
+    return collector(_unmerk(items))
+
+exclude_annotation_dispatcher = caching_dispatcher(
+        token_handler,
+        buffer_handler,
+        ndarray_handler,
         string_handler,
         excluder_handler(
             map_annotation_handler,
             lambda m: util.flatten((k, util.annotate(v))
                 for k, v in util.pairwise(m)),
-            lambda i: util.ordered_map(_unmerk(i)),
             'map_exclude_handler'),
         excluder_handler(
             seq_annotation_handler,
             lambda s: (util.annotate(v) for v in s),
-            lambda i: list(_unmerk(i)),
             'seq_exclude_handler'),
         default_handler)
 
+
+def exclusion_walker(structure, dispatcher, tokenizer, memo=None, top=True, sequencer=None,
+                     splitter=None, policy=None):
+    """
+    A `walker` giving the same results as `walker` with the `exclude_annotation_dispatcher`,
+    but given the `annotation_dispatcher` (or another that says to tokenize what is annotated):
+    each structure it says to tokenize is instead excluded from tokenization, along with
+    everything within it, while all other structures are tokenized.
+
+    Whether the walk is within an excluded structure is kept on the walker's own stack,
+    rather than by wrapping each member of an excluded structure in a `merky.util.annotate`
+    to be dispatched and unwrapped again, so excluding costs no more than tokenizing.  Any
+    `merky.util.annotate` wrapper around a leaf is removed from the normal structure.
+
+    See `walker` for the meaning of the other arguments.
+    """
+    stack = []
+    accum = []
+    top_flag = top
+    excluded = False
+    key = source = None
+    current, collector, tokenize = iter((structure,)), lambda x: x, False
+    while True:
+        try:
+            item = next(current)
+            if memo is not None:
+                key = (id(getattr(item, '__merky_annotated__', item)),
+                       excluded or bool(getattr(item, '__merky__', False)))
+                hit = memo.get(key)
+                if hit is not None:
+                    yield hit[1:]
+                    accum.append(hit[1])
+                    continue
+            next_item, next_col, next_tok = dispatcher(item)
+            if next_col:
+                stack.append((current, collector, tokenize, accum, source, excluded))
+                if next_tok is ALWAYS:
+                    excluded = False
+                else:
+                    excluded = excluded or bool(next_tok)
+                    next_tok = not excluded
+                # The top level is tokenized regardless of the policy, so unless the policy
+                # would tokenize it anyway, its token can't stand for it when nested.
+                memoize = memo is not None and next_tok and not (
+                    top_flag and policy is not None and next_tok is not ALWAYS)
+                current, collector, tokenize, accum, top_flag = next_item, \
+                                                                next_col, \
+                                                                (ALWAYS if top_flag else next_tok), \
+                                                                [], \
+                                                                False
+                source = (key, item) if memoize else None
+                if tokenize and sequencer is not None and collector is list:
+                    collector, accum = streamed, sequencer()
+            elif type(next_item) is util.annotate:
+                accum.append(next_item.__merky_annotated__)
+            else:
+                accum.append(next_item)
+        except StopIteration:
+            value = collector(accum)
+            if tokenize:
+                chunks = splitter(value) if splitter is not None and collector is list else None
+                if chunks is not None:
+                    for pair in chunks[:-1]:
+                        yield pair
+                    t, value = chunks[-1]
+                elif collector is streamed:
+                    t = accum.token()
+                elif policy is not None and tokenize is True:
+                    t = policy(value)
+                else:
+                    t = tokenizer(value)
+                if t is not None:
+                    yield (t, value)
+                    if source is not None:
+                        memo[source[0]] = (source[1], t, value)
+                    value = t
+
+            if not stack:
+                if not top:
+                    yield (None, value[0])
+                break
+
+            current, collector, tokenize, accum, source, excluded = stack.pop()
+            accum.append(value)
+
+
+# The dispatchers above give every dict in key order, so their normal structures
+# need no sorting when serialized.
+ORDERED_DISPATCHERS = frozenset([full_nesting_dispatcher,
+                                 annotation_dispatcher,
+                                 exclude_annotation_dispatcher])
@@ -1,7 +1,11 @@
+import array
 import collections
 import itertools
 import six
 
+# Types whose instances are hashed and stored as raw bytes; see `buffer_view`.
+BUFFER_TYPES = (bytearray, memoryview, array.array) + ((bytes,) if six.PY3 else ())
+
 def flatten(sequence_of_sequences):
     return itertools.chain.from_iterable(sequence_of_sequences)
 
@@ -15,10 +19,85 @@ def pairwise(sequence):
         pass
 
 
+def buffer_view(item):
+    """
+    Returns a memoryview of the bytes of the buffer `item` (one of the `BUFFER_TYPES`),
+    sharing its memory unless it is not contiguous.
+
+    The bytes of an `array.array` are those of its machine representation, so they
+    depend on the byte order and item size of the platform.
+    """
+    view = memoryview(item)
+    if six.PY2 or not view.c_contiguous:
+        return memoryview(view.tobytes())
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
 def ordered_map(sequence):
     return collections.OrderedDict(sorted(pairwise(sequence)))
 
 
+def presorted_map(sequence):
+    """
+    Like `ordered_map`, for a flattened `sequence` of pairs already sorted by key.
+    """
+    return collections.OrderedDict(pairwise(sequence))
+
+
+def unique_pairs(pairs):
+    """
+    Yields the `(token, structure)` pairs from `pairs`, skipping any whose
+    token has already been yielded.
+    """
+    seen = set()
+    for pair in pairs:
+        if pair[0] not in seen:
+            seen.add(pair[0])
+            yield pair
+
+
+class LRUCache(object):
+    """
+    A size-bounded mapping that evicts its least recently used entry.
+
+    Only the subset of the `dict` interface needed for memoization is
+    provided: `get`, item assignment, `in`, `len`, and `clear`.  Both
+    `get` and assignment count as a "use" of the key.
+    """
+    __slots__ = ('maxsize', '_map')
+
+    def __init__(self, maxsize):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize = maxsize
+        self._map = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._map.pop(key)
+        except KeyError:
+            return default
+        self._map[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._map.pop(key, None)
+        self._map[key] = value
+        if len(self._map) > self.maxsize:
+            self._map.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._map
+
+    def __len__(self):
+        return len(self._map)
+
+    def clear(self):
+        self._map.clear()
+
+
 class annotate(object):
     """
     Tells merky to tokenize a given object.
@@ -42,6 +121,31 @@ class annotate(object):
     def __iter__(self):
         return iter(self.__merky_annotated__)
 
+    def __reduce__(self):
+        return type(self), (self.__merky_annotated__,)
+
+
+class chunked(object):
+    """
+    Tells merky to tokenize a `numpy.ndarray` in chunks.
+
+    The bytes of the wrapped array are split into chunks of `size` bytes, each
+    tokenized on its own, so that a change to part of a large array gives new
+    tokens only for the chunks it touches, and a store need only take those in.
+
+    The array wrapped is accessible via `item`.
+    """
+    __slots__ = ('item', 'size')
+
+    def __init__(self, item, size):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self.item = item
+        self.size = size
+
+    def __reduce__(self):
+        return type(self), (self.item, self.size)
+
 
 def annotate_values(dictlike):
     """
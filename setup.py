@@ -24,6 +24,9 @@ Merky - compute merkle trees for JSON-friendly data.
     install_requires = [
                 'six >= 1.5',
     ],
+    extras_require = {
+        'numpy': ['numpy'],
+    },
     setup_requires = [
         'nose',
         'mock >= 1.0.1',
@@ -31,5 +34,6 @@ Merky - compute merkle trees for JSON-friendly data.
     tests_require = [
         'nose',
         'mock >= 1.0.1',
+        'futures; python_version < "3"',
     ],
 )